@@ -3,18 +3,27 @@
 import sys
 import json
 import shutil
+import glob
 import os
 
+if sys.version_info < (3, 10):
+    sys.exit('run.py needs Python 3.10 or newer')
 
 sys.path.insert(0, 'src') # add library code to path
 from etl import get_data
-from process_data import process_data
-from conversion import convert_data
+from process_data import (process_data, project_data, concat_data, FULL_VCF,
+                          MODEL_NAME)
+from conversion import convert_data, file_stem
+from scheduler import make_target, run_targets
+from instrument import start_trace, summarize
+from benchmark import run_benchmarks
 
 
 DATA_PARAMS = 'config/data-params.json'
 TEST_PARAMS = 'config/test-params.json'
 CONVERT_PARAMS = 'config/convert-params.json'
+PROJECT_PARAMS = 'config/project-params.json'
+BENCHMARK_PARAMS = 'config/benchmark-params.json'
 
 
 def load_params(fp):
@@ -24,48 +33,115 @@ def load_params(fp):
     return param
 
 
-def main(targets):
+def conversion_outputs(cfg):
+    """
+    Lists files written by the conversion target
     
-    # make the clean target
+    :param cfg: Conversion parameters
+    """
+    
+    def out_fp(fp, ext):
+        return os.path.join(cfg['outdir'], file_stem(fp)+ext)
+    
+    # Scattered calls are gathered into an indexed .vcf.gz
+    vcf_ext = '.vcf.gz' if cfg.get('scatter', 1) > 1 else '.vcf'
+    
+    return ([out_fp(fp, '.bam') for fp in cfg['fastq_bam']] +
+            [out_fp(fp, vcf_ext) for fp in cfg['fastq_vcf'] + cfg['bam_vcf']])
+
+
+
+def project_targets():
+    """
+    Declares project targets, their dependencies, 
+    inputs and outputs
+    """
+    
+    convert_cfg = load_params(CONVERT_PARAMS)['data']
+    data_cfg = load_params(DATA_PARAMS)['data']
+    test_cfg = load_params(TEST_PARAMS)
+    project_cfg = load_params(PROJECT_PARAMS)['data']
+    benchmark_cfg = load_params(BENCHMARK_PARAMS)['data']
+    
+    # Process inputs are the VCF files at inpath
+    inpath = test_cfg['process']['inpath'].replace('\\', '')
+    vcfs = glob.glob(os.path.join(inpath, '*.vcf.gz'))
+    plot_fp = os.path.join(test_cfg['process']['outdir'], 
+                           '1000GenomesPlot.html')
+    model_fp = os.path.join(test_cfg['process']['outdir'], MODEL_NAME)
+    
+    targets = [
+        make_target('convert', lambda: convert_data(**convert_cfg),
+                    inputs=(convert_cfg['fastq_bam'] + convert_cfg['fastq_vcf'] +
+                            convert_cfg['bam_vcf'] + [CONVERT_PARAMS]),
+                    outputs=conversion_outputs(convert_cfg)),
+        make_target('concat', lambda: concat_data(**test_cfg['process']),
+                    deps=['data-test'], inputs=vcfs + [TEST_PARAMS],
+                    outputs=[FULL_VCF], lock='data/temp'),
+        make_target('data', lambda: get_data(**data_cfg)),
+        make_target('data-test', lambda: get_data(**test_cfg['data'])),
+        make_target('process', lambda: process_data(**test_cfg['process']),
+                    deps=['data-test'], inputs=vcfs + [TEST_PARAMS], 
+                    outputs=[plot_fp, model_fp], lock='data/temp'),
+        make_target('test-project', 
+                    lambda: process_data(**test_cfg['process'], test=True),
+                    deps=['data-test'], lock='data/temp'),
+        make_target('project', lambda: project_data(**project_cfg),
+                    deps=['process'],
+                    inputs=project_cfg['vcfs'] + [project_cfg['model'], 
+                                                  PROJECT_PARAMS],
+                    outputs=[os.path.join(project_cfg['outdir'], 
+                                          'projected.csv')]),
+        make_target('benchmark', lambda: run_benchmarks(**benchmark_cfg))
+    ]
+    
+    return {target.name: target for target in targets}
+
+
+
+def main(targets, jobs=1):
+    
+    # make the clean target, before any other target
     if 'clean' in targets:
         shutil.rmtree('data/',ignore_errors=True)
+        targets = [t for t in targets if t != 'clean']
         
-        
-    # make the conversion target
-    if 'convert' in targets:
-        cfg = load_params(CONVERT_PARAMS)['data']
-        convert_data(**cfg)
-        
+    if not targets:
+        return
+    
+    # make the remaining targets and their dependencies, 
+    # tracing the resources each one uses
+    trace_fp = start_trace()
+    success = run_targets(project_targets(), targets, jobs)
+    summarize(trace_fp)
+    
+    if not success:
+        sys.exit(1)
 
-    # make the data target
-    if 'data' in targets:
-        cfg = load_params(DATA_PARAMS)['data']
-        get_data(**cfg)
-        
+    return
 
-    # make the test target
-    if 'data-test' in targets:
-        cfg = load_params(TEST_PARAMS)['data']
-        get_data(**cfg)
 
 
-    # make the process target
-    if 'process' in targets:
-        cfg = load_params(TEST_PARAMS)['process']
-        process_data(**cfg)
-        
-        
-    # make the test project target
-    if 'test-project' in targets:
-        cfg_data = load_params(TEST_PARAMS)['data']
-        get_data(**cfg_data)
-        
-        cfg_process = load_params(TEST_PARAMS)['process']
-        process_data(**cfg_process, test=True)
+def parse_args(args):
+    """
+    Splits command line arguments into targets and the 
+    number of targets to run at once ('-j N' or '--jobs N')
+    """
+    
+    targets, jobs = [], 4
+    args = iter(args)
+    for arg in args:
+        if arg in ('-j', '--jobs'):
+            jobs = int(next(args))
+        elif arg.startswith('--jobs='):
+            jobs = int(arg.split('=', 1)[1])
+        else:
+            targets.append(arg)
+            
+    return targets, jobs
 
-    return
 
 
 if __name__ == '__main__':
-    targets = sys.argv[1:]
-    main(targets)
+    targets, jobs = parse_args(sys.argv[1:])
+    main(targets, jobs)
@@ -0,0 +1,482 @@
+"""  Benchmark Suite
+
+benchmark.py generates seeded synthetic VCF, FASTQ and BAM
+files of a chosen number of samples and variants, times
+every pipeline stage on them while tracking peak memory,
+and compares the results against a stored baseline. Counts
+of what each stage kept are deterministic and always
+checked, while time and memory are only compared on the
+host the baseline was recorded on. Each stage runs in a
+fresh process inside the benchmark's own directory, so the
+pipeline's outputs and cache are never touched.
+
+"""
+
+# Importing libraries
+import pandas as pd
+import numpy as np
+import multiprocessing
+import platform
+import resource
+import pysam
+import time
+import json
+import os
+import process_data as pdata
+from concurrent.futures import ProcessPoolExecutor
+from bgzf import BgzfWriter
+from read_data import read_vcf, read_fastq, read_bam
+from instrument import RSS_BYTES
+
+BASES = np.frombuffer(b'ACGT', dtype=np.uint8)
+GT_STRINGS = np.array(['0|0', '0|1', '1|0', '1|1'])
+CONTIG_LENGTH = 10000000
+
+# Changes below these are treated as noise
+NOISE_FLOOR = {'seconds': 0.1, 'peak_mb': 10.0}
+
+
+
+def write_vcfs(outdir, n_samples, n_variants, n_chroms=2, n_pops=3, seed=0):
+    """
+    Writes synthetic BGZF VCF files, one per chromosome, of
+    samples drawn from populations with drifted allele
+    frequencies so PCA has structure to find
+
+    :param outdir: Directory to write files
+    :param n_samples: Number of samples
+    :param n_variants: Total number of variants
+    :param n_chroms: Number of chromosomes
+    :param n_pops: Number of populations
+    :param seed: Random seed
+    :returns: List of paths to VCF files
+    """
+
+    rng = np.random.default_rng(seed)
+    samples = ['SYN{:06d}'.format(i) for i in range(n_samples)]
+    pops = rng.integers(n_pops, size=n_samples)
+
+    # Drifting population frequencies from ancestral ones
+    ancestral = rng.uniform(0.02, 0.5, size=n_variants)
+    drift = (1 - 0.05) / 0.05
+    freqs = rng.beta((ancestral * drift)[:, None],
+                     ((1 - ancestral) * drift)[:, None],
+                     size=(n_variants, n_pops))
+
+    fps = []
+    bounds = np.linspace(0, n_variants, n_chroms + 1).astype(int)
+    for c in range(n_chroms):
+        chrom = str(c + 1)
+        fp = os.path.join(outdir, 'synthetic_chr{}.vcf.gz'.format(chrom))
+        start, stop = bounds[c], bounds[c+1]
+        positions = np.sort(rng.choice(CONTIG_LENGTH, stop - start,
+                                       replace=False)) + 1
+        alleles = rng.choice(BASES, size=(stop - start, 2))
+        alleles[:, 1] = BASES[(np.searchsorted(BASES, alleles[:, 0]) +
+                               rng.integers(1, 4, stop - start)) % 4]
+
+        with BgzfWriter(fp) as out:
+            out.write(('##fileformat=VCFv4.1\n'
+                       '##contig=<ID={},length={}>\n'
+                       '##FORMAT=<ID=GT,Number=1,Type=String,'
+                       'Description="Genotype">\n'
+                       '#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\t'
+                       'FORMAT\t{}\n').format(chrom, CONTIG_LENGTH,
+                                              '\t'.join(samples)).encode())
+
+            for i in range(start, stop):
+                p = freqs[i, pops]
+                codes = (2 * (rng.random(n_samples) < p) +
+                         (rng.random(n_samples) < p))
+                ref, alt = alleles[i - start].tobytes().decode()
+                line = '{}\t{}\t.\t{}\t{}\t100\tPASS\t.\tGT\t{}\n'.format(
+                    chrom, positions[i - start], ref, alt,
+                    '\t'.join(GT_STRINGS[codes]))
+                out.write(line.encode())
+
+        pysam.tabix_index(fp, preset='vcf', force=True)
+        fps.append(fp)
+
+    return fps
+
+
+
+def write_fastq(fp, n_reads, read_length=100, seed=0):
+    """
+    Writes a synthetic FASTQ file of random reads
+
+    :param fp: Path to FASTQ file
+    :param n_reads: Number of reads
+    :param read_length: Length of each read
+    :param seed: Random seed
+    """
+
+    rng = np.random.default_rng(seed)
+    seqs = BASES[rng.integers(4, size=(n_reads, read_length))]
+    quals = rng.integers(2, 41, size=(n_reads, read_length)) + 33
+
+    with open(fp, 'w') as f:
+        for i in range(n_reads):
+            f.write('@read{}\n{}\n+\n{}\n'.format(
+                i, seqs[i].tobytes().decode(),
+                quals[i].astype(np.uint8).tobytes().decode()))
+
+    return
+
+
+
+def write_bam(fp, n_reads, read_length=100, seed=0):
+    """
+    Writes a synthetic sorted and indexed BAM file of random
+    reads aligned to one contig
+
+    :param fp: Path to BAM file
+    :param n_reads: Number of reads
+    :param read_length: Length of each read
+    :param seed: Random seed
+    """
+
+    rng = np.random.default_rng(seed)
+    starts = np.sort(rng.integers(CONTIG_LENGTH - read_length, size=n_reads))
+    header = {'HD': {'VN': '1.6', 'SO': 'coordinate'},
+              'SQ': [{'SN': '1', 'LN': CONTIG_LENGTH}]}
+    quals = pysam.qualitystring_to_array('I' * read_length)
+
+    with pysam.AlignmentFile(fp, 'wb', header=header) as out:
+        for i, start in enumerate(starts):
+            read = pysam.AlignedSegment()
+            read.query_name = 'read{}'.format(i)
+            read.query_sequence = BASES[rng.integers(4, size=read_length)
+                                        ].tobytes().decode()
+            read.flag = 0
+            read.reference_id = 0
+            read.reference_start = int(start)
+            read.mapping_quality = 60
+            read.cigarstring = '{}M'.format(read_length)
+            read.query_qualities = quals
+            out.write(read)
+
+    pysam.index(fp)
+
+    return
+
+
+
+def run_stage(rundir, func, args):
+    """
+    Helper function for 'measure'. Runs a stage in the
+    benchmark directory, in a fresh worker process
+
+    :returns: Tuple of seconds and peak resident megabytes
+              of this process or any worker it waited for
+    """
+
+    # Starting the stage's own workers as in a pipeline run,
+    # not by spawn as this process was
+    multiprocessing.set_start_method('fork', force=True)
+    os.chdir(rundir)
+    if not os.path.exists('data/temp'):
+        os.makedirs('data/temp')
+
+    start = time.perf_counter()
+    func(*args)
+    seconds = time.perf_counter() - start
+
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+
+    return seconds, peak * RSS_BYTES / 1e6
+
+
+
+def measure(rundir, func, *args):
+    """
+    Runs a stage in a new process, measuring wall time and
+    peak resident memory, worker processes included
+
+    :param rundir: Directory the stage runs in, holding its
+                   'data/temp' outputs
+    :param func: Module-level function running the stage
+    :param args: Arguments of the function
+    :returns: Tuple of seconds and peak megabytes
+    """
+
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+        return pool.submit(run_stage, rundir, func, args).result()
+
+
+
+def concat(vcfs):
+    """
+    Benchmark stage concatenating VCF files
+    """
+
+    with open(pdata.INPUT_LIST, 'w') as f:
+        f.write('\n'.join(vcfs) + '\n')
+    pdata.concat_vcfs()
+
+    return
+
+
+
+def qc(maf, geno, mind):
+    """
+    Benchmark stage computing QC statistics and masks
+    """
+
+    pdata.compute_stats()
+    pdata.filter_vcf(maf, geno, mind)
+
+    return
+
+
+
+def plot(outdir):
+    """
+    Benchmark stage plotting PCs with cluster labels
+    """
+
+    pdata.plot(pd.read_csv(pdata.PCS_FP), outdir,
+               clusters=pd.read_csv(pdata.CLUSTERS_FP))
+
+    return
+
+
+
+def run_scale(n_samples, n_variants, n_reads, workdir, num_pca=3):
+    """
+    Benchmarks every stage at one scale. Pipeline stages run
+    uncached, in the order 'process_data' runs them, with
+    outputs under the scale's own 'data/temp'
+
+    :param n_samples: Number of samples
+    :param n_variants: Number of variants
+    :param n_reads: Number of FASTQ and BAM reads
+    :param workdir: Directory for synthetic files and outputs
+    :param num_pca: Number of principal components
+    :returns: Tuple of list of result dictionaries and the
+              dictionary of stage output counts
+    """
+
+    workdir = os.path.abspath(workdir)
+    if not os.path.exists(workdir):
+        os.makedirs(workdir)
+
+    # Linking sample populations read by clustering and plots
+    references = os.path.join(workdir, 'references')
+    if not os.path.lexists(references):
+        os.symlink(os.path.abspath('references'), references)
+
+    # Generating inputs
+    vcfs = write_vcfs(workdir, n_samples, n_variants)
+    fastq_fp = os.path.join(workdir, 'synthetic.fq')
+    bam_fp = os.path.join(workdir, 'synthetic.bam')
+    write_fastq(fastq_fp, n_reads)
+    write_bam(bam_fp, n_reads)
+
+    stages = [
+        ('read_vcf', read_vcf, vcfs[0]),
+        ('read_fastq', read_fastq, fastq_fp),
+        ('read_bam', read_bam, bam_fp),
+        ('concat', concat, vcfs),
+        ('store', pdata.make_store, vcfs),
+        ('filter', qc, 0.05, 0.1, 0.05),
+        ('ld', pdata.prune_ld, 50, 5, 0.2),
+        ('kinship', pdata.filter_related, 0.0884),
+        ('pca', pdata.run_pca, num_pca),
+        ('cluster', pdata.run_clustering, 3),
+        ('plot', plot, workdir)
+    ]
+
+    results = []
+    scale = '{}x{}'.format(n_samples, n_variants)
+    for name, func, *args in stages:
+        seconds, peak = measure(workdir, func, *args)
+        results.append({'scale': scale, 'stage': name,
+                        'seconds': round(seconds, 4),
+                        'peak_mb': round(peak, 2)})
+        print('  {:<12}{:<12}{:>9.2f}s{:>10.1f} MB'.format(scale, name,
+                                                         seconds, peak))
+
+    return results, stage_outputs(workdir, scale)
+
+
+
+def stage_outputs(workdir, scale):
+    """
+    Counts what the pipeline stages of a scale kept. Inputs
+    are seeded, so the counts are the same on every host
+
+    :param workdir: Directory the stages ran in
+    :param scale: Name of the scale
+    :returns: Dictionary of counts
+    """
+
+    def load(fp, key):
+        with np.load(os.path.join(workdir, fp)) as data:
+            return int(data[key].sum())
+
+    pcs = pd.read_csv(os.path.join(workdir, pdata.PCS_FP))
+    clusters = pd.read_csv(os.path.join(workdir, pdata.CLUSTERS_FP))
+
+    return {'scale': scale,
+            'qc_variants': load(pdata.QC_MASK, 'variants'),
+            'qc_samples': load(pdata.QC_MASK, 'samples'),
+            'ld_variants': load(pdata.LD_MASK, 'variants'),
+            'unrelated_samples': load(pdata.KINSHIP_MASK, 'samples'),
+            'pca_samples': len(pcs),
+            'clusters': {col: int(clusters[col].nunique())
+                         for col in clusters.columns if col != 'Sample'}}
+
+
+
+def host_info():
+    """
+    Describes the machine timings were measured on
+
+    :returns: Dictionary of architecture, CPU model and count
+    """
+
+    cpu = platform.processor()
+    try:
+        with open('/proc/cpuinfo') as f:
+            models = [line.split(':', 1)[1].strip() for line in f
+                      if line.startswith('model name')]
+        cpu = models[0] if models else cpu
+    except OSError:
+        pass
+
+    return {'machine': platform.machine(), 'cpu': cpu,
+            'cpus': os.cpu_count()}
+
+
+
+def compare(results, baseline, tolerance=0.5):
+    """
+    Compares results against a baseline. Stages missing
+    from the baseline are reported too, as they could
+    never fail the check
+
+    :param results: List of result dictionaries
+    :param baseline: List of baseline result dictionaries
+    :param tolerance: Allowed relative increase of time
+                      and memory, beyond NOISE_FLOOR
+    :returns: List of regression descriptions
+    """
+
+    base = {(r['scale'], r['stage']): r for r in baseline}
+
+    regressions = []
+    for result in results:
+        old = base.get((result['scale'], result['stage']))
+        if old is None:
+            regressions.append('{} {}: no baseline, rerun with '
+                               'update_baseline'.format(result['scale'],
+                                                        result['stage']))
+            continue
+        for metric in ['seconds', 'peak_mb']:
+            increase = result[metric] - old[metric]
+            if (increase > old[metric] * tolerance and 
+                increase > NOISE_FLOOR[metric]):
+                regressions.append('{} {} {}: {} -> {}'.format(
+                    result['scale'], result['stage'], metric,
+                    old[metric], result[metric]))
+
+    return regressions
+
+
+
+def compare_outputs(outputs, baseline):
+    """
+    Compares stage output counts against a baseline, which
+    must match exactly
+
+    :param outputs: List of output count dictionaries
+    :param baseline: List of baseline output count dictionaries
+    :returns: List of mismatch descriptions
+    """
+
+    base = {o['scale']: o for o in baseline}
+
+    mismatches = []
+    for output in outputs:
+        old = base.get(output['scale'])
+        if old is None:
+            mismatches.append('{}: no baseline outputs, rerun with '
+                              'update_baseline'.format(output['scale']))
+            continue
+        for key, value in output.items():
+            if old.get(key) != value:
+                mismatches.append('{} {}: {} -> {}'.format(
+                    output['scale'], key, old.get(key), value))
+
+    return mismatches
+
+
+
+# ---------------------------------------------------------------------
+# Driver Function
+# ---------------------------------------------------------------------
+
+
+def run_benchmarks(scales, outdir, baseline, tolerance=0.5,
+                   update_baseline=False, **kwargs):
+    """
+    Benchmarks the pipeline at several scales, writes the
+    results and checks them against the baseline. Time and
+    memory are only compared when the baseline was recorded
+    on a host like this one
+
+    :param scales: List of dictionaries of 'samples',
+                   'variants' and 'reads' counts
+    :param outdir: Directory to write synthetic data and results
+    :param baseline: Path to baseline results
+    :param tolerance: Allowed relative increase of time and memory
+    :param update_baseline: Whether to replace the baseline
+    """
+
+    # Creating out directory
+    if not os.path.exists(outdir):
+        os.makedirs(outdir)
+
+    print('***benchmark***')
+    results, outputs = [], []
+    for scale in scales:
+        workdir = os.path.join(outdir, '{}x{}'.format(scale['samples'],
+                                                      scale['variants']))
+        stages, counts = run_scale(scale['samples'], scale['variants'],
+                                   scale['reads'], workdir)
+        results += stages
+        outputs.append(counts)
+
+    run = {'host': host_info(), 'stages': results, 'outputs': outputs}
+    results_fp = os.path.join(outdir, 'results.json')
+    with open(results_fp, 'w') as f:
+        json.dump(run, f, indent=1)
+
+    # Replacing or checking against the baseline
+    if update_baseline or not os.path.exists(baseline):
+        with open(baseline, 'w') as f:
+            json.dump(run, f, indent=1)
+        print('***baseline saved at {}***'.format(baseline))
+        return
+
+    with open(baseline) as f:
+        base = json.load(f)
+
+    regressions = compare_outputs(outputs, base['outputs'])
+    if base['host'] == run['host']:
+        regressions += compare(results, base['stages'], tolerance)
+    else:
+        print('***baseline recorded on {}, skipping time and memory '
+              'checks***'.format(base['host']))
+
+    if regressions:
+        raise RuntimeError('Benchmark regressions beyond {:.0%}, changed '
+                           'outputs or missing baselines:\n{}'.format(
+                               tolerance, '\n'.join(regressions)))
+
+    print('***benchmark passed, results saved at {}***'.format(results_fp))
+
+    return
@@ -0,0 +1,207 @@
+"""  BGZF Blocks
+
+bgzf.py reads and writes BGZF, the blocked gzip format of
+tabix-indexed VCF files. Blocks can be copied as-is between
+files or compressed in parallel, as zlib releases the GIL.
+
+"""
+
+# Importing libraries
+import struct
+import zlib
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# Empty block marking the end of a BGZF file
+BGZF_EOF = bytes.fromhex('1f8b08040000000000ff0600424302001b00'
+                         '03000000000000000000')
+
+# Uncompressed bytes per block, as used by htslib
+MAX_BLOCK_DATA = 0xff00
+
+
+
+def is_bgzf(fp):
+    """
+    Checks whether a file is BGZF compressed
+
+    :param fp: Path to file
+    :returns: Boolean
+    """
+
+    with open(fp, 'rb') as f:
+        header = f.read(16)
+
+    return (len(header) == 16 and header[:4] == b'\x1f\x8b\x08\x04' and
+            header[12:14] == b'BC')
+
+
+
+def read_blocks(f):
+    """
+    Iterates over raw BGZF blocks of a file
+
+    :param f: Binary file handle
+    :returns: Generator of block bytes, header to trailer
+    """
+
+    while True:
+        header = f.read(18)
+        if not header:
+            return
+        if len(header) < 18 or header[12:14] != b'BC':
+            raise ValueError('Invalid BGZF block header')
+
+        block_size = struct.unpack('<H', header[16:18])[0] + 1
+        yield header + f.read(block_size - 18)
+
+
+
+def block_length(block):
+    """
+    Reads the uncompressed length of a raw BGZF block
+
+    :param block: Block bytes
+    :returns: Number of uncompressed bytes
+    """
+
+    return struct.unpack('<I', block[-4:])[0]
+
+
+
+def decompress_block(block):
+    """
+    Decompresses a raw BGZF block
+
+    :param block: Block bytes
+    :returns: Uncompressed bytes
+    """
+
+    return zlib.decompress(block[18:-8], -15)
+
+
+
+def compress_block(data, level=6):
+    """
+    Compresses data into one BGZF block
+
+    :param data: At most MAX_BLOCK_DATA bytes
+    :param level: zlib compression level
+    :returns: Block bytes
+    """
+
+    deflate = zlib.compressobj(level, zlib.DEFLATED, -15)
+    payload = deflate.compress(data) + deflate.flush()
+
+    header = struct.pack('<4BI2BH2BHH', 0x1f, 0x8b, 8, 4, 0, 0, 0xff,
+                         6, ord('B'), ord('C'), 2, len(payload) + 25)
+    trailer = struct.pack('<2I', zlib.crc32(data), len(data))
+
+    return header + payload + trailer
+
+
+
+class BgzfWriter:
+    """
+    Writes a BGZF file, compressing blocks on a thread pool
+    while keeping them in order, and copying already
+    compressed blocks through untouched
+    """
+
+    def __init__(self, fp, threads=None, level=6):
+        """
+        :param fp: Path to output file
+        :param threads: Number of compression threads
+                        (default all cores)
+        :param level: zlib compression level
+        """
+
+        self.fp = fp
+        self.file = open(fp, 'wb')
+        self.threads = threads or os.cpu_count()
+        self.level = level
+        self.pool = ThreadPoolExecutor(max_workers=self.threads)
+        self.pending = deque()
+        self.buffer = bytearray()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        # A file cut short by an error must not look complete
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def _drain(self, limit):
+        # Writing finished blocks in submission order
+        while len(self.pending) > limit:
+            self.file.write(self.pending.popleft().result())
+
+    def _submit(self, data):
+        self.pending.append(self.pool.submit(compress_block, data,
+                                             self.level))
+        self._drain(self.threads * 4)
+
+    def write(self, data):
+        """
+        Buffers uncompressed data, compressing full blocks
+
+        :param data: Bytes to write
+        """
+
+        self.buffer += data
+        while len(self.buffer) >= MAX_BLOCK_DATA:
+            self._submit(bytes(self.buffer[:MAX_BLOCK_DATA]))
+            del self.buffer[:MAX_BLOCK_DATA]
+
+    def flush(self):
+        """
+        Compresses any buffered data into a final partial block
+        """
+
+        if self.buffer:
+            self._submit(bytes(self.buffer))
+            self.buffer = bytearray()
+
+    def write_block(self, block):
+        """
+        Copies a raw BGZF block, after any buffered data
+
+        :param block: Block bytes
+        """
+
+        self.flush()
+        self._drain(0)
+        self.file.write(block)
+
+    def close(self):
+        """
+        Writes remaining blocks and the EOF marker
+        """
+
+        if self.file.closed:
+            return
+
+        self.flush()
+        self._drain(0)
+        self.file.write(BGZF_EOF)
+        self.file.close()
+        self.pool.shutdown()
+
+    def abort(self):
+        """
+        Drops pending blocks and deletes the partial output,
+        without writing the EOF marker
+        """
+
+        if self.file.closed:
+            return
+
+        self.pool.shutdown(cancel_futures=True)
+        self.pending.clear()
+        self.file.close()
+        if os.path.exists(self.fp):
+            os.remove(self.fp)
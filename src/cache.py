@@ -0,0 +1,219 @@
+"""  Stage Cache
+
+cache.py keeps pipeline artifacts in a content-addressed
+cache directory. Stages are keyed on their parameters, the
+identity of their input files and the keys of the stages
+they depend on, so a stage only re-runs when something it
+depends on changed. Outputs are copied in and out of the
+cache, and checked against their stored digests before
+they are restored.
+
+"""
+
+# Importing libraries
+import hashlib
+import shutil
+import json
+import os
+
+CACHE_DIR = 'data/cache'
+DIGESTS = 'digests.json'
+
+
+
+def file_identity(fp, checksum=False):
+    """
+    Identifies a file by size and modification time,
+    or by content
+
+    :param fp: Path to file
+    :param checksum: Whether to hash file content instead
+    :returns: List identifying the file
+    """
+
+    if checksum:
+        digest = hashlib.sha256()
+        with open(fp, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+        return [os.path.basename(fp), digest.hexdigest()]
+
+    stat = os.stat(fp)
+
+    return [os.path.basename(fp), stat.st_size, stat.st_mtime_ns]
+
+
+
+def stage_key(name, params=None, inputs=(), parents=(), checksum=False):
+    """
+    Computes the cache key of a stage
+
+    :param name: Name of stage
+    :param params: Dictionary of parameters affecting outputs
+    :param inputs: List of paths to input files
+    :param parents: List of keys of upstream stages
+    :param checksum: Whether to identify inputs by content
+    :returns: Hex digest
+    """
+
+    description = {'stage': name, 'params': params or {},
+                   'inputs': [file_identity(fp, checksum) for fp in inputs],
+                   'parents': list(parents)}
+    encoded = json.dumps(description, sort_keys=True, default=str)
+
+    return hashlib.sha256(encoded.encode()).hexdigest()
+
+
+
+def copy_file(src, dst):
+    """
+    Copies a file through a temporary file renamed into
+    place, so the destination is never partially written
+    and files linked to an old destination are untouched
+
+    :param src: Path to existing file
+    :param dst: Path to new file, replaced if it exists
+    """
+
+    tmp = dst+'.tmp'
+    shutil.copy2(src, tmp)
+    os.replace(tmp, dst)
+
+    return
+
+
+
+def digest(fp):
+    """
+    Helper function. Identifies a file by size and content
+
+    :param fp: Path to file
+    :returns: List of size and SHA-256 digest
+    """
+
+    return [os.path.getsize(fp), file_identity(fp, checksum=True)[1]]
+
+
+
+def cache_lookup(key, outputs, cache_dir=CACHE_DIR):
+    """
+    Restores outputs of a cached stage
+
+    :param key: Stage key from 'stage_key'
+    :param outputs: List of paths the stage writes
+    :param cache_dir: Cache directory
+    :returns: Boolean whether the key was found
+    """
+
+    entry = os.path.join(cache_dir, key)
+    cached = [os.path.join(entry, os.path.basename(fp)) for fp in outputs]
+    digests_fp = os.path.join(entry, DIGESTS)
+    if not all(os.path.exists(fp) for fp in cached + [digests_fp]):
+        return False
+
+    # Dropping entries changed since they were stored
+    with open(digests_fp) as f:
+        digests = json.load(f)
+    if any(digests.get(os.path.basename(fp)) != digest(fp) for fp in cached):
+        print('***cache entry {} is corrupt, removing***'.format(key))
+        shutil.rmtree(entry, ignore_errors=True)
+        return False
+
+    for src, dst in zip(cached, outputs):
+        copy_file(src, dst)
+
+    # Marking entry as recently used
+    os.utime(entry)
+
+    return True
+
+
+
+def cache_store(key, outputs, cache_dir=CACHE_DIR, max_bytes=None):
+    """
+    Stores outputs of a stage, evicting least recently
+    used entries beyond the size limit
+
+    :param key: Stage key from 'stage_key'
+    :param outputs: List of paths the stage wrote
+    :param cache_dir: Cache directory
+    :param max_bytes: Size limit of cache directory
+    """
+
+    entry = os.path.join(cache_dir, key)
+    partial = entry+'.partial'
+    shutil.rmtree(partial, ignore_errors=True)
+    os.makedirs(partial)
+
+    digests = {}
+    for fp in outputs:
+        copy_file(fp, os.path.join(partial, os.path.basename(fp)))
+        digests[os.path.basename(fp)] = digest(fp)
+    with open(os.path.join(partial, DIGESTS), 'w') as f:
+        json.dump(digests, f)
+
+    shutil.rmtree(entry, ignore_errors=True)
+    os.rename(partial, entry)
+
+    if max_bytes is not None:
+        evict(cache_dir, max_bytes, keep=key)
+
+    return
+
+
+
+def evict(cache_dir, max_bytes, keep=None):
+    """
+    Removes least recently used entries until the cache
+    fits the size limit
+
+    :param cache_dir: Cache directory
+    :param max_bytes: Size limit of cache directory
+    :param keep: Key never to evict
+    """
+
+    entries = []
+    for key in os.listdir(cache_dir):
+        entry = os.path.join(cache_dir, key)
+        size = sum(os.path.getsize(os.path.join(entry, f))
+                   for f in os.listdir(entry))
+        entries.append((os.path.getmtime(entry), size, key))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, key in sorted(entries):
+        if total <= max_bytes:
+            break
+        if key != keep:
+            shutil.rmtree(os.path.join(cache_dir, key))
+            total -= size
+
+    return
+
+
+
+def cached_stage(name, func, outputs, params=None, inputs=(), parents=(),
+                 cache_dir=CACHE_DIR, max_bytes=None):
+    """
+    Runs a stage unless its outputs are cached
+
+    :param name: Name of stage
+    :param func: Function without arguments running the stage
+    :param outputs: List of paths the stage writes
+    :param params: Dictionary of parameters affecting outputs
+    :param inputs: List of paths to input files
+    :param parents: List of keys of upstream stages
+    :param cache_dir: Cache directory
+    :param max_bytes: Size limit of cache directory
+    :returns: Stage key, for use by downstream stages
+    """
+
+    key = stage_key(name, params, inputs, parents)
+
+    if cache_lookup(key, outputs, cache_dir):
+        print('***{} restored from cache***'.format(name))
+        return key
+
+    func()
+    cache_store(key, outputs, cache_dir, max_bytes)
+
+    return key
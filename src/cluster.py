@@ -0,0 +1,298 @@
+"""  Sample Clustering
+
+cluster.py clusters samples on their principal components
+with mini-batch k-means and a diagonal Gaussian mixture,
+each restarted from several seeds in parallel, and scores
+clusterings against known populations.
+
+"""
+
+# Importing libraries
+import numpy as np
+import os
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+KMeansResult = namedtuple('KMeansResult', ['labels', 'centers', 'inertia'])
+GMMResult = namedtuple('GMMResult', ['labels', 'weights', 'means', 'variances',
+                                     'loglik'])
+
+# Variance floor keeping mixture components from collapsing,
+# relative to the variance of each dimension
+MIN_VAR = 1e-6
+
+
+
+def sq_distances(X, centers):
+    """
+    Squared Euclidean distances of points to centers
+
+    :param X: Array of points (n x d)
+    :param centers: Array of centers (k x d)
+    :returns: Array (n x k)
+    """
+
+    dist = ((X ** 2).sum(axis=1)[:, None] - 2 * X @ centers.T +
+            (centers ** 2).sum(axis=1)[None, :])
+
+    return np.maximum(dist, 0)
+
+
+
+def kmeans_pp(X, k, rng):
+    """
+    Chooses initial centers by k-means++ seeding
+
+    :param X: Array of points (n x d)
+    :param k: Number of clusters
+    :param rng: NumPy random generator
+    :returns: Array of centers (k x d)
+    """
+
+    centers = [X[rng.integers(len(X))]]
+    closest = sq_distances(X, centers[0][None, :])[:, 0]
+    for _ in range(1, k):
+        total = closest.sum()
+        probs = closest / total if total > 0 else None
+        centers.append(X[rng.choice(len(X), p=probs)])
+        closest = np.minimum(closest,
+                             sq_distances(X, centers[-1][None, :])[:, 0])
+
+    return np.array(centers)
+
+
+
+def minibatch_kmeans(X, k, batch_size=1024, n_iter=100, seed=0):
+    """
+    Runs mini-batch k-means. Each step moves centers
+    towards the mean of their points in a random batch,
+    with per-center learning rates decaying by count
+
+    :param X: Array of points (n x d)
+    :param k: Number of clusters
+    :param batch_size: Number of points per step
+    :param n_iter: Number of steps
+    :param seed: Random seed
+    :returns: KMeansResult of labels, centers and inertia
+    """
+
+    rng = np.random.default_rng(seed)
+    seed_points = X[rng.choice(len(X), min(len(X), 10 * batch_size),
+                               replace=False)]
+    centers = kmeans_pp(seed_points, k, rng)
+    counts = np.zeros(k)
+
+    for _ in range(n_iter):
+        batch = X[rng.integers(len(X), size=min(batch_size, len(X)))]
+        nearest = sq_distances(batch, centers).argmin(axis=1)
+
+        # Summing batch points per center at once
+        sums = np.zeros_like(centers)
+        np.add.at(sums, nearest, batch)
+        batch_counts = np.bincount(nearest, minlength=k)
+
+        counts += batch_counts
+        moved = batch_counts > 0
+        rate = batch_counts[moved] / counts[moved]
+        centers[moved] += rate[:, None] * (sums[moved] /
+                                           batch_counts[moved, None] -
+                                           centers[moved])
+
+    dist = sq_distances(X, centers)
+    labels = dist.argmin(axis=1)
+    inertia = dist[np.arange(len(X)), labels].sum()
+
+    return KMeansResult(labels, centers, inertia)
+
+
+
+def log_responsibilities(X, weights, means, variances):
+    """
+    Helper function for 'gmm_diag'. Computes the E-step of
+    a diagonal Gaussian mixture in log space
+
+    :param X: Array of points (n x d)
+    :param weights: Component weights (k)
+    :param means: Component means (k x d)
+    :param variances: Component variances (k x d)
+    :returns: Tuple of log responsibilities (n x k) and
+              log-likelihood of each point
+    """
+
+    log_prob = (np.log(weights)[None, :] -
+                0.5 * np.log(2 * np.pi * variances).sum(axis=1)[None, :] -
+                0.5 * ((X ** 2) @ (1 / variances).T -
+                       2 * X @ (means / variances).T +
+                       ((means ** 2) / variances).sum(axis=1)[None, :]))
+    peak = log_prob.max(axis=1, keepdims=True)
+    norm = peak[:, 0] + np.log(np.exp(log_prob - peak).sum(axis=1))
+
+    return log_prob - norm[:, None], norm
+
+
+
+def gmm_diag(X, k, n_iter=200, tol=1e-6, max_fit=100000, seed=0):
+    """
+    Fits a Gaussian mixture with diagonal covariances by
+    expectation-maximization, started from mini-batch k-means.
+    Larger inputs are fit on a random subset of points and
+    only labelled in full
+
+    :param X: Array of points (n x d)
+    :param k: Number of components
+    :param n_iter: Maximum number of EM iterations
+    :param tol: Change of mean log-likelihood to stop at
+    :param max_fit: Maximum number of points fit on
+    :param seed: Random seed
+    :returns: GMMResult of labels, weights, means, variances
+              and total log-likelihood
+    """
+
+    init = minibatch_kmeans(X, k, seed=seed)
+    fit = X
+    if len(X) > max_fit:
+        rng = np.random.default_rng(seed)
+        fit = X[rng.choice(len(X), max_fit, replace=False)]
+
+    # Flooring variances relative to the data, since unit-norm
+    # PCs of n samples have variances of about 1/n
+    spread = fit.var(axis=0)
+    floor = np.where(spread > 0, MIN_VAR * spread, MIN_VAR)
+
+    means = init.centers.copy()
+    variances = np.tile(np.maximum(spread, floor), (k, 1))
+    weights = np.full(k, 1 / k)
+    previous = -np.inf
+
+    for _ in range(n_iter):
+        log_resp, norm = log_responsibilities(fit, weights, means, variances)
+        if norm.mean() - previous < tol:
+            break
+        previous = norm.mean()
+
+        # M-step
+        resp = np.exp(log_resp)
+        totals = resp.sum(axis=0) + 1e-12
+        weights = totals / len(fit)
+        means = (resp.T @ fit) / totals[:, None]
+        variances = np.maximum((resp.T @ fit ** 2) / totals[:, None] -
+                               means ** 2, floor)
+
+    log_resp, norm = log_responsibilities(X, weights, means, variances)
+
+    return GMMResult(log_resp.argmax(axis=1), weights, means, variances,
+                     norm.sum())
+
+
+
+class SeededFit:
+    """
+    Clustering function applied to fixed data for a given
+    seed, picklable for use in worker processes
+    """
+
+    def __init__(self, func, X, k, kwargs):
+        self.func, self.X, self.k, self.kwargs = func, X, k, kwargs
+
+    def __call__(self, seed):
+        return self.func(self.X, self.k, seed=seed, **self.kwargs)
+
+
+
+def best_of(func, X, k, restarts=8, jobs=None, **kwargs):
+    """
+    Runs a clustering from several seeds in parallel worker
+    processes, keeping the best fit
+
+    :param func: 'minibatch_kmeans' or 'gmm_diag'
+    :param X: Array of points (n x d)
+    :param k: Number of clusters
+    :param restarts: Number of seeds
+    :param jobs: Number of worker processes (default CPU count)
+    :returns: Result with the lowest inertia or highest
+              log-likelihood
+    """
+
+    with ProcessPoolExecutor(max_workers=jobs or
+                             min(restarts, os.cpu_count())) as pool:
+        results = list(pool.map(SeededFit(func, X, k, kwargs),
+                                range(restarts)))
+
+    if func is minibatch_kmeans:
+        return min(results, key=lambda r: r.inertia)
+
+    return max(results, key=lambda r: r.loglik)
+
+
+
+def contingency(labels, truth):
+    """
+    Helper function. Counts samples per pair of cluster
+    and true group
+
+    :param labels: Array of cluster labels
+    :param truth: Array of true groups
+    :returns: Array (clusters x groups)
+    """
+
+    _, label_idx = np.unique(labels, return_inverse=True)
+    _, truth_idx = np.unique(truth, return_inverse=True)
+    table = np.zeros((label_idx.max() + 1, truth_idx.max() + 1))
+    np.add.at(table, (label_idx, truth_idx), 1)
+
+    return table
+
+
+
+def adjusted_rand(labels, truth):
+    """
+    Adjusted Rand index of a clustering
+
+    :param labels: Array of cluster labels
+    :param truth: Array of true groups
+    :returns: Float, 1 for identical partitions, about 0
+              for random ones
+    """
+
+    table = contingency(labels, truth)
+
+    def pairs(x):
+        return (x * (x - 1) / 2).sum()
+
+    index = pairs(table)
+    rows, cols = pairs(table.sum(axis=1)), pairs(table.sum(axis=0))
+    expected = rows * cols / max(pairs(np.array([table.sum()])), 1)
+    maximum = (rows + cols) / 2
+
+    if maximum == expected:
+        return 1.0
+
+    return (index - expected) / (maximum - expected)
+
+
+
+def normalized_mutual_info(labels, truth):
+    """
+    Normalized mutual information of a clustering,
+    using the arithmetic mean of entropies
+
+    :param labels: Array of cluster labels
+    :param truth: Array of true groups
+    :returns: Float between 0 and 1
+    """
+
+    table = contingency(labels, truth) / len(labels)
+    p_label, p_truth = table.sum(axis=1), table.sum(axis=0)
+
+    nonzero = table > 0
+    mutual = (table[nonzero] * np.log(table[nonzero] /
+              np.outer(p_label, p_truth)[nonzero])).sum()
+
+    def entropy(p):
+        return -(p[p > 0] * np.log(p[p > 0])).sum()
+
+    mean_entropy = (entropy(p_label) + entropy(p_truth)) / 2
+    if mean_entropy == 0:
+        return 1.0
+
+    return mutual / mean_entropy
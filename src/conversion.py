@@ -1,220 +1,402 @@
 """ File Converter
 
 conversion.py contains functions that allow the
-conversion of FASTQ files to BAM, BAM to VCF, or 
-FASTQ straight to a VCF file.
+conversion of FASTQ files to BAM, BAM to VCF, or
+FASTQ straight to a VCF file. Each file is converted
+by its own asyncio task, inside its own scratch
+directory, running tools through a shared 'runner.Runner'
+that limits how many of each run at once.
 
 """
 
 # Importing libraries
-import subprocess as sp
+import instrument
+import asyncio
 import shutil
+import pysam
 import os
+from runner import Runner
+from reference import prep_reference, scatter_intervals
 
-REF_ROOT = 'Homo_sapiens_assembly38.fasta'
 #PICARD = 'references/picard.jar'
 R_GROUP = "@RG\\tID:group1\\tSM:Sample\\tPL:illumina\\tLB:lib1\\tPU:unit1"
 
+SH_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                       'conversion.sh')
+TEMP = os.path.abspath('data/temp')
 
+# Input extensions stripped from names of jobs and outputs
+EXTENSIONS = ('.fastq.gz', '.fq.gz', '.fastq', '.fq', '.bam')
 
-def fastq_to_bam(fps, outdir, full=False, temp_kp=False):
+
+
+def file_stem(fp):
+    """
+    Helper function. Strips directories and the input
+    extension from a file path, keeping the rest of the
+    name so files of the same sample stay apart.
+
+    :param fp: Path to input file
+    :returns: File stem
+    """
+
+    name = os.path.basename(fp)
+    for ext in EXTENSIONS:
+        if name.endswith(ext):
+            return name[:-len(ext)]
+
+    return name
+
+
+
+def scratch_dir(fp):
+    """
+    Helper function. Creates the scratch directory for the
+    job converting a file, keeping files of an earlier
+    attempt so it can resume.
+
+    :param fp: Path to input file
+    :returns: Absolute path to scratch directory
+    """
+
+    scratch = os.path.join(TEMP, 'jobs', file_stem(fp))
+    if not os.path.exists(scratch):
+        os.makedirs(scratch)
+
+    return scratch
+
+
+
+async def map_fastq(runner, fp, ref, scratch, threads=1):
+    """
+    Maps a FASTQ file to the reference, creating a sorted BAM
+
+    :param runner: Runner of commands
+    :param fp: Path to FASTQ file
+    :param ref: Absolute path to reference FASTA
+    :param scratch: Scratch directory of the job
+    :param threads: Number of BWA threads
+    :returns: Path to BAM file in scratch directory
+    """
+
+    name = file_stem(fp)
+    sam_path = os.path.join(scratch, name+'.sam')
+    bam_path = os.path.join(scratch, name+'.bam')
+
+    # Mapping FASTQs to reference file to create SAM
+    await runner.run(['sh', SH_PATH, 'mapper', R_GROUP, ref, 
+                      os.path.abspath(fp), sam_path, str(threads)])
+
+    # Converting SAM to BAM
+    await runner.run(['sh', SH_PATH, 'sam_bam', sam_path, bam_path])
+    os.remove(sam_path)
+
+    return bam_path
+
+
+
+async def call_variants(runner, fp, ref, scratch, threads=1, scatter=1):
+    """
+    Calls variants of a BAM file. When scattered, each
+    interval of the reference is called separately, 'threads'
+    intervals at a time, and intervals already called by an
+    earlier attempt are skipped
+
+    :param runner: Runner of commands
+    :param fp: Path to BAM file
+    :param ref: Absolute path to reference FASTA
+    :param scratch: Scratch directory of the job
+    :param threads: Number of GATK pair-HMM threads, or of
+                    intervals called at once when scattered
+    :param scatter: Number of intervals to call separately
+    :returns: Path to VCF file in scratch directory
+    """
+
+    name = file_stem(fp)
+    bam_path = os.path.join(scratch, name+'.bam')
+
+    # Linking BAM into scratch so its index is written there
+    if os.path.abspath(fp) != bam_path:
+        if os.path.lexists(bam_path):
+            os.remove(bam_path)
+        os.symlink(os.path.abspath(fp), bam_path)
+
+    # Creating index for BAM files
+    await runner.run(['sh', SH_PATH, 'index_bam', bam_path, bam_path])
+
+    # Converting BAM to VCF
+    if scatter <= 1:
+        vcf_path = os.path.join(scratch, name+'.vcf')
+        await runner.run(['sh', SH_PATH, 'haplotype', ref, bam_path, vcf_path,
+                          str(threads)])
+        return vcf_path
+
+    vcf_path = os.path.join(scratch, name+'.vcf.gz')
+    intervals = scatter_intervals(ref, scatter)
+    parts = [os.path.join(scratch, 'part_{:04d}.vcf.gz'.format(i))
+             for i in range(len(intervals))]
+
+    limit = asyncio.Semaphore(threads)
+
+    async def call(interval, part):
+        async with limit:
+            return await call_interval(runner, interval, part, ref, bam_path)
+
+    called = await asyncio.gather(*map(call, intervals, parts))
+    failed = [part for part, ok in zip(parts, called) if not ok]
+
+    if failed:
+        raise RuntimeError('HaplotypeCaller failed on {} of {} intervals of '
+                           '{}, rerun to resume: {}'.format(
+                               len(failed), len(parts), fp, failed))
+
+    # Gathering intervals in reference order, indexing
+    if os.path.exists(vcf_path):
+        os.remove(vcf_path)
+    await runner.run(['sh', SH_PATH, 'gather_vcfs', vcf_path] + parts)
+    await asyncio.to_thread(pysam.tabix_index, vcf_path, preset='vcf', 
+                            force=True)
+
+    return vcf_path
+
+
+
+async def call_interval(runner, interval, part, ref, bam_path):
+    """
+    Helper function for 'call_variants'. Calls variants
+    on one interval, unless an earlier attempt finished it.
+
+    :param runner: Runner of commands
+    :param interval: List of (contig, start, end) segments
+    :param part: Path to VCF file of interval
+    :param ref: Absolute path to reference FASTA
+    :param bam_path: Path to indexed BAM file
+    :returns: Boolean whether the interval was called
+    """
+
+    done = part+'.done'
+    if os.path.exists(done):
+        return True
+
+    bed = part.replace('.vcf.gz', '.bed')
+    with open(bed, 'w') as f:
+        for segment in interval:
+            f.write('{}\t{}\t{}\n'.format(*segment))
+
+    code = await runner.run(['sh', SH_PATH, 'haplotype_interval', ref, 
+                             bam_path, part, bed], check=False)
+    if code != 0:
+        return False
+
+    open(done, 'w').close()
+
+    return True
+
+
+
+async def convert_file(runner, fp, outdir, ref, steps, threads=1, scatter=1):
+    """
+    Job converting one file
+
+    :param runner: Runner of commands
+    :param fp: Path to input file
+    :param outdir: Directory to write out converted file
+    :param ref: Absolute path to reference FASTA
+    :param steps: 'fastq_bam', 'fastq_vcf' or 'bam_vcf'
+    :param threads: Number of threads of each tool
+    :param scatter: Number of intervals variants are called on
+    :returns: Path to converted file
+    """
+
+    scratch = scratch_dir(fp)
+
+    out_fp = fp
+    if steps.startswith('fastq'):
+        out_fp = await map_fastq(runner, out_fp, ref, scratch, threads)
+    if steps.endswith('vcf'):
+        out_fp = await call_variants(runner, out_fp, ref, scratch, threads, 
+                                     scatter)
+
+    # Writes to out directory, cleans out scratch directory
+    dest = os.path.join(outdir, os.path.basename(out_fp))
+    shutil.move(out_fp, dest)
+    if os.path.exists(out_fp+'.tbi'):
+        shutil.move(out_fp+'.tbi', dest+'.tbi')
+    shutil.rmtree(scratch, ignore_errors=True)
+
+    return dest
+
+
+
+async def convert_group(runner, fps, outdir, ref, steps, jobs=1, threads=1,
+                        scatter=1):
+    """
+    Converts files concurrently, one job per file, in the
+    running event loop. The first failing command fails
+    the conversion, and commands of other jobs are killed
+
+    :param runner: Runner of commands
+    :param fps: List of paths to input files
+    :param outdir: Absolute path to output directory
+    :param ref: Absolute path to reference FASTA
+    :param steps: 'fastq_bam', 'fastq_vcf' or 'bam_vcf'
+    :param jobs: Number of files converted at once
+    :param threads: Number of threads of each job
+    :param scatter: Number of intervals variants are called on
+    :returns: List of paths to converted files
+    """
+
+    # Jobs of files with the same stem would share scratch
+    # directories and outputs
+    stems = [file_stem(fp) for fp in fps]
+    duplicates = sorted({stem for stem in stems if stems.count(stem) > 1})
+    if duplicates:
+        raise ValueError('Input files share names {}'.format(duplicates))
+
+    limit = asyncio.Semaphore(jobs)
+
+    async def job(fp):
+        async with limit:
+            return await convert_file(runner, fp, outdir, ref, steps, 
+                                      threads, scatter)
+
+    with instrument.stage(steps):
+        out_fps = await asyncio.gather(*map(job, fps))
+
+    return out_fps
+
+
+
+def convert_files(fps, outdir, steps, jobs=1, threads=1, scatter=1,
+                  runner=None):
+    """
+    Converts files concurrently, one job per file
+
+    :param fps: List of paths to input files
+    :param outdir: Path to output directory
+    :param steps: 'fastq_bam', 'fastq_vcf' or 'bam_vcf'
+    :param jobs: Number of files converted at once
+    :param threads: Number of threads of each job
+    :param scatter: Number of intervals variants are called on
+    :param runner: Runner of commands (default one with 
+                   TOOL_LIMITS and no retries)
+    :returns: List of paths to converted files
+    """
+
+    # Prepare reference shared by all jobs
+    ref = prep_reference(bwa=steps.startswith('fastq'), gaps=scatter > 1)
+
+    return asyncio.run(convert_group(runner or Runner(), fps, 
+                                     os.path.abspath(outdir), ref, steps, 
+                                     jobs, threads, scatter))
+
+
+
+def fastq_to_bam(fps, outdir, jobs=1, threads=1, runner=None):
     """
     Converts FASTQ file to BAM
-    
+
     :param fps: List of paths to FASTQ files
     :param outdir: Path to output file
-    :param full: Boolean whether it is a full 
-                 conversion
-    :param temp_kp: Whether to leave files in temp
-                    directory. Used for full conversion.
-    """
-    
-    # Prepare temp directory if not full 
-    # FASTQ->VCF conversion
-    if not full:
-        prep_directory(fps, outdir, ftype='fastq')
-    
-    # Changing to temp directory
-    temp = 'data/temp'
-    os.chdir(temp)
-    
-    # Defining new filepaths 
-    new_outdir = '../../'+outdir
-    #new_picard = '../../'+PICARD
-    sh_path = '../../src/conversion.sh'
-    
-    for file in fps:
-        filename = file.split('/')[-1]
-        filename_wo_ext = filename.split('.')[0]
-        sam_path = filename_wo_ext+'.sam'
-        bam_path = filename_wo_ext+'.bam'
-        
-        # Mapping FASTQs to reference file to create SAM
-        sp.call(['sh', sh_path, 'mapper', R_GROUP, REF_ROOT, filename, sam_path])
-        
-        # Converting SAM to BAM
-        sp.call(['sh', sh_path, 'sam_bam', sam_path, bam_path])
-    
-        # Writes to out directory
-        if not full:
-            sp.call(['sh', sh_path, 'copier', bam_path, new_outdir])
-    
-    # Clean out temp directory
-    if not temp_kp:
-        new_temp = '../temp'
-        shutil.rmtree(new_temp, ignore_errors=True)
-    
-    return 
-
-
-
-def bam_to_vcf(fps, outdir, full=False):
+    :param jobs: Number of files converted at once
+    :param threads: Number of BWA threads per file
+    :param runner: Runner of commands
+    """
+
+    convert_files(fps, outdir, 'fastq_bam', jobs, threads, runner=runner)
+
+    return
+
+
+
+def bam_to_vcf(fps, outdir, jobs=1, threads=1, scatter=1, runner=None):
     """
     Converts a BAM file to VCF
-    
+
     :param fps: List of paths to BAM files
-    :param out_fp: Path to output file
-    :param full: Boolean whether it is a full 
-                 conversion
-    """
-    
-    # Prepare temp directory if not full 
-    # FASTQ->VCF conversion
-    if not full:
-        prep_directory(fps, outdir, ftype='bam')
-        
-        # Changing to temp directory
-        temp = 'data/temp'
-        os.chdir(temp)
-        
-        outdir = '../../'+outdir
-    
-    for file in fps:
-        filename = file.split('/')[-1]
-        filename_wo_ext = filename.split('.')[0]
-        vcf_path = filename_wo_ext+'.vcf'
-        sh_path = '../../src/conversion.sh'
-        
-        # Creating index for BAM files
-        sp.call(['sh', sh_path, 'index_bam', filename, filename])
-    
-        # Converting BAM to VCF
-        sp.call(['sh', sh_path, 'haplotype', REF_ROOT, filename, vcf_path])
-    
-        sp.call(['sh', sh_path, 'copier', vcf_path, outdir])
-     
-    # Clean out temp directory
-    temp = '../temp'
-    shutil.rmtree(temp, ignore_errors=True)
-    
+    :param outdir: Path to output file
+    :param jobs: Number of files converted at once
+    :param threads: Number of GATK pair-HMM threads per file
+    :param scatter: Number of intervals to call separately,
+                    gathered into an indexed .vcf.gz
+    :param runner: Runner of commands
+    """
+
+    convert_files(fps, outdir, 'bam_vcf', jobs, threads, scatter, runner)
+
     return
-    
 
 
-def fastq_to_vcf(fps, outdir):
+
+def fastq_to_vcf(fps, outdir, jobs=1, threads=1, scatter=1, runner=None):
     """
     Converts FASTQ file to VCF
-    
+
     :param fps: List of paths to FASTQ files
     :param outdir: Path to output file
+    :param jobs: Number of files converted at once
+    :param threads: Number of threads of each tool per file
+    :param scatter: Number of intervals to call separately,
+                    gathered into an indexed .vcf.gz
+    :param runner: Runner of commands
     """
-    
-    # Prepare temp directory
-    prep_directory(fps, outdir, ftype='fastq')
-    
-    # Converting FASTQ to BAM
-    fastq_to_bam(fps, outdir, full=True, temp_kp=True)
-    
-    # Getting new names for input files
-    fps_new = [fp.split('/')[-1].split('.')[0]+'.bam' 
-               for fp in fps]   
-    
-    # Converting BAM files to VCF
-    bam_to_vcf(fps_new, '../../'+outdir, True)
-    
-    return
-
 
+    convert_files(fps, outdir, 'fastq_vcf', jobs, threads, scatter, runner)
 
-def prep_directory(fps, outdir, ftype='fastq'):
-    """
-    Prepares temp directory for file conversion
-    
-    :param fp: Filepath of file to create directory
-    :param outdir: Directory to write out files
-    :param ftype: File type to prepare directory for
-    """
-    
-    # Creating temp directory
-    tmp = 'data/temp'
-    if not os.path.exists(tmp):
-        os.makedirs(tmp)
-        
-    # Filepaths to reference files
-    ref_files_fp = ('../../../../datasets/dsc180a-wi20-public/'+
-                    'Genome/resources/hg38/')
-    
-    # Shell script path
-    sh_path = 'src/conversion.sh'
-    
-    # Moving reference to temp directory
-    sp.call(['sh', sh_path, 'copier', ref_files_fp+REF_ROOT, tmp])
-        
-    # Moving input files to temp directory
-    for file in fps:
-        sp.call(['sh', sh_path, 'copier', file, tmp])
-        
-    # Creating sequence dictionary for reference
-    unrooted = REF_ROOT.split('.')[0]
-    sp.call(['sh', sh_path, 'seq_dict', tmp+'/'+REF_ROOT, tmp, unrooted])
-    
-    # Indexing reference
-    sp.call(['sh', sh_path, 'fasta_index', tmp+'/'+REF_ROOT])
-        
-    if ftype == 'fastq':
-        
-        # Copying references genome files and input file to temp
-        ref_ext = ['.amb', '.ann', '.bwt', '.pac', '.sa']
-        for ext in ref_ext:
-            sp.call(['sh', sh_path, 'copier', ref_files_fp+REF_ROOT+ext, tmp])
-        
     return
 
 
 
 # ---------------------------------------------------------------------
 # Driver Function
-# --------------------------------------------------------------------- 
+# ---------------------------------------------------------------------
 
 
-def convert_data(fastq_bam, fastq_vcf, bam_vcf, outdir, **kwargs):
+def convert_data(fastq_bam, fastq_vcf, bam_vcf, outdir, jobs=1, threads=1,
+                 scatter=1, limits=None, timeout=None, retries=0, **kwargs):
     """
     Converts genetic data based on configuration file content.
-    
-    :param fastq_bam: List of filepaths to FASTQ files 
+
+    :param fastq_bam: List of filepaths to FASTQ files
                       to convert to BAM
     :param fastq_vcf: List of filepaths to FASTQ files
                       to convert to VCF
-    :param bam_vcf: List of filepaths to BAM file to 
+    :param bam_vcf: List of filepaths to BAM file to
                     convert to VCF
     :param outdir: Directory to write out converted files
+    :param jobs: Number of files converted at once
+    :param threads: Number of threads of each conversion job
+                    (BWA '-t', GATK native pair-HMM threads)
+    :param scatter: Number of reference intervals variants
+                    are called on in parallel per file
+    :param limits: Dictionary of commands of each tool run
+                   at once, across all files
+    :param timeout: Seconds before a command is killed
+    :param retries: Number of times a failed command is rerun
     """
-    
+
     # Creating out directory
     if not os.path.exists(outdir):
         os.makedirs(outdir)
-    
-    # Convert FASTQ to BAM files
-    if fastq_bam:
-        fastq_to_bam(fastq_bam, outdir)
-    
-    # Convert FASTQ to VCF files
-    if fastq_vcf:
-        fastq_to_vcf(fastq_vcf, outdir)
-    
-    # Convert BAM to VCF files
-    if bam_vcf:
-        bam_to_vcf(bam_vcf, outdir)
-        
-    return 
-    
\ No newline at end of file
+
+    groups = [(fps, steps) for fps, steps in [(fastq_bam, 'fastq_bam'),
+                                              (fastq_vcf, 'fastq_vcf'),
+                                              (bam_vcf, 'bam_vcf')] if fps]
+    if not groups:
+        return
+
+    # Prepare reference shared by all groups
+    ref = prep_reference(bwa=bool(fastq_bam or fastq_vcf), gaps=scatter > 1)
+    outdir = os.path.abspath(outdir)
+    runner = Runner(limits, timeout, retries)
+
+    # Converting FASTQ to BAM, FASTQ to VCF, then BAM to VCF
+    # files in one event loop, sharing the runner's limits
+    async def convert_all():
+        for fps, steps in groups:
+            await convert_group(runner, fps, outdir, ref, steps, jobs, 
+                                threads, scatter)
+
+    asyncio.run(convert_all())
+
+    return
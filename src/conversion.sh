@@ -3,6 +3,7 @@
 
 mapper() {
    bwa mem \
+   -t ${5:-1} \
    -R $1 \
    -p $2 \
    $3 > $4
@@ -14,6 +15,11 @@ fasta_index() {
 }
 
 
+bwa_index() {
+    bwa index $1
+}
+
+
 sam_bam() {
     gatk SortSam \
     -I $1 \
@@ -36,14 +42,28 @@ seq_dict() {
 
 haplotype() {
     gatk HaplotypeCaller \
+    --native-pair-hmm-threads ${4:-1} \
     -R $1 \
     -I $2 \
     -O $3
 }
 
 
-copier() {
-    cp $1 $2
+haplotype_interval() {
+    gatk HaplotypeCaller \
+    -R $1 \
+    -I $2 \
+    -O $3 \
+    -L $4
+}
+
+
+gather_vcfs() {
+    out=$1
+    shift
+    gatk GatherVcfs \
+    $(printf -- '-I %s ' "$@") \
+    -O $out
 }
 
 
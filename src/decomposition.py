@@ -0,0 +1,310 @@
+"""  Genotype Decomposition
+
+decomposition.py runs principal component analysis on
+packed genotypes, streaming standardized variant blocks
+from disk through a randomized SVD, or accumulating
+them into a sample Gram matrix that subsets of samples
+can be decomposed from.
+
+"""
+
+# Importing libraries
+import numpy as np
+from collections import namedtuple
+from genotype import iter_blocks
+
+PCAResult = namedtuple('PCAResult', ['eigvecs', 'eigvals', 'loadings',
+                                     'freqs', 'variants', 'samples'])
+
+
+
+def allele_freqs(geno, block_size=10000, variants=None, samples=None):
+    """
+    Computes alternate allele frequencies over non-missing calls
+
+    :param geno: GenotypeData returned by 'genotype.load_bed'
+    :param block_size: Number of variants per block
+    :param variants: Boolean mask of variants to keep (default all)
+    :param samples: Boolean mask of samples to keep (default all)
+    :returns: float64 array of frequencies for kept variants
+    """
+
+    freqs = []
+    for _, dosage in iter_blocks(geno, block_size, variants, samples):
+        called = dosage >= 0
+        alt = np.where(called, dosage, 0).sum(axis=1, dtype=np.int64)
+        n_called = called.sum(axis=1)
+        freqs.append(alt / np.maximum(2 * n_called, 1))
+
+    if not freqs:
+        return np.zeros(0)
+
+    return np.concatenate(freqs)
+
+
+
+def standardize(dosage, freqs, dtype=np.float32):
+    """
+    Centers and scales dosages by allele frequency,
+    mean-imputing missing calls
+
+    :param dosage: int8 array of dosages (variants x samples)
+    :param freqs: Alternate allele frequency of each variant
+    :returns: Standardized array (variants x samples)
+    """
+
+    mean = (2 * freqs).astype(dtype)[:, None]
+    scale = np.sqrt(2 * freqs * (1 - freqs)).astype(dtype)[:, None]
+
+    # Monomorphic variants carry no information and are zeroed
+    scale[scale == 0] = np.inf
+
+    std = (dosage.astype(dtype) - mean) / scale
+    std[dosage < 0] = 0
+
+    return std
+
+
+
+def iter_standardized(geno, freqs, block_size=10000, variants=None,
+                      samples=None):
+    """
+    Iterates over blocks of standardized genotypes
+
+    :param freqs: Frequencies of kept variants from 'allele_freqs'
+    :returns: Generator of (position of block in kept variants,
+              standardized block of variants x samples) tuples
+    """
+
+    start = 0
+    for _, dosage in iter_blocks(geno, block_size, variants, samples):
+        stop = start + len(dosage)
+        yield slice(start, stop), standardize(dosage, freqs[start:stop])
+        start = stop
+
+
+
+def fix_signs(eigvecs):
+    """
+    Flips eigenvectors in place so their largest entry is
+    positive, making results reproducible
+
+    :param eigvecs: Array of eigenvectors (samples x components)
+    :returns: Array of signs applied to each component
+    """
+
+    signs = np.sign(eigvecs[np.abs(eigvecs).argmax(axis=0),
+                            np.arange(eigvecs.shape[1])])
+    signs[signs == 0] = 1
+    eigvecs *= signs
+
+    return signs
+
+
+
+def randomized_pca(geno, num_pca, block_size=10000, variants=None,
+                   samples=None, freqs=None, oversample=20, n_iter=8, seed=0,
+                   init=None):
+    """
+    Runs blocked randomized PCA. Memory is bounded by the block
+    size plus (samples x num_pca + oversample) arrays, and each
+    block product runs through multithreaded BLAS. Given a
+    starting basis, such as the eigenvectors of a previous run
+    on a superset of samples, the random sketch is skipped
+    and fewer power iterations are needed
+
+    :param geno: GenotypeData returned by 'genotype.load_bed'
+    :param num_pca: Number of principal components
+    :param block_size: Number of variants per block
+    :param variants: Boolean mask of variants to keep (default all)
+    :param samples: Boolean mask of samples to keep (default all)
+    :param freqs: Precomputed frequencies of kept variants
+    :param oversample: Extra dimensions of the random sketch
+    :param n_iter: Number of power iterations
+    :param seed: Random seed of the sketch
+    :param init: Array (samples x components) to start power
+                 iterations from, padded with random columns
+                 up to the sketch size (default random sketch)
+    :returns: PCAResult of eigenvectors (samples x num_pca),
+              eigenvalues, loadings (variants x num_pca) and
+              the allele frequencies, variant and sample
+              indices they refer to
+    """
+
+    n_samples = len(geno.samples)
+    variant_idx = (np.arange(len(geno.variants)) if variants is None
+                   else np.flatnonzero(variants))
+    sample_idx = (np.arange(n_samples) if samples is None
+                  else np.flatnonzero(samples))
+
+    if freqs is None:
+        freqs = allele_freqs(geno, block_size, variants, samples)
+
+    rank = min(num_pca + oversample, len(sample_idx), len(variant_idx))
+    rng = np.random.default_rng(seed)
+
+    def blocks():
+        return iter_standardized(geno, freqs, block_size, variants, samples)
+
+    if init is not None:
+        # Starting from the given basis in the sample space
+        init = init[:, :rank]
+        sketch = np.hstack([init, rng.standard_normal(
+            (len(sample_idx), rank - init.shape[1]))])
+    else:
+        # Sketching the sample space with a random projection
+        sketch = np.zeros((len(sample_idx), rank))
+        for _, block in blocks():
+            omega = rng.standard_normal((len(block), rank), dtype=np.float32)
+            sketch += block.T @ omega
+
+    # Power iterations, also accumulating the projected
+    # covariance Q' X X' Q on the last basis
+    for _ in range(max(n_iter, 1)):
+        basis = np.linalg.qr(sketch)[0].astype(np.float32)
+        sketch = np.zeros_like(sketch)
+        projected = np.zeros((rank, rank))
+        for _, block in blocks():
+            proj = block @ basis
+            sketch += block.T @ proj
+            projected += proj.T @ proj
+
+    # Eigen-decomposing in the reduced space
+    vals, vecs = np.linalg.eigh(projected)
+    order = np.argsort(vals)[::-1][:num_pca]
+    vals, vecs = np.maximum(vals[order], 0), vecs[:, order]
+    eigvecs = basis.astype(np.float64) @ vecs
+
+    # Fixing signs so results are reproducible
+    signs = fix_signs(eigvecs)
+    vecs *= signs
+
+    # Variant loadings are the right singular vectors
+    singular = np.sqrt(vals)
+    singular[singular == 0] = np.inf
+    loadings = np.zeros((len(variant_idx), len(order)))
+    for pos, block in blocks():
+        loadings[pos] = (block @ basis) @ vecs / singular
+
+    # Eigenvalues of the genetic relationship matrix
+    eigvals = vals / max(len(variant_idx), 1)
+
+    return PCAResult(eigvecs, eigvals, loadings, freqs,
+                     variant_idx, sample_idx)
+
+
+
+def gram_matrix(geno, freqs, block_size=10000, variants=None, samples=None):
+    """
+    Accumulates the sample Gram matrix Z'Z of standardized
+    genotypes in one pass. Subsets of samples can then be
+    decomposed from it without reading genotypes again
+
+    :param geno: GenotypeData returned by 'genotype.load_bed'
+    :param freqs: Frequencies of kept variants from 'allele_freqs'
+    :param block_size: Number of variants per block
+    :param variants: Boolean mask of variants to keep (default all)
+    :param samples: Boolean mask of samples to keep (default all)
+    :returns: float64 array (samples x samples)
+    """
+
+    n_samples = len(geno.samples) if samples is None else samples.sum()
+    gram = np.zeros((n_samples, n_samples))
+    for _, block in iter_standardized(geno, freqs, block_size, variants,
+                                      samples):
+        gram += block.T @ block
+
+    return gram
+
+
+
+def gram_eigen(gram, num_pca):
+    """
+    Finds the top eigenvectors of a Gram matrix after
+    double-centering it, so a submatrix for a subset of
+    samples is re-centered on that subset
+
+    :param gram: Gram matrix from 'gram_matrix', or a submatrix
+    :param num_pca: Number of principal components
+    :returns: Tuple of eigenvalues and eigenvectors
+              (samples x num_pca), largest first
+    """
+
+    means = gram.mean(axis=0)
+    centered = gram - means[:, None] - means[None, :] + means.mean()
+
+    vals, vecs = np.linalg.eigh(centered)
+    order = np.argsort(vals)[::-1][:num_pca]
+    vals, vecs = np.maximum(vals[order], 0), vecs[:, order]
+    fix_signs(vecs)
+
+    return vals, vecs
+
+
+
+def gram_pca(geno, eigvecs, vals, block_size=10000, variants=None,
+             samples=None):
+    """
+    Completes a decomposition found from the Gram matrix
+    with frequencies and variant loadings of its samples
+
+    :param geno: GenotypeData returned by 'genotype.load_bed'
+    :param eigvecs: Eigenvectors from 'gram_eigen'
+    :param vals: Eigenvalues from 'gram_eigen'
+    :param block_size: Number of variants per block
+    :param variants: Boolean mask of variants to keep (default all)
+    :param samples: Boolean mask of samples the eigenvectors
+                    refer to (default all)
+    :returns: PCAResult, as returned by 'randomized_pca'
+    """
+
+    variant_idx = (np.arange(len(geno.variants)) if variants is None
+                   else np.flatnonzero(variants))
+    sample_idx = (np.arange(len(geno.samples)) if samples is None
+                  else np.flatnonzero(samples))
+    freqs = allele_freqs(geno, block_size, variants, samples)
+
+    # Variant loadings are the right singular vectors
+    singular = np.sqrt(vals)
+    singular[singular == 0] = np.inf
+    loadings = np.zeros((len(variant_idx), len(vals)))
+    for pos, block in iter_standardized(geno, freqs, block_size, variants,
+                                        samples):
+        loadings[pos] = block @ eigvecs / singular
+
+    # Eigenvalues of the genetic relationship matrix
+    eigvals = vals / max(len(variant_idx), 1)
+
+    return PCAResult(eigvecs, eigvals, loadings, freqs,
+                     variant_idx, sample_idx)
+
+
+
+def project(dosage, freqs, loadings, eigvals):
+    """
+    Projects samples onto principal components of a saved
+    decomposition. Scores are least-squares fits on the
+    variants each sample has called, so missing calls do
+    not shrink them towards zero
+
+    :param dosage: int8 array of dosages (variants x samples) at
+                   the decomposition's variants, -1 where missing
+    :param freqs: Allele frequencies of the decomposition
+    :param loadings: Variant loadings of the decomposition
+    :param eigvals: Eigenvalues of the decomposition
+    :returns: Array of scores (samples x components) on the
+              scale of the decomposition's eigenvectors
+    """
+
+    std = standardize(dosage, freqs, np.float64)
+    called = (dosage >= 0).astype(np.float64)
+
+    # Singular values, as in 'randomized_pca'
+    singular = np.sqrt(eigvals * max(len(loadings), 1))
+    singular[singular == 0] = np.inf
+
+    # Share of each component's loadings a sample has called
+    coverage = called.T @ np.square(loadings)
+    coverage[coverage == 0] = np.inf
+
+    return (std.T @ loadings) / coverage / singular
@@ -15,18 +15,35 @@ import json
 import gzip
 import io
 import os
+import zlib
+import time
+import ftplib
+import hashlib
+import threading
 from itertools import islice
 from ftplib import FTP
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+FTP_SRV = 'ftp.1000genomes.ebi.ac.uk'
+
+# Index files listing MD5 checksums of phase 3 files, kept
+# locally once downloaded
+ALIGNMENT_INDEXES = [
+    '/vol1/ftp/phase3/20130502.phase3.low_coverage.alignment.index',
+    '/vol1/ftp/phase3/20130502.phase3.exome.alignment.index']
+SEQUENCE_INDEXES = ['/vol1/ftp/phase3/20130502.phase3.sequence.index']
+INDEX_DIR = 'data/indexes'
 
     
     
-def get_vcf(chr_num, outdir):
+def get_vcf(chr_num, outdir, workers=4):
     """
     Downloads VCF files of a specific chromosome. Chromosomes 
     1-22 are available to download.
     
     :param chr_num: Integer or string representing chromosome to download
     :param outdir: Directory to write out data
+    :param workers: Number of concurrent FTP connections
     
     >>> get_vcf(21) is None
     True
@@ -36,17 +53,15 @@ def get_vcf(chr_num, outdir):
     path = '/vol1/ftp/release/20130502/'
     fname = ('ALL.chr{}.phase3').format(str(chr_num))
         
-    # Downloading file in ftp directory
-    fnames = download_data(path, 'vcf', outdir, fname)
-    
-    # Unzip file
-    unzipper(fnames, otudir)
+    # Downloading BGZF file and its tabix index as-is,
+    # downstream stages read them without unzipping
+    download_data(path, 'vcf', outdir, fname, workers, keep_index=True)
     
     return
     
 
     
-def get_bam(sample, chr_num, outdir):
+def get_bam(sample, chr_num, outdir, workers=4):
     """
     Downloads BAM files for a specific individual. Chromosomes
     11 and 20 are available.
@@ -54,6 +69,7 @@ def get_bam(sample, chr_num, outdir):
     :param sample: String identifying individual
     :param chr_num: Integer representing chromosome to download
     :param outdir: Directory to write out data
+    :param workers: Number of concurrent FTP connections
     
     >>> get_bam("HG00096", 20) is None
     True
@@ -64,19 +80,21 @@ def get_bam(sample, chr_num, outdir):
     fname = (('{}.chrom{}.ILLUMINA.bwa')
              .format(sample, str(chr_num)))
     
-    # Downloading file
-    download_data(path, 'bam', outdir, fname)
+    # Downloading file, verified against the alignment indexes
+    download_data(path, 'bam', outdir, fname, workers, 
+                  md5_indexes=ALIGNMENT_INDEXES)
     
     return
     
     
     
-def get_fastq(sample, outdir):
+def get_fastq(sample, outdir, workers=4):
     """
     Downloads all FASTQ files for a specific individual.
     
     :param sample: String identifying individual
     :param outdir: Directory to write out data
+    :param workers: Number of concurrent FTP connections
     
     >>> get_fastq("HG01921") is None
     True
@@ -85,32 +103,278 @@ def get_fastq(sample, outdir):
     # Creating ftp path to file
     path = '/vol1/ftp/phase3/data/{}/sequence_read/'.format(sample)
     
-    # Downloading all sequences in ftp directory to local directory
-    fnames = download_data(path, 'fastq', outdir)
-    
-    # Unzip files
-    unzipper(fnames, outdir)
+    # Downloading all sequences in ftp directory to local
+    # directory, unzipping as they are received, verified
+    # against the sequence index
+    download_data(path, 'fastq', outdir, workers=workers, decompress=True,
+                  md5_indexes=SEQUENCE_INDEXES)
     
     return
     
 
 
-def download_data(path, ftype, outdir, fname=None):
+def connect(host=FTP_SRV, port=21):
+    """
+    Opens an anonymous, binary mode FTP connection
+    
+    :param host: FTP server hostname
+    :param port: FTP server port
+    :returns: FTP connection
+    """
+    
+    ftp = FTP()
+    ftp.connect(host, port, timeout=60)
+    ftp.login()
+    ftp.voidcmd('TYPE I')
+    
+    return ftp
+
+
+
+def fetch_file(get_conn, drop_conn, remote, dest, retries=3, md5=None,
+               decompress=False):
+    """
+    Downloads one file, resuming partial downloads with REST
+    and verifying size and, if given, MD5 checksum. A file
+    failing verification is downloaded again from the start
+    
+    :param get_conn: Function returning this worker's connection
+    :param drop_conn: Function discarding this worker's connection
+    :param remote: Path to file on FTP server
+    :param dest: Path to write file to
+    :param retries: Number of retries after a failed transfer
+    :param md5: Expected MD5 hex digest of file
+    :param decompress: Whether to gunzip the file while it is
+                       received. Decompressed transfers restart
+                       rather than resume after an error
+    :returns: Number of bytes transferred
+    """
+    
+    part = dest+'.part'
+    transferred = 0
+    
+    for attempt in range(retries+1):
+        try:
+            ftp = get_conn()
+            size = ftp.size(remote)
+            
+            # Skipping files already downloaded
+            if os.path.exists(dest) and (decompress or 
+                                         os.path.getsize(dest) == size):
+                return transferred
+            
+            # Resuming from end of partial file
+            offset = 0
+            if not decompress and os.path.exists(part):
+                offset = os.path.getsize(part)
+            if offset > size:
+                offset = 0
+            
+            received = offset
+            digest = hashlib.md5()
+            with open(part, 'ab' if offset else 'wb') as file:
+                sink = gunzip_writer(file) if decompress else file.write
+                
+                def write(block):
+                    nonlocal transferred, received
+                    sink(block)
+                    digest.update(block)
+                    transferred += len(block)
+                    received += len(block)
+                    
+                if offset < size:
+                    ftp.retrbinary('RETR '+remote, write, rest=offset or None)
+            
+            # Verifying download, restarting if corrupted
+            if received != size:
+                raise IOError('{} received {} bytes, expected {}'
+                              .format(remote, received, size))
+            
+            if offset:
+                checksum = file_md5(part)
+            else:
+                checksum = digest.hexdigest()
+                
+            if md5 is not None and checksum != md5:
+                os.remove(part)
+                raise IOError('{} failed MD5 verification'.format(part))
+                
+            os.replace(part, dest)
+            return transferred
+        
+        except ftplib.all_errors + (zlib.error,) as err:
+            drop_conn()
+            if attempt == retries:
+                raise
+            print('***retrying {} after error: {}***'.format(remote, err))
+            time.sleep(2 ** attempt)
+
+
+
+def gunzip_writer(file):
+    """
+    Creates a callback that decompresses gzip data as it
+    arrives, including multi-member files such as BGZF
+    
+    :param file: File object to write decompressed data to
+    :returns: Function taking blocks of compressed bytes
+    """
+    
+    decomp = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    
+    def write(block):
+        nonlocal decomp
+        while block:
+            file.write(decomp.decompress(block))
+            if not decomp.eof:
+                break
+                
+            # Starting next gzip member
+            block = decomp.unused_data
+            decomp = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            
+    return write
+
+
+
+def file_md5(fp):
+    """
+    Computes MD5 checksum of a file
+    
+    :param fp: Path to file
+    :returns: MD5 hex digest
+    """
+    
+    digest = hashlib.md5()
+    with open(fp, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+            
+    return digest.hexdigest()
+
+
+
+def parse_md5sums(lines):
+    """
+    Reads checksums written by 'md5sum', one '<md5>  <file>'
+    line per file
+    
+    :param lines: Iterable of lines
+    :returns: Dictionary of file names to MD5 hex digests
+    """
+    
+    checksums = {}
+    for line in lines:
+        fields = line.split()
+        if len(fields) == 2 and len(fields[0]) == 32:
+            checksums[os.path.basename(fields[1].lstrip('*'))] = fields[0]
+            
+    return checksums
+
+
+
+def parse_index(lines):
+    """
+    Reads checksums from a 1000 Genomes index file, a table
+    whose header names each file column followed by the
+    column of its MD5 checksum
+    
+    :param lines: Iterable of lines, header first
+    :returns: Dictionary of file names to MD5 hex digests
+    """
+    
+    lines = iter(lines)
+    header = next(lines, '').lstrip('#').rstrip('\n').split('\t')
+    pairs = [(i, i+1) for i in range(len(header)-1) 
+             if 'MD5' in header[i+1].upper() and 'MD5' not in header[i].upper()]
+    
+    checksums = {}
+    for line in lines:
+        fields = line.rstrip('\n').split('\t')
+        for file_col, md5_col in pairs:
+            if md5_col < len(fields) and fields[file_col]:
+                checksums[os.path.basename(fields[file_col])] = fields[md5_col]
+                
+    return checksums
+
+
+
+def remote_checksums(get_conn, drop_conn, path, fnames, md5_indexes=(), 
+                     retries=3, index_dir=INDEX_DIR):
+    """
+    Collects MD5 checksums of files on the server, from '.md5'
+    files listed next to them and from index files. Index
+    files are downloaded once and reused while their size
+    matches the server's
+    
+    :param get_conn: Function returning this worker's connection
+    :param drop_conn: Function discarding this worker's connection
+    :param path: Path to directory of files on the server
+    :param fnames: List of file names in the directory
+    :param md5_indexes: List of paths to index files on the server
+    :param retries: Number of retries per index file
+    :param index_dir: Directory index files are kept in
+    :returns: Dictionary of file names to MD5 hex digests
+    """
+    
+    checksums = {}
+    
+    for index in md5_indexes:
+        try:
+            get_conn().size(index)
+        except ftplib.error_perm:
+            print('***no index {}, skipping its checksums***'.format(index))
+            continue
+            
+        if not os.path.exists(index_dir):
+            os.makedirs(index_dir)
+        local = os.path.join(index_dir, os.path.basename(index))
+        fetch_file(get_conn, drop_conn, index, local, retries)
+        with open(local) as f:
+            checksums.update(parse_index(f))
+            
+    # Checksum files next to the data take precedence
+    for f in fnames:
+        if f.endswith('.md5'):
+            data = io.BytesIO()
+            get_conn().retrbinary('RETR '+path+f, data.write)
+            lines = data.getvalue().decode(errors='replace').splitlines()
+            checksums.update(parse_md5sums(lines))
+            
+    return checksums
+
+
+
+def download_data(path, ftype, outdir, fname=None, workers=4, retries=3,
+                  checksums=None, md5_indexes=(), keep_index=False, 
+                  decompress=False, host=FTP_SRV, port=21):
     """
     Downloads data at a specifc path within the International 
-    Genome Sample Resource's FTP server
+    Genome Sample Resource's FTP server, using a pool of
+    concurrent connections. Files are verified against MD5
+    checksums listed in '.md5' files next to them, in index
+    files or given directly, and by size only otherwise
     
     :param path: String representing path to directory housing
                  files for download
     :param ftype: String representing file type
     :param fname: List containing file names to download
     :param outdir: Directory to write out data
+    :param workers: Number of concurrent connections
+    :param retries: Number of retries per file
+    :param checksums: Dictionary of file names to MD5 hex digests
+                      of the files as stored on the server
+    :param md5_indexes: List of paths to index files on the
+                        server listing MD5 checksums
+    :param keep_index: Whether to also download VCF .tbi indexes
+    :param decompress: Whether to unzip .gz files while they
+                       are received, writing each byte once
+    :param host: FTP server hostname
+    :param port: FTP server port
     """
     
     # Connect to ftp server
-    ftp_srv = 'ftp.1000genomes.ebi.ac.uk'
-    ftp = FTP(ftp_srv)
-    ftp.login()
+    ftp = connect(host, port)
     
     # Changing directory within ftp
     ftp.cwd(path)
@@ -118,59 +382,84 @@ def download_data(path, ftype, outdir, fname=None):
     # Searches for files in directory
     all_fnames = []
     ftp.retrlines('NLST', callback=lambda x: all_fnames.append(str(x))) 
+    ftp.close()
+    
+    data_fnames = [f for f in all_fnames if not f.endswith('.md5')]
     
     if ftype == 'vcf':
-        fnames = [f for f in all_fnames if (fname in f) and ('tbi' not in f)]
+        fnames = [f for f in data_fnames 
+                  if (fname in f) and (keep_index or 'tbi' not in f)]
     
     elif ftype == 'bam':
-        fnames = [f for f in all_fnames
+        fnames = [f for f in data_fnames
                   if (fname in f) and ('bai' not in f) and ('bas' not in f)]
     
     elif ftype == 'fastq':
-        fnames = all_fnames
+        fnames = data_fnames
         
     # Creates data directory if it doesnt exist
     if not os.path.exists(outdir):
         os.makedirs(outdir)
     
+    # One connection per worker thread, reopened after errors
+    local = threading.local()
+    conns = []
+    
+    def get_conn():
+        if getattr(local, 'ftp', None) is None:
+            local.ftp = connect(host, port)
+            conns.append(local.ftp)
+        return local.ftp
+    
+    def drop_conn():
+        if getattr(local, 'ftp', None) is not None:
+            local.ftp.close()
+            local.ftp = None
+    
     # Writes out data to data directory
-    for f in fnames:
-        file = open(outdir+f, "wb")
-        resp = ftp.retrbinary("RETR "+path+f, file.write)
-        file.close()
+    start = time.time()
+    total = 0
+    
+    try:
+        checksums = dict(remote_checksums(get_conn, drop_conn, path, 
+                                          all_fnames, md5_indexes, retries),
+                         **(checksums or {}))
+        for f in fnames:
+            if f not in checksums:
+                print('***no MD5 listed for {}, verifying size only***'
+                      .format(f))
+        
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {}
+            for f in fnames:
+                unzip = decompress and f.endswith('.gz')
+                dest = os.path.join(outdir, f[:-3] if unzip else f)
+                future = pool.submit(fetch_file, get_conn, drop_conn, path+f,
+                                     dest, retries, checksums.get(f), unzip)
+                futures[future] = f
+            
+            for future in as_completed(futures):
+                total += future.result()
+                elapsed = max(time.time() - start, 1e-6)
+                print('***downloaded {} ({:.1f} MB total, {:.1f} MB/s)***'
+                      .format(futures[future], total / 1e6, 
+                              total / 1e6 / elapsed))
     
     # Disconnects from ftp
-    ftp.close()
+    finally:
+        for conn in conns:
+            conn.close()
         
     return fnames
 
     
     
-def unzipper(fnames, path):
-    """
-    Unzips files
-    
-    :param fnames: List containing files to unzip
-    :param path: Directory of zipped file
-    """
-    
-    # Unzipping files in local directory
-    for fname in fnames:
-        with gzip.open(path+fname,'rb') as zipped, open(path+fname[:-3], 'wb') as unzipped:
-            shutil.copyfileobj(zipped, unzipped)
-            
-        # Removed old zipped file
-        os.remove(path+fname) 
-        
-    return
-        
-        
 # ---------------------------------------------------------------------
 # Driver Function
 # ---------------------------------------------------------------------      
         
         
-def get_data(vcf, bam, fastq, outdir, **kwargs):
+def get_data(vcf, bam, fastq, outdir, workers=4, **kwargs):
     """
     Downloads genetic data based on configuration file content.
     
@@ -179,6 +468,8 @@ def get_data(vcf, bam, fastq, outdir, **kwargs):
                 for BAM files
     :param fastq: List containing sample for FASTQ files
     :param otudir: Directory to write out files
+    :param workers: Number of concurrent FTP connections
+                    per download
     
     >>> cfg = json.load(open('data-params.json'))
     >>> get_data(**cfg) is None
@@ -187,7 +478,7 @@ def get_data(vcf, bam, fastq, outdir, **kwargs):
     
     # Checks if inpath passed in. If so, nothing will
     # be done as only existing test data is needed
-    if len(kwargs) > 0:
+    if 'inpath' in kwargs:
         return
         
     else:
@@ -195,10 +486,10 @@ def get_data(vcf, bam, fastq, outdir, **kwargs):
 
             if type(data) == dict:
                 for key in data.keys():
-                    func(key, data[key], outdir)
+                    func(key, data[key], outdir, workers)
             else:
                 for arg in data:
-                    func(arg, outdir)
+                    func(arg, outdir, workers)
 
         # Download VCF
         run_query(get_vcf, vcf)
@@ -0,0 +1,283 @@
+"""  Genotype Store
+
+genotype.py packs VCF genotype calls into a 2-bit-per-call
+matrix using the PLINK .bed layout and memory-maps it for
+every later processing stage.
+
+"""
+
+# Importing libraries
+import pandas as pd
+import numpy as np
+from collections import namedtuple
+from read_data import read_vcf_chunks
+
+BED_MAGIC = b'\x6c\x1b\x01'
+BIM_COLUMNS = ['Chrom', 'ID', 'CM', 'Pos', 'A1', 'A2']
+FAM_COLUMNS = ['FID', 'IID', 'Father', 'Mother', 'Sex', 'Phenotype']
+
+# PLINK codes indexed by alternate allele dosage. A1 is
+# the alternate allele, so 0b00 is homozygous alternate
+DOSAGE_CODES = np.array([0b11, 0b10, 0b00], dtype=np.uint8)
+MISSING_CODE = 0b01
+
+# Alternate allele dosage for each 2-bit code (-1 missing),
+# expanded to every possible packed byte
+CODE_DOSAGES = np.array([2, -1, 1, 0], dtype=np.int8)
+BYTE_DOSAGES = CODE_DOSAGES[(np.arange(256)[:, None] >>
+                             np.array([0, 2, 4, 6])) & 0b11]
+
+# Leading characters of a call read for its GT, enough
+# for two alleles of up to three digits
+GT_WIDTH = 8
+
+GenotypeData = namedtuple('GenotypeData', ['packed', 'variants', 'samples'])
+
+
+
+def gt_to_dosage(gts):
+    """
+    Converts VCF GT fields to alternate allele dosages
+
+    :param gts: Array-like of GT strings (variants x samples).
+                Only the leading 'a|b' of each field is read,
+                alleles may have several digits
+    :returns: int8 array of dosages, -1 where missing
+    """
+
+    # Viewing the leading characters of each call as bytes
+    calls = np.ascontiguousarray(
+        np.asarray(gts, dtype=object).astype('S{}'.format(GT_WIDTH)))
+    raw = calls.view(np.uint8).reshape(calls.shape + (GT_WIDTH,))
+    padded = np.concatenate([raw, np.zeros(calls.shape + (1,), np.uint8)],
+                            axis=-1)
+
+    # Locating the end of GT and the allele separator, if any
+    ends = np.argmax((padded == 0) | (padded == ord(':')), axis=-1)
+    seps = np.argmax((padded == ord('|')) | (padded == ord('/')), axis=-1)
+    haploid = (seps == 0) | (seps > ends)
+    seps = np.where(haploid, ends, seps)
+
+    # An allele is reference only when it is exactly '0'
+    first = raw[..., 0]
+    second = np.take_along_axis(padded, (seps + 1)[..., None], -1)[..., 0]
+    alt_1 = ~((first == ord('0')) & (seps == 1))
+    alt_2 = np.where(haploid, alt_1,
+                     ~((second == ord('0')) & (ends - seps == 2)))
+
+    dosage = alt_1.astype(np.int8) + alt_2.astype(np.int8)
+    missing = (first == ord('.')) | (~haploid & (second == ord('.')))
+    dosage[missing] = -1
+
+    return dosage
+
+
+
+def pack_dosages(dosage):
+    """
+    Packs dosages into PLINK .bed bytes, four calls per byte
+
+    :param dosage: int8 array of dosages (variants x samples)
+    :returns: uint8 array (variants x ceil(samples / 4))
+    """
+
+    n_variants, n_samples = dosage.shape
+
+    # Padding samples to a multiple of four with zero codes
+    codes = np.zeros((n_variants, -(-n_samples // 4) * 4), dtype=np.uint8)
+    codes[:, :n_samples] = np.where(dosage < 0, MISSING_CODE,
+                                    DOSAGE_CODES[np.clip(dosage, 0, 2)])
+
+    packed = (codes[:, 0::4] | (codes[:, 1::4] << 2) |
+              (codes[:, 2::4] << 4) | (codes[:, 3::4] << 6))
+
+    return packed
+
+
+
+def unpack_dosages(packed, n_samples):
+    """
+    Unpacks PLINK .bed bytes into dosages
+
+    :param packed: uint8 array (variants x bytes per variant)
+    :param n_samples: Number of samples stored in each row
+    :returns: int8 array of dosages, -1 where missing
+    """
+
+    dosage = BYTE_DOSAGES[np.asarray(packed)]
+
+    return dosage.reshape(len(dosage), -1)[:, :n_samples]
+
+
+
+def write_bed(vcf_fps, prefix, chunksize=10000):
+    """
+    Converts VCF files into a PLINK .bed/.bim/.fam fileset
+
+    :param vcf_fps: List of paths to VCF files sharing samples
+    :param prefix: Output path without extension
+    :returns: Number of variants written
+    """
+
+    fixed = ['#CHROM', 'POS', 'ID', 'REF', 'ALT']
+    samples = None
+    n_variants = 0
+
+    with open(prefix+'.bed', 'wb') as bed, open(prefix+'.bim', 'w') as bim:
+        bed.write(BED_MAGIC)
+
+        for fp in vcf_fps:
+            for chunk in read_vcf_chunks(fp, chunksize, columns=fixed):
+
+                # Checking sample columns match across files
+                chunk_samples = list(chunk.columns[len(fixed):])
+                if samples is None:
+                    samples = chunk_samples
+                elif chunk_samples != samples:
+                    raise ValueError('Samples in {} do not match'.format(fp))
+
+                # Packing genotypes, writing variant information
+                dosage = gt_to_dosage(chunk[samples].to_numpy())
+                bed.write(pack_dosages(dosage).tobytes())
+
+                chunk_variants(chunk).to_csv(bim, sep='\t', header=False,
+                                             index=False)
+                n_variants += len(chunk)
+
+    write_fam(samples or [], prefix+'.fam')
+
+    return n_variants
+
+
+
+def chunk_variants(chunk):
+    """
+    Builds .bim rows of a chunk of VCF records
+
+    :param chunk: DataFrame from 'read_data.read_vcf_chunks'
+    :returns: DataFrame of BIM_COLUMNS, A1 being the
+              alternate allele
+    """
+
+    return pd.DataFrame({'Chrom': chunk['#CHROM'], 'ID': chunk['ID'],
+                         'CM': 0, 'Pos': chunk['POS'], 'A1': chunk['ALT'],
+                         'A2': chunk['REF']})
+
+
+
+def write_fam(samples, fp):
+    """
+    Writes sample information, family ID mirrors sample ID
+
+    :param samples: List of sample IDs
+    :param fp: Path to .fam file
+    """
+
+    fam = pd.DataFrame({'FID': samples, 'IID': samples, 'Father': 0,
+                        'Mother': 0, 'Sex': 0, 'Phenotype': -9})
+    fam.to_csv(fp, sep=' ', header=False, index=False)
+
+    return
+
+
+
+def read_bim(fp):
+    """
+    Reads variant information of a .bim file
+
+    :param fp: Path to .bim file
+    :returns: DataFrame of BIM_COLUMNS
+    """
+
+    return pd.read_csv(fp, sep='\t', header=None, names=BIM_COLUMNS,
+                       dtype={'Chrom': str, 'ID': str, 'A1': str, 'A2': str},
+                       keep_default_na=False)
+
+
+
+def read_fam(fp):
+    """
+    Reads sample information of a .fam file
+
+    :param fp: Path to .fam file
+    :returns: DataFrame of FAM_COLUMNS
+    """
+
+    return pd.read_csv(fp, sep=r'\s+', header=None, names=FAM_COLUMNS,
+                       dtype={'FID': str, 'IID': str}, keep_default_na=False)
+
+
+
+def map_bed(fp, n_variants, n_samples):
+    """
+    Memory-maps the packed matrix of a .bed file
+
+    :param fp: Path to .bed file
+    :param n_variants: Number of variants in file
+    :param n_samples: Number of samples in file
+    :returns: uint8 array (variants x bytes per variant)
+    """
+
+    # Checking header, variant-major mode only
+    with open(fp, 'rb') as f:
+        if f.read(3) != BED_MAGIC:
+            raise ValueError('{} is not a variant-major .bed'.format(fp))
+
+    bytes_per_variant = -(-n_samples // 4)
+    if n_variants == 0:
+        return np.zeros((0, bytes_per_variant), dtype=np.uint8)
+
+    return np.memmap(fp, dtype=np.uint8, mode='r', offset=3,
+                     shape=(n_variants, bytes_per_variant))
+
+
+
+def load_bed(prefix):
+    """
+    Memory-maps a PLINK .bed/.bim/.fam fileset
+
+    :param prefix: Path to fileset without extension
+    :returns: GenotypeData of packed matrix, variant
+              and sample tables
+    """
+
+    variants = read_bim(prefix+'.bim')
+    samples = read_fam(prefix+'.fam')
+    packed = map_bed(prefix+'.bed', len(variants), len(samples))
+
+    return GenotypeData(packed, variants, samples)
+
+
+
+def iter_blocks(geno, block_size=10000, variants=None, samples=None):
+    """
+    Iterates over blocks of unpacked dosages
+
+    :param geno: GenotypeData returned by 'load_bed'
+    :param block_size: Number of variants per block
+    :param variants: Boolean mask of variants to keep (default all)
+    :param samples: Boolean mask of samples to keep (default all)
+    :returns: Generator of (variant indices, int8 dosage
+              block of variants x samples) tuples
+    """
+
+    n_samples = len(geno.samples)
+    if variants is None:
+        index = np.arange(len(geno.variants))
+    else:
+        index = np.flatnonzero(variants)
+
+    for start in range(0, len(index), block_size):
+        block_index = index[start:start+block_size]
+
+        # Contiguous blocks are sliced straight from the memory map
+        if block_index[-1] - block_index[0] == len(block_index) - 1:
+            packed = geno.packed[block_index[0]:block_index[-1]+1]
+        else:
+            packed = geno.packed[block_index]
+
+        dosage = unpack_dosages(packed, n_samples)
+        if samples is not None:
+            dosage = dosage[:, samples]
+
+        yield block_index, dosage
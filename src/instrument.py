@@ -0,0 +1,250 @@
+"""  Instrumentation
+
+instrument.py records how long pipeline stages and external
+commands take and what they use: wall and CPU time, peak
+resident memory of the stage or command itself, bytes read
+and written, and exit status.
+Each measurement is appended as a JSON trace event to the
+trace file of the run, which worker processes inherit.
+Commands are measured as 'runner.py' runs them.
+
+"""
+
+# Importing libraries
+import pandas as pd
+import contextlib
+import resource
+import threading
+import json
+import time
+import os
+
+TRACE_DIR = 'data/traces'
+TRACE_ENV = 'PIPELINE_TRACE'
+
+# Sizes of 'ru_inblock'/'ru_oublock' blocks and 'ru_maxrss' units
+BLOCK_BYTES = 512
+RSS_BYTES = 1024
+
+# Seconds between resident memory samples of a stage
+RSS_INTERVAL = 0.05
+
+
+
+def start_trace(trace_dir=TRACE_DIR):
+    """
+    Starts a trace file for this run. Processes started
+    afterwards write to the same file
+
+    :param trace_dir: Directory of trace files
+    :returns: Path to trace file
+    """
+
+    if not os.path.exists(trace_dir):
+        os.makedirs(trace_dir)
+
+    fp = os.path.join(trace_dir, 'run-{}-{}.jsonl'.format(
+        time.strftime('%Y%m%d-%H%M%S'), os.getpid()))
+    open(fp, 'w').close()
+    os.environ[TRACE_ENV] = os.path.abspath(fp)
+
+    return fp
+
+
+
+def emit(event):
+    """
+    Appends an event to the trace file of the run, if any
+
+    :param event: Dictionary
+    """
+
+    fp = os.environ.get(TRACE_ENV)
+    if fp is None:
+        return
+
+    # Single appends of one line keep concurrent writers whole
+    line = json.dumps(event, default=str) + '\n'
+    with open(fp, 'a') as f:
+        f.write(line)
+
+    return
+
+
+
+def proc_io():
+    """
+    Reads bytes read and written by this process so far
+
+    :returns: Tuple of bytes read and written, None where
+              /proc is unavailable
+    """
+
+    try:
+        with open('/proc/self/io') as f:
+            fields = dict(line.split(': ') for line in f)
+    except (OSError, ValueError):
+        return None, None
+
+    return int(fields['read_bytes']), int(fields['write_bytes'])
+
+
+
+def current_rss():
+    """
+    Reads the resident memory of this process
+
+    :returns: Bytes, None where /proc is unavailable
+    """
+
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+
+    return pages * os.sysconf('SC_PAGE_SIZE')
+
+
+
+class RSSSampler:
+    """
+    Samples resident memory of this process in a thread,
+    keeping the peak since it started. Spikes shorter than
+    the interval can be missed
+    """
+
+    def __init__(self, interval=RSS_INTERVAL):
+        self.start_rss = self.peak = current_rss()
+        self.stopped = threading.Event()
+        self.thread = None
+        if self.start_rss is not None:
+            self.thread = threading.Thread(target=self.sample, args=(interval,),
+                                           daemon=True)
+            self.thread.start()
+
+    def sample(self, interval):
+        while not self.stopped.wait(interval):
+            self.peak = max(self.peak, current_rss() or 0)
+
+    def stop(self):
+        """
+        :returns: Tuple of peak resident bytes and their growth
+                  over the start, None where /proc is unavailable
+        """
+
+        if self.thread is None:
+            return None, None
+
+        self.stopped.set()
+        self.thread.join()
+        self.peak = max(self.peak, current_rss() or 0)
+
+        return self.peak, self.peak - self.start_rss
+
+
+
+@contextlib.contextmanager
+def stage(name):
+    """
+    Records a pipeline stage running in this process. CPU
+    time covers this process and commands it waited for.
+    Memory is the peak resident size of this process while
+    the stage runs, sampled, and its growth over the size
+    the stage started at
+
+    :param name: Name in trace
+    """
+
+    start = time.time()
+    sampler = RSSSampler()
+    self_start = resource.getrusage(resource.RUSAGE_SELF)
+    children_start = resource.getrusage(resource.RUSAGE_CHILDREN)
+    read_start, write_start = proc_io()
+    status = 'ok'
+
+    try:
+        yield
+    except BaseException as e:
+        status = type(e).__name__
+        raise
+    finally:
+        self_end = resource.getrusage(resource.RUSAGE_SELF)
+        children_end = resource.getrusage(resource.RUSAGE_CHILDREN)
+        read_end, write_end = proc_io()
+        peak_rss, rss_growth = sampler.stop()
+
+        def spent(field):
+            return (getattr(self_end, field) - getattr(self_start, field) +
+                    getattr(children_end, field) -
+                    getattr(children_start, field))
+
+        emit({'type': 'stage', 'name': name, 'start': start,
+              'wall': time.time() - start,
+              'user': spent('ru_utime'), 'sys': spent('ru_stime'),
+              'max_rss': peak_rss, 'rss_growth': rss_growth,
+              'read_bytes': (None if read_start is None
+                             else read_end - read_start),
+              'write_bytes': (None if write_start is None
+                              else write_end - write_start),
+              'status': status, 'pid': os.getpid()})
+
+
+
+def load_trace(fp):
+    """
+    Reads the events of a trace file
+
+    :param fp: Path to trace file
+    :returns: DataFrame of events
+    """
+
+    with open(fp) as f:
+        events = [json.loads(line) for line in f if line.strip()]
+
+    return pd.DataFrame(events)
+
+
+
+def summarize(fp):
+    """
+    Prints a table of time and resources per stage and
+    command, largest wall time first
+
+    :param fp: Path to trace file
+    """
+
+    events = load_trace(fp)
+    if events.empty:
+        return
+
+    events['failed'] = ~events['status'].isin(['ok', 0])
+    if 'rss_growth' not in events:
+        events['rss_growth'] = None
+    summary = events.groupby(['type', 'name']).agg(
+        runs=('wall', 'size'), wall=('wall', 'sum'), user=('user', 'sum'),
+        sys=('sys', 'sum'), max_rss=('max_rss', 'max'),
+        rss_growth=('rss_growth', 'max'),
+        read=('read_bytes', 'sum'), written=('write_bytes', 'sum'),
+        failed=('failed', 'sum'))
+    summary = summary.sort_values('wall', ascending=False)
+
+    # Memory is each stage's or command's own peak, and the
+    # most a stage grew this process by ('-' if unknown)
+    def mb(value):
+        return '-' if pd.isna(value) else '{:.1f}'.format(value / 1e6)
+
+    print('***resource summary, trace at {}***'.format(fp))
+    print('  {:<8}{:<38}{:>5}{:>10}{:>10}{:>10}{:>10}{:>10}{:>10}{:>7}'
+          .format('type', 'name', 'runs', 'wall s', 'cpu s', 'peak MB',
+                  'growth MB', 'read MB', 'write MB', 'failed'))
+    for (kind, name), row in summary.iterrows():
+        print('  {:<8}{:<38}{:>5}{:>10.1f}{:>10.1f}{:>10}{:>10}{:>10.1f}'
+              '{:>10.1f}{:>7}'.format(kind, name[:37], int(row['runs']),
+                                      row['wall'], row['user'] + row['sys'],
+                                      mb(row['max_rss']), 
+                                      mb(row['rss_growth']),
+                                      row['read'] / 1e6, row['written'] / 1e6,
+                                      int(row['failed'])))
+
+    return
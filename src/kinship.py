@@ -0,0 +1,158 @@
+"""  Relatedness
+
+kinship.py estimates kinship and identity-by-state between
+every pair of samples from counts of shared genotypes,
+accumulated as sample x sample products of genotype
+indicator matrices over variant blocks in worker threads
+and added into one set of totals, and picks a large set
+of samples without close relatives.
+
+"""
+
+# Importing libraries
+import numpy as np
+import threading
+import os
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from genotype import unpack_dosages
+
+Relatedness = namedtuple('Relatedness', ['kinship', 'ibs', 'called'])
+
+# Bytes of working memory all threads may use at once
+MEMORY_BUDGET = 4 * 1024 ** 3
+
+
+
+def block_counts(geno, index, samples=None):
+    """
+    Helper function for 'relatedness'. Counts genotype
+    pairs of every two samples over one block of variants,
+    as products of genotype indicator matrices
+
+    :param geno: GenotypeData returned by 'genotype.load_bed'
+    :param index: Sorted array of variant indices
+    :param samples: Boolean mask of samples to keep (default all)
+    :returns: Tuple of float32 arrays (samples x samples) of
+              het/het pairs, opposite homozygote pairs,
+              hets of the row sample where both are called,
+              summed allele differences and jointly called
+              variants
+    """
+
+    dosage = unpack_dosages(geno.packed[index], len(geno.samples))
+    if samples is not None:
+        dosage = dosage[:, samples]
+
+    hom_ref, het, hom_alt = [(dosage == d).astype(np.float32)
+                             for d in range(3)]
+    called = hom_ref + het + hom_alt
+
+    het_het = het.T @ het
+    ref_het = hom_ref.T @ het
+    het_alt = het.T @ hom_alt
+    ref_alt = hom_ref.T @ hom_alt
+
+    # Opposite homozygotes share no allele, and each other
+    # step between genotypes differs by one allele
+    ibs0 = ref_alt + ref_alt.T
+    hets = ref_het.T + het_het + het_alt
+    diffs = ref_het + ref_het.T + het_alt + het_alt.T + 2 * ibs0
+
+    # Counts stay exact in float32 below 2^24 variants a block
+    return het_het, ibs0, hets, diffs, called.T @ called
+
+
+
+def block_bytes(n_samples, block_size):
+    """
+    Helper function for 'relatedness'. Estimates the peak
+    memory of counting one block of variants
+
+    :param n_samples: Number of samples kept
+    :param block_size: Number of variants per block
+    :returns: Integer bytes
+    """
+
+    # Four float32 indicator matrices, and the products and
+    # sums of 'block_counts' held at once
+    return 4 * (4 * block_size * n_samples + 10 * n_samples ** 2)
+
+
+
+def relatedness(geno, block_size=10000, variants=None, samples=None,
+                jobs=None, memory=MEMORY_BUDGET):
+    """
+    Computes KING-robust kinship coefficients, which hold
+    up under population structure, and identity by state,
+    the fraction of alleles shared. Both are taken over
+    jointly called variants. Variant blocks are counted in
+    worker threads, as NumPy releases the GIL in matrix
+    products, and added into one set of float64 totals
+    under a lock. Besides those five sample x sample
+    totals, each thread holds the counts of one block, so
+    threads are capped to fit the memory budget
+
+    :param geno: GenotypeData returned by 'genotype.load_bed'
+    :param block_size: Number of variants per block
+    :param variants: Boolean mask of variants to keep (default all)
+    :param samples: Boolean mask of samples to keep (default all)
+    :param jobs: Number of worker threads (default CPU count)
+    :param memory: Bytes of block counts all threads may
+                   hold at once, leaving at least one thread
+    :returns: Relatedness of kinship and IBS matrices and
+              jointly called variant counts (samples x samples)
+    """
+
+    index = (np.arange(len(geno.variants)) if variants is None
+             else np.flatnonzero(variants))
+    n_samples = len(geno.samples) if samples is None else samples.sum()
+    jobs = max(1, min(jobs or os.cpu_count(),
+                      memory // block_bytes(n_samples, block_size)))
+
+    totals = [np.zeros((n_samples, n_samples)) for _ in range(5)]
+    lock = threading.Lock()
+
+    def accumulate(start):
+        counts = block_counts(geno, index[start:start+block_size], samples)
+        with lock:
+            for total, part in zip(totals, counts):
+                total += part
+
+    # Consuming results so worker errors are raised
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        list(pool.map(accumulate, range(0, len(index), block_size)))
+    het_het, ibs0, hets, diffs, called = totals
+
+    kinship = (het_het - 2 * ibs0) / np.maximum(hets + hets.T, 1)
+    ibs = 1 - diffs / np.maximum(2 * called, 1)
+
+    return Relatedness(kinship, ibs, called)
+
+
+
+def unrelated(kinship, threshold=0.0884):
+    """
+    Drops one sample of every pair related above the
+    threshold, repeatedly removing the sample with the most
+    remaining relatives so as few as possible are dropped
+
+    :param kinship: Kinship matrix from 'relatedness'
+    :param threshold: Kinship coefficient threshold (default
+                      0.0884, second-degree relatives)
+    :returns: Boolean mask of samples kept
+    """
+
+    related = kinship > threshold
+    np.fill_diagonal(related, False)
+    related = related & related.T
+
+    keep = np.ones(len(kinship), dtype=bool)
+    counts = related.sum(axis=1)
+    while counts.max(initial=0) > 0:
+        drop = counts.argmax()
+        keep[drop] = False
+        counts -= related[drop] & keep
+        counts[drop] = 0
+
+    return keep
@@ -0,0 +1,155 @@
+"""  LD Pruning
+
+ld.py prunes variants in linkage disequilibrium with a
+sliding window over each chromosome, keeping one variant
+of every highly correlated pair. Pairwise r^2 is computed
+as dot products of normalized genotype rows, and
+chromosomes are pruned in parallel.
+
+"""
+
+# Importing libraries
+import numpy as np
+import os
+from concurrent.futures import ProcessPoolExecutor
+from genotype import unpack_dosages
+from store import load_genotypes
+from decomposition import standardize
+
+
+
+def normalized_rows(geno, index, samples=None):
+    """
+    Loads variants as unit-length rows of standardized
+    genotypes, so their dot products are correlations
+
+    :param geno: GenotypeData returned by 'genotype.load_bed'
+    :param index: Sorted array of variant indices
+    :param samples: Boolean mask of samples to keep (default all)
+    :returns: Tuple of float32 rows (variants x samples) and
+              minor allele frequencies
+    """
+
+    dosage = unpack_dosages(geno.packed[index], len(geno.samples))
+    if samples is not None:
+        dosage = dosage[:, samples]
+
+    called = dosage >= 0
+    alt = np.where(called, dosage, 0).sum(axis=1, dtype=np.int64)
+    freqs = alt / np.maximum(2 * called.sum(axis=1), 1)
+
+    rows = standardize(dosage, freqs)
+    norms = np.linalg.norm(rows, axis=1, keepdims=True)
+    rows /= np.where(norms > 0, norms, 1)
+
+    return rows, np.minimum(freqs, 1 - freqs)
+
+
+
+def prune_window(r2, mafs, threshold):
+    """
+    Helper function for 'prune_contig'. Greedily removes
+    one variant of each pair above the threshold, dropping
+    the one with the lower minor allele frequency
+
+    :param r2: Matrix of pairwise r^2 within the window
+    :param mafs: Minor allele frequency of each variant
+    :param threshold: r^2 threshold
+    :returns: Boolean mask of variants kept in the window
+    """
+
+    keep = np.ones(len(mafs), dtype=bool)
+    linked = np.triu(r2 > threshold, k=1)
+
+    for i in np.flatnonzero(linked.any(axis=1)):
+        if not keep[i]:
+            continue
+        for j in np.flatnonzero(linked[i] & keep):
+            if mafs[i] < mafs[j]:
+                keep[i] = False
+                break
+            keep[j] = False
+
+    return keep
+
+
+
+def prune_contig(path, index, window=50, step=5, threshold=0.2,
+                 samples=None, block_size=10000):
+    """
+    Prunes the variants of one chromosome
+
+    :param path: Path to genotype store or .bed fileset prefix
+    :param index: Sorted indices of the chromosome's candidate
+                  variants, in position order
+    :param window: Window size in variants
+    :param step: Number of variants the window moves by
+    :param threshold: r^2 threshold
+    :param samples: Boolean mask of samples to keep (default all)
+    :param block_size: Number of variants loaded at once
+    :returns: Array of kept variant indices
+    """
+
+    geno = load_genotypes(path)
+    keep = np.ones(len(index), dtype=bool)
+    seg_start, seg_stop = 0, 0
+
+    for start in range(0, len(index), step):
+
+        # Loading next segment, overlapping by one window
+        if start + window > seg_stop and seg_stop < len(index):
+            seg_start = start
+            seg_stop = min(start + block_size + window, len(index))
+            rows, mafs = normalized_rows(geno, index[seg_start:seg_stop],
+                                         samples)
+
+        # Correlating remaining variants in window
+        local = np.flatnonzero(keep[start:start + window]) + start
+        if len(local) < 2:
+            continue
+
+        z = rows[local - seg_start]
+        r2 = np.square(z @ z.T)
+        kept = prune_window(r2, mafs[local - seg_start], threshold)
+        keep[local[~kept]] = False
+
+    return index[keep]
+
+
+
+def ld_prune(path, window=50, step=5, threshold=0.2, variants=None,
+             samples=None, block_size=10000, jobs=None):
+    """
+    Prunes variants in linkage disequilibrium, running
+    chromosomes in parallel worker processes
+
+    :param path: Path to genotype store or .bed fileset prefix
+    :param window: Window size in variants
+    :param step: Number of variants the window moves by
+    :param threshold: r^2 threshold
+    :param variants: Boolean mask of candidate variants (default all)
+    :param samples: Boolean mask of samples to keep (default all)
+    :param block_size: Number of variants loaded at once per worker
+    :param jobs: Number of worker processes (default CPU count)
+    :returns: Boolean mask of variants kept
+    """
+
+    geno = load_genotypes(path)
+    if variants is None:
+        variants = np.ones(len(geno.variants), dtype=bool)
+
+    # Grouping candidate variants by chromosome, in file order
+    chroms = geno.variants['Chrom'].to_numpy()
+    candidates = np.flatnonzero(variants)
+    groups = [candidates[chroms[candidates] == chrom]
+              for chrom in dict.fromkeys(chroms[candidates])]
+
+    keep = np.zeros(len(geno.variants), dtype=bool)
+    with ProcessPoolExecutor(max_workers=jobs or os.cpu_count()) as pool:
+        futures = [pool.submit(prune_contig, path, index, window, step,
+                               threshold, samples, block_size)
+                   for index in groups]
+        for future in futures:
+            keep[future.result()] = True
+
+    return keep
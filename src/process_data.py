@@ -1,7 +1,8 @@
 """  Data Processing and Plotting
 
-process_data.py processes VCF file data using PLINK2 and
-plots final results.
+process_data.py processes VCF file data into a packed
+genotype store, filters it, runs PCA on the filtered
+genotypes and plots final results.
 
 """
 
@@ -10,10 +11,48 @@ import pandas as pd
 import numpy as np
 import plotly.graph_objs as go
 import plotly.offline as ply
-import subprocess as sp
+import instrument
+import runner
+import pysam
+import json
 import os
+from read_data import open_vcf, read_vcf_header, read_vcf_chunks, VCF_FIXED
+from bgzf import (BgzfWriter, is_bgzf, read_blocks, block_length, 
+                  decompress_block)
+from genotype import gt_to_dosage
+from store import build_store, load_store, store_stats, SHARD_SIZE
+from qc import qc_masks, save_stats, load_stats
+from decomposition import (allele_freqs, randomized_pca, gram_matrix, 
+                           gram_eigen, gram_pca, project)
+from ld import ld_prune
+from kinship import relatedness, unrelated
+from cluster import (minibatch_kmeans, gmm_diag, best_of, adjusted_rand, 
+                     normalized_mutual_info)
+from cache import cached_stage, stage_key
 
 SH_PATH = 'src/process_data.sh'
+INPUT_LIST = 'data/temp/input.list'
+FULL_VCF = 'data/temp/full_chroms.vcf.gz'
+STORE_DIR = 'data/temp/store'
+QC_STATS = 'data/temp/qc_stats.npz'
+QC_MASK = 'data/temp/qc_mask.npz'
+LD_MASK = 'data/temp/ld_mask.npz'
+KINSHIP_MASK = 'data/temp/kinship_mask.npz'
+RELATED_FP = 'data/temp/related.csv'
+PCS_FP = 'data/temp/pcs.csv'
+PCA_FP = 'data/temp/pca.npz'
+OUTLIERS_FP = 'data/temp/outliers.txt'
+CLUSTERS_FP = 'data/temp/clusters.csv'
+CLUSTER_METRICS = 'data/temp/cluster_metrics.json'
+MODEL_NAME = 'pca_model.npz'
+
+# Samples up to which PCA decomposes a sample Gram matrix
+# in memory, streaming genotypes through randomized PCA above
+GRAM_MAX_SAMPLES = 4000
+
+# Variants below which kinship estimates are too noisy to
+# tell relatives apart, so no samples are dropped
+MIN_KINSHIP_VARIANTS = 1000
 
 
 
@@ -25,13 +64,13 @@ def gather_fnames(data_fp):
     :param data_fp: Path where data is housed
     """
     
-    input_fp = "data/temp/input.list"
+    input_fp = INPUT_LIST
     f_1 = open(input_fp, "w")
     
     # Extracting filepaths for files of interest
     clean_fp = data_fp.replace('\\', '')
     arg2 = 's/^/{}/'.format(data_fp)
-    sp.call(['sh', SH_PATH, 'create_list', clean_fp, arg2, input_fp])
+    runner.run(['sh', SH_PATH, 'create_list', clean_fp, arg2, input_fp])
     
     f_1.close()
 
@@ -39,18 +78,162 @@ def gather_fnames(data_fp):
 
 
 
-def concat_vcfs():
+def read_header(fp):
+    """
+    Helper function for 'concat_vcfs'. Reads VCF header.
+    
+    :param fp: Path to VCF file
+    :returns: Tuple of header text and column names
+    """
+    
+    with open_vcf(fp) as f:
+        meta, columns = read_vcf_header(f)
+        
+    text = '\n'.join(meta + ['\t'.join(columns)]) + '\n'
+        
+    return text, columns
+
+
+
+def copy_bgzf_body(fp, writer):
+    """
+    Helper function for 'concat_vcfs'. Copies records of
+    a BGZF VCF file, recompressing only the blocks that
+    contain header lines.
+    
+    :param fp: Path to BGZF VCF file
+    :param writer: BgzfWriter of concatenated file
+    :returns: Last byte of records copied
+    """
+    
+    in_header, line_start = True, True
+    last_block, last_data = None, b'\n'
+    
+    with open(fp, 'rb') as f:
+        for block in read_blocks(f):
+            if block_length(block) == 0:
+                continue
+                
+            # Copying blocks past the header untouched
+            if not in_header:
+                writer.write_block(block)
+                last_block = block
+                continue
+                
+            # Skipping header lines within block
+            data = decompress_block(block)
+            pos = 0
+            while pos < len(data):
+                if line_start and data[pos:pos+1] != b'#':
+                    in_header = False
+                    break
+                newline = data.find(b'\n', pos)
+                line_start = newline >= 0
+                pos = len(data) if newline < 0 else newline + 1
+                
+            if not in_header and pos < len(data):
+                writer.write(data[pos:])
+                last_data = data[pos:]
+                
+    if last_block is not None:
+        last_data = decompress_block(last_block)
+        
+    return last_data[-1:]
+
+
+
+def copy_gzip_body(fp, writer):
+    """
+    Helper function for 'concat_vcfs'. Copies records of
+    a plain or gzip compressed VCF file.
+    
+    :param fp: Path to VCF file
+    :param writer: BgzfWriter of concatenated file
+    :returns: Last byte of records copied
+    """
+    
+    with open_vcf(fp, binary=True) as f:
+        
+        # Skipping header lines
+        line = f.readline()
+        while line.startswith(b'#'):
+            line = f.readline()
+        
+        writer.write(line)
+        last = line[-1:] or b'\n'
+        
+        for data in iter(lambda: f.read(1 << 22), b''):
+            writer.write(data)
+            last = data[-1:]
+            
+    return last
+
+
+
+def concat_vcfs(threads=None):
     """
     Gathers all VCF file paths inside a .list file, accesses 
     those paths, and concatenates all the corresponding VCF 
-    files together.
+    files together into a BGZF file with a tabix index.
+    Records of BGZF inputs are copied block by block, other
+    inputs are recompressed in parallel.
+    
+    :param threads: Number of compression threads
+                    (default all cores)
     """
     
-    # Storing VCF header 
-    sp.call(['sh', SH_PATH, 'header'])
+    with open(INPUT_LIST) as f:
+        fps = [l.strip() for l in f if l.strip()]
+        
+    # Checking headers share the same samples
+    header, columns = read_header(fps[0])
+    for fp in fps[1:]:
+        if read_header(fp)[1] != columns:
+            raise ValueError('Columns of {} do not match {}'
+                             .format(fp, fps[0]))
+    
+    # Storing VCF header, concatenating VCF records
+    with BgzfWriter(FULL_VCF, threads) as writer:
+        writer.write(header.encode())
+        
+        for fp in fps:
+            if is_bgzf(fp):
+                last = copy_bgzf_body(fp, writer)
+            else:
+                last = copy_gzip_body(fp, writer)
+                
+            if last != b'\n':
+                writer.write(b'\n')
+                
+    # Indexing concatenated file
+    pysam.tabix_index(FULL_VCF, preset='vcf', force=True)
+    
+    return
+
 
-    # Concatenating VCF files
-    sp.call(['sh', SH_PATH, 'concatenate'])
+
+def make_store(fps, block_size=10000):
+    """
+    Packs VCF files into the sharded genotype store used by
+    every later stage, re-ingesting only changed files
+    
+    :param fps: List of paths to VCF files
+    :param block_size: Number of records read at once
+    """
+    
+    build_store(fps, STORE_DIR, chunksize=block_size)
+    
+    return
+
+
+
+def compute_stats():
+    """
+    Assembles QC statistics of the genotype store from
+    metadata saved with its shards
+    """
+    
+    save_stats(store_stats(STORE_DIR), QC_STATS)
     
     return
 
@@ -58,87 +241,399 @@ def concat_vcfs():
 
 def filter_vcf(maf, geno, mind):
     """
-    Filters VCF file using PLINK2
+    Filters genotypes to SNPs passing MAF and missingness
+    thresholds, writing keep-masks from stored QC statistics
     
     :param maf: Minor allele frequency threshold
     :param geno: SNP missing call rate threshold
     :param mind: Sample missing call rate threshold
+    :returns: Tuple of variant and sample keep-masks
     """
     
-    sp.call(['sh', SH_PATH, 'filter', str(maf), str(geno), str(mind)])
+    stats = load_stats(QC_STATS)
+    
+    # Writing keep-masks
+    variants, samples = qc_masks(stats, maf, geno, mind)
+    np.savez(QC_MASK, variants=variants, samples=samples)
     
-    return 
+    return variants, samples
 
 
 
-def check_outliers():
+def load_masks():
     """
-    Checks if outliers exist in eigenvector data
-    produced from PLINK2's PCA output  
+    Loads keep-masks written by 'filter_vcf'
+    
+    :returns: Tuple of variant and sample keep-masks
     """
+    
+    with np.load(QC_MASK) as masks:
+        return masks['variants'], masks['samples']
+
 
-    # Reading in principal component data
-    pcs = (pd.read_csv(
-             'data/temp/chrom_pc.eigenvec', sep=' ', header=None)
-             .rename(columns={1:'Sample', 2:'PC1', 3:'PC2', 4:'PC3'}))
+
+def prune_ld(window, step, r2, block_size=10000):
+    """
+    Prunes filtered variants in linkage disequilibrium,
+    writing the variant keep-list used by PCA
+    
+    :param window: Window size in variants
+    :param step: Number of variants the window moves by
+    :param r2: r^2 threshold
+    :param block_size: Number of variants held in memory at once
+    :returns: Boolean mask of variants kept
+    """
+    
+    variants, samples = load_masks()
+    pruned = ld_prune(STORE_DIR, window, step, r2, variants, samples, 
+                      block_size)
+    np.savez(LD_MASK, variants=pruned)
+    
+    print('***LD pruning kept {} of {} variants***'.format(pruned.sum(), 
+                                                         variants.sum()))
+    
+    return pruned
+
+
+
+def filter_related(max_kinship, block_size=10000, 
+                   min_variants=MIN_KINSHIP_VARIANTS):
+    """
+    Drops one sample of every pair related above the kinship
+    threshold, estimated on filtered, LD-pruned variants,
+    writing the sample keep-mask used by PCA and the list
+    of related pairs. With fewer than 'min_variants' variants
+    every sample is kept
+    
+    :param max_kinship: Kinship coefficient threshold
+    :param block_size: Number of variants held in memory at once
+    :param min_variants: Fewest variants kinship is estimated on
+    :returns: Boolean mask of samples kept
+    """
+    
+    _, samples = load_masks()
+    with np.load(LD_MASK) as pruned:
+        variants = pruned['variants']
+    
+    # Skipping estimates dominated by noise
+    if variants.sum() < min_variants:
+        print('***relatedness filter skipped: {} variants, fewer than {}***'
+              .format(variants.sum(), min_variants))
+        pd.DataFrame(columns=['Sample1', 'Sample2', 'Kinship', 'IBS', 
+                              'Called']).to_csv(RELATED_FP, index=False)
+        np.savez(KINSHIP_MASK, samples=samples)
+        return samples
+    
+    geno = load_store(STORE_DIR)
+    rel = relatedness(geno, block_size, variants, samples)
+    keep = unrelated(rel.kinship, max_kinship)
+    
+    # Writing pairs above the threshold
+    ids = geno.samples['IID'].to_numpy()[samples]
+    first, second = np.nonzero(np.triu(rel.kinship > max_kinship, k=1))
+    pd.DataFrame({'Sample1': ids[first], 'Sample2': ids[second],
+                  'Kinship': rel.kinship[first, second],
+                  'IBS': rel.ibs[first, second],
+                  'Called': rel.called[first, second].astype(int)}
+                ).to_csv(RELATED_FP, index=False)
+    
+    unrelated_samples = samples.copy()
+    unrelated_samples[np.flatnonzero(samples)[~keep]] = False
+    np.savez(KINSHIP_MASK, samples=unrelated_samples)
+    
+    print('***relatedness filter: {} related pairs, dropped {} of {} '
+          'samples***'.format(len(first), (~keep).sum(), len(keep)))
+    
+    return unrelated_samples
+
+
+
+def check_outliers(pcs):
+    """
+    Checks if outliers exist in principal component data
+    
+    :param pcs: DataFrame of principal components per sample
+    :returns: List of outlier sample IDs
+    """
 
     # Calculating z_scores
-    z_scores = (pcs[['PC1', 'PC2', 'PC3']]
-                   .apply(lambda x: (x-x.mean())/x.std(), axis=0))
+    pc_cols = [c for c in ['PC1', 'PC2', 'PC3'] if c in pcs]
+    z_scores = (pcs[pc_cols] - pcs[pc_cols].mean()) / pcs[pc_cols].std()
 
     # Finding outlier samples
-    check_outlier = z_scores.apply(lambda x: abs(x) > 3, axis=0)
-    outliers = check_outlier[check_outlier.any(axis='columns')].index
-    outlier_samps = pcs.loc[outliers][[0, 'Sample']]
+    check_outlier = z_scores.abs() > 3
+    outlier_samps = pcs.loc[check_outlier.any(axis='columns'), 'Sample']
+
+    return list(outlier_samps)
+
+
+
+def pca(num_pca, block_size=10000, variants=None, samples=None, 
+        max_rounds=5, gram_max_samples=GRAM_MAX_SAMPLES):
+    """
+    Runs PCA on filtered genotypes, removing outliers over
+    rounds. Up to 'gram_max_samples' samples, genotypes are
+    read once into a sample Gram matrix, and each round
+    decomposes its submatrix of remaining samples in memory.
+    Larger sample sets would need quadratic memory and cubic
+    time that way, so each round streams genotypes through
+    randomized PCA instead, started from the components of
+    the round before
+    
+    :param num_pca: Number of principle components
+    :param block_size: Number of variants held in memory at once
+    :param variants: Boolean mask of variants to keep
+    :param samples: Boolean mask of samples to keep
+    :param max_rounds: Maximum number of outlier removal rounds
+    :param gram_max_samples: Most samples decomposed from a
+                             Gram matrix
+    :returns: DataFrame of principal components per sample,
+              the PCAResult it was built from and the list
+              of outlier sample IDs
+    """
+    
+    geno = load_store(STORE_DIR)
+    if samples is None:
+        samples = np.ones(len(geno.samples), dtype=bool)
     
-    # Checks if outliers exists
-    if len(outlier_samps) > 0:
-        # Writing outliers to text file
-        outlier_samps.to_csv('data/temp/outliers.txt', sep= ' ', 
-                             header=False, index=False)
-        return True
+    ids = geno.samples['IID'].to_numpy()[samples]
+    use_gram = len(ids) <= gram_max_samples
+    if use_gram:
+        freqs = allele_freqs(geno, block_size, variants, samples)
+        gram = gram_matrix(geno, freqs, block_size, variants, samples)
+    
+    # Removing outliers until none remain
+    keep = np.ones(len(ids), dtype=bool)
+    outliers = []
+    result, last = None, None
+    for rnd in range(max_rounds + 1):
+        final = samples.copy()
+        final[np.flatnonzero(samples)[~keep]] = False
+        
+        if use_gram:
+            vals, vecs = gram_eigen(gram[np.ix_(keep, keep)], num_pca)
+        else:
+            # Few power iterations refine last round's components
+            # of the samples still kept
+            init = None if result is None else result.eigvecs[keep[last]]
+            result = randomized_pca(geno, num_pca, block_size, variants, 
+                                    final, init=init, 
+                                    n_iter=8 if init is None else 3)
+            vecs, last = result.eigvecs, keep.copy()
+        
+        pcs = pd.DataFrame(vecs, columns=['PC{}'.format(i+1) 
+                                          for i in range(vecs.shape[1])])
+        pcs.insert(0, 'Sample', ids[keep])
+        
+        found = check_outliers(pcs)
+        print('***outlier round {}: {} samples, {} outliers***'.format(
+            rnd, keep.sum(), len(found)))
+        if not found or rnd == max_rounds:
+            break
+            
+        outliers += found
+        keep &= ~np.isin(ids, found)
+    
+    # Computing loadings of final samples
+    if use_gram:
+        result = gram_pca(geno, vecs, vals, block_size, variants, final)
 
-    return False
+    return pcs, result, outliers
 
 
 
-def pca(num_pca, outliers=False):
+def run_pca(num_pca, block_size=10000, max_rounds=5):
     """
-    Runs PCA on VCF file
+    Runs PCA on filtered, LD-pruned genotypes of unrelated
+    samples with outlier removal, and saves the results
     
     :param num_pca: Number of principle components
-    :param outliers: Whether to filter out outliers or not
+    :param block_size: Number of variants held in memory at once
+    :param max_rounds: Maximum number of outlier removal rounds
+    """
+    
+    with np.load(LD_MASK) as pruned:
+        variants = pruned['variants']
+    with np.load(KINSHIP_MASK) as unrelated_samples:
+        samples = unrelated_samples['samples']
+    
+    pcs, result, outliers = pca(num_pca, block_size, variants, samples, 
+                                max_rounds)
+    
+    # Writing outliers to text file, empty if none were found
+    pd.Series(outliers, dtype=object).to_csv(OUTLIERS_FP, sep=' ', 
+                                             header=False, index=False)
+        
+    pcs.to_csv(PCS_FP, index=False)
+    np.savez(PCA_FP, **result._asdict())
+    
+    return
+
+
+
+def run_clustering(n_clusters, restarts=8):
     """
+    Clusters samples on their principal components with
+    mini-batch k-means and a diagonal Gaussian mixture, and
+    scores both against the listed sample populations
+    
+    :param n_clusters: Number of clusters
+    :param restarts: Number of seeds each method is run from,
+                     in parallel, keeping the best fit
+    """
+    
+    pcs = pd.read_csv(PCS_FP)
+    X = pcs.filter(regex='^PC').to_numpy()
+    
+    kmeans = best_of(minibatch_kmeans, X, n_clusters, restarts)
+    gmm = best_of(gmm_diag, X, n_clusters, restarts)
     
-    cmds = ['sh', SH_PATH, 'pca', str(num_pca), '--remove', 
-            'data/temp/outliers.txt', 'data/temp/chrom_pc']
+    clusters = pd.DataFrame({'Sample': pcs['Sample'], 
+                             'KMeans': kmeans.labels, 'GMM': gmm.labels})
+    clusters.to_csv(CLUSTERS_FP, index=False)
     
-    # Removes '--remove [path]' argument from command
-    if not outliers: 
-        cmds[4] = ''
-        cmds[5] = ''
+    # Scoring against populations of listed samples
+    samples = pd.read_csv('references/sample_pop.csv')
+    listed = clusters.merge(samples[['Sample', 'Population']], on='Sample')
+    metrics = {'samples': len(listed), 
+               'kmeans': {'inertia': float(kmeans.inertia)},
+               'gmm': {'loglik': float(gmm.loglik)}}
+    for method, col in [('kmeans', 'KMeans'), ('gmm', 'GMM')]:
+        if len(listed):
+            metrics[method]['ari'] = adjusted_rand(listed[col], 
+                                                   listed['Population'])
+            metrics[method]['nmi'] = normalized_mutual_info(
+                listed[col], listed['Population'])
+        print('***{} clusters: {}***'.format(method, ', '.join(
+            '{} {:.4g}'.format(k, v) for k, v in metrics[method].items())))
+    
+    with open(CLUSTER_METRICS, 'w') as f:
+        json.dump(metrics, f, indent=1)
+    
+    return
+
 
-    # Running PCA
-    sp.call(cmds)
 
+def save_model(fp):
+    """
+    Saves the PCA model, identifying its variants by
+    position and alleles so new samples can be projected
+    without the genotype store
+    
+    :param fp: Path to model file
+    """
+    
+    geno = load_store(STORE_DIR)
+    
+    with np.load(PCA_FP) as pca_result:
+        result = dict(pca_result)
+    variants = geno.variants.iloc[result['variants']]
+    
+    np.savez(fp, chrom=variants['Chrom'].to_numpy(dtype=str),
+             pos=variants['Pos'].to_numpy(), 
+             ref=variants['A2'].to_numpy(dtype=str),
+             alt=variants['A1'].to_numpy(dtype=str), 
+             freqs=result['freqs'], loadings=result['loadings'], 
+             eigvals=result['eigvals'], eigvecs=result['eigvecs'],
+             samples=geno.samples['IID'].to_numpy(dtype=str)[
+                 result['samples']])
+    
     return
 
 
 
-def create_trace(df, pop):
+def site_keys(chroms, pos, ref, alt):
+    """
+    Helper function for 'project_samples'. Builds keys
+    matching variants across files, ignoring 'chr' prefixes
+    
+    :returns: Array of keys
+    """
+    
+    chroms = pd.Series(chroms, dtype=str).str.replace('^chr', '', regex=True)
+    
+    return (chroms + ':' + pd.Series(pos).astype(str) + ':' + 
+            pd.Series(ref, dtype=str) + ':' + 
+            pd.Series(alt, dtype=str)).to_numpy()
+
+
+
+def project_samples(vcf_fps, model_fp, samples=None, block_size=10000):
+    """
+    Genotypes samples at the variants of a saved PCA model
+    and projects them onto its principal components
+    
+    :param vcf_fps: List of paths to VCF files of new samples
+    :param model_fp: Path to model saved by 'save_model'
+    :param samples: List of sample IDs to project (default all)
+    :param block_size: Number of VCF records read at once
+    :returns: DataFrame of principal components per sample,
+              with the number of model variants present in
+              the VCFs and called for each sample, and the
+              fraction of model variants missing
+    """
+    
+    with np.load(model_fp) as model:
+        model = dict(model)
+    keys = site_keys(model['chrom'], model['pos'], model['ref'], model['alt'])
+    index = pd.Index(keys)
+    
+    # Collecting dosages at model variants, missing elsewhere
+    dosage, present = None, np.zeros(len(keys), dtype=bool)
+    for fp in vcf_fps:
+        for chunk in read_vcf_chunks(fp, block_size, VCF_FIXED[:5], samples):
+            found = index.get_indexer(site_keys(chunk['#CHROM'], chunk['POS'],
+                                                chunk['REF'], chunk['ALT']))
+            hits = found >= 0
+            if dosage is None:
+                samples = list(chunk.columns[5:])
+                dosage = np.full((len(keys), len(samples)), -1, dtype=np.int8)
+            elif list(chunk.columns[5:]) != samples:
+                raise ValueError('Samples of {} differ from earlier '
+                                 'VCF files'.format(fp))
+            dosage[found[hits]] = gt_to_dosage(chunk.loc[hits, samples])
+            present[found[hits]] = True
+            
+    if dosage is None:
+        raise ValueError('No VCF records to project')
+    
+    # Projecting onto saved components
+    scores = project(dosage, model['freqs'], model['loadings'], 
+                     model['eigvals'])
+    called = (dosage >= 0).sum(axis=0)
+    
+    pcs = pd.DataFrame(scores, columns=['PC{}'.format(i+1) 
+                                        for i in range(scores.shape[1])])
+    pcs.insert(0, 'Sample', samples)
+    pcs['Sites'] = present.sum()
+    pcs['Called'] = called
+    pcs['Missing'] = 1 - called / max(len(keys), 1)
+    
+    return pcs
+
+
+
+def create_trace(df, pop, decimals=4):
     """
     Helper function for 'plot'. Creates traces 
     for plot.
     
     :param df: DataFrame to create trace for
     :param pop: Population contained in df
+    :param decimals: Number of significant digits kept of
+                     each coordinate, shortening the JSON
+                     embedded in the HTML file
     :returns: Trace
     """
+    
+    coords = [round_coords(df[pc].to_numpy(), decimals) 
+              for pc in ['PC1', 'PC2', 'PC3']]
+    
     trace = go.Scatter3d(
-        x=df['PC1'], y=df['PC2'], 
-        z=df['PC3'], legendgroup="group", 
+        x=coords[0], y=coords[1], 
+        z=coords[2], legendgroup=pop, 
         name=pop, mode="markers",
-        hovertext=df['Sample'], hoverinfo='text', 
+        hovertext='Sample: ' + df['Sample'].astype(str), hoverinfo='text', 
         marker={'size':3}
     )
     
@@ -146,41 +641,131 @@ def create_trace(df, pop):
 
 
 
-def plot(outdir, test=False):
+def round_coords(values, decimals=4):
+    """
+    Helper function for 'create_trace'. Rounds coordinates
+    to a number of significant digits of their range
+    
+    :param values: Array of coordinates
+    :param decimals: Number of significant digits
+    :returns: Rounded array
+    """
+    
+    extent = np.abs(values).max() if len(values) else 0
+    if extent == 0:
+        return values
+    
+    digits = decimals - 1 - int(np.floor(np.log10(extent)))
+    
+    return np.round(values, max(digits, 0))
+
+
+
+def downsample(pcs, max_points, bins=20, seed=0):
+    """
+    Downsamples samples evenly over PC space. Samples are
+    binned on a grid of the first three PCs and dense cells
+    are capped, so sparse groups and outliers are kept
+    
+    :param pcs: DataFrame of principal components per sample
+    :param max_points: Maximum number of samples kept
+    :param bins: Number of grid cells along each PC
+    :param seed: Random seed of the samples kept
+    :returns: DataFrame of kept samples
+    """
+    
+    if len(pcs) <= max_points:
+        return pcs
+    
+    # Assigning samples to grid cells
+    cells = np.zeros(len(pcs), dtype=np.int64)
+    for pc in ['PC1', 'PC2', 'PC3']:
+        values = pcs[pc].to_numpy()
+        edges = np.linspace(values.min(), values.max(), bins + 1)[1:-1]
+        cells = cells * bins + np.searchsorted(edges, values)
+    
+    # Finding the largest cap per cell that fits by binary
+    # search. Samples kept under a cap are the cells smaller
+    # than it in full, plus the cap for every other cell
+    sizes = np.sort(np.bincount(np.unique(cells, return_inverse=True)[1]))
+    prefix = np.concatenate([[0], np.cumsum(sizes)])
+    
+    def kept(cap):
+        small = np.searchsorted(sizes, cap)
+        return prefix[small] + cap * (len(sizes) - small)
+    
+    lo, hi = 1, sizes[-1]
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if kept(mid) <= max_points:
+            lo = mid
+        else:
+            hi = mid - 1
+    cap = lo
+    
+    # Keeping a random 'cap' samples of every cell
+    order = np.random.default_rng(seed).permutation(len(pcs))
+    shuffled = pd.Series(cells[order])
+    rank = shuffled.groupby(shuffled).cumcount().to_numpy()
+    
+    return pcs.iloc[np.sort(order[rank < cap])]
+
+
+
+def plot(pcs, outdir, test=False, max_points=None, clusters=None):
     """
     Plots PCA clusters
     
+    :param pcs: DataFrame of principal components per sample
     :param outdir: Path to output PCA
     :param test: Boolean whether to generate test plot
+    :param max_points: Maximum number of samples plotted,
+                       downsampled evenly over PC space
+                       (default all)
+    :param clusters: DataFrame of cluster labels per sample,
+                     one column per method. Each can be
+                     chosen from a menu to group samples by
+                     instead of population (default none)
     """
     
-    # Reading in principal component data
-    pcs = (pd.read_csv('data/temp/chrom_pc.eigenvec', sep=' ', header=None)
-             .rename(columns={1:'Sample', 2:'PC1', 3:'PC2', 4:'PC3'}))
-
-    # Creating sample-superpopulation pair dictionary and 
-    # mapping to samples in pc data above
-    samples = pd.read_csv('references/sample_pop.csv')
-    samples_dict = samples.set_index('Sample').to_dict()['Population']
-    pcs['Population'] = pcs.loc[:,0].apply(lambda x: samples_dict[x])
-    pcs['Sample'] = pcs['Sample'].apply(lambda x: 'Sample: '+x)
+    # Joining sample-superpopulation pairs onto samples,
+    # unlisted samples are grouped as 'Unknown'
+    samples = pd.read_csv('references/sample_pop.csv', 
+                          dtype={'Population': 'category'})
+    pcs = pcs.merge(samples[['Sample', 'Population']], on='Sample', 
+                    how='left')
+    pcs['Population'] = (pcs['Population'].cat.add_categories('Unknown')
+                         .fillna('Unknown'))
+    
+    groupings = ['Population']
+    if clusters is not None:
+        groupings += [c for c in clusters if c != 'Sample']
+        pcs = pcs.merge(clusters, on='Sample', how='left')
+    
+    if max_points is not None:
+        pcs = downsample(pcs, max_points)
 
     # Plotting first three principle components
     fig = go.Figure()
 
-    # Subsetting data into populations
-    european = pcs[pcs['Population'] == 'European']
-    east_asian = pcs[pcs['Population'] == 'East Asian']
-    mixed_american = pcs[pcs['Population'] == 'Ad Mixed American']
-    south_asia = pcs[pcs['Population'] == 'South Asian']
-    african = pcs[pcs['Population'] == 'African']
-
-    # Adding data to plot
-    fig.add_trace(create_trace(european, 'European'))
-    fig.add_trace(create_trace(east_asian, 'East Asian'))
-    fig.add_trace(create_trace(mixed_american, 'Ad Mixed American'))
-    fig.add_trace(create_trace(south_asia, 'South Asian'))
-    fig.add_trace(create_trace(african, 'African'))
+    # Adding a trace per group present, showing populations
+    # until another grouping is chosen
+    shown = []
+    for grouping in groupings:
+        for name, group in pcs.groupby(grouping, observed=True):
+            name = (str(name) if grouping == 'Population' 
+                    else '{} {}'.format(grouping, name))
+            trace = create_trace(group, name)
+            trace.visible = grouping == 'Population'
+            fig.add_trace(trace)
+            shown.append(grouping)
+    
+    if len(groupings) > 1:
+        buttons = [{'label': grouping, 'method': 'update',
+                    'args': [{'visible': [g == grouping for g in shown]}]}
+                   for grouping in groupings]
+        fig.update_layout(updatemenus=[{'buttons': buttons, 'x': .1, 
+                                        'y': .95}])
 
     if test:
         sample = "Test Sample"
@@ -209,7 +794,10 @@ def plot(outdir, test=False):
 # Driver Function
 # ---------------------------------------------------------------------
 
-def process_data(inpath, maf, geno, mind, num_pca, outdir, test=False):
+def process_data(inpath, maf, geno, mind, num_pca, outdir, ld_window=50,
+                 ld_step=5, ld_r2=0.2, max_kinship=0.0884, max_rounds=5, 
+                 n_clusters=5, restarts=8, block_size=10000, cache_size=20, 
+                 max_points=None, test=False):
     """
     Processes VCF files to generate PCA plot
     
@@ -219,6 +807,18 @@ def process_data(inpath, maf, geno, mind, num_pca, outdir, test=False):
     :param mind: Sample missing call rate threshold
     :param num_pca: Number of principle components
     :param outdir: Directory to output final plot
+    :param ld_window: LD pruning window size in variants
+    :param ld_step: Number of variants the LD window moves by
+    :param ld_r2: LD pruning r^2 threshold
+    :param max_kinship: Kinship coefficient above which one
+                        sample of a pair is dropped
+    :param max_rounds: Maximum number of outlier removal rounds
+    :param n_clusters: Number of clusters found on the PCs
+    :param restarts: Number of seeds each clustering is run from
+    :param block_size: Number of variants held in memory
+                       at once during QC and PCA
+    :param cache_size: Size limit of stage cache in GB
+    :param max_points: Maximum number of samples plotted
     :param test: Boolean whether to generate test plot
     """
     
@@ -233,21 +833,113 @@ def process_data(inpath, maf, geno, mind, num_pca, outdir, test=False):
     
     # Gathers VCF filepaths
     gather_fnames(inpath)
+    with open(INPUT_LIST) as f:
+        fps = [l.strip() for l in f if l.strip()]
+    
+    def stage(name, func, outputs, params=None, inputs=(), parents=()):
+        def traced():
+            with instrument.stage(name):
+                func()
+        return cached_stage(name, traced, outputs, params, inputs, parents,
+                            max_bytes=cache_size * 1e9)
     
-    # Loads and concatentates files together
-    concat_vcfs()
+    # Packs genotypes into shards, in parallel per file. The
+    # store keeps unchanged shards itself, so it is keyed on
+    # its inputs rather than cached
+    with instrument.stage('store'):
+        make_store(fps, block_size)
+    store_key = stage_key('store', {'shard_size': SHARD_SIZE}, inputs=fps)
     
-    # Filters master VCF file
-    filter_vcf(maf, geno, mind)
+    # Filters genotypes
+    stats_key = stage('qc_stats', compute_stats, [QC_STATS], 
+                      parents=[store_key])
+    mask_key = stage('filter', lambda: filter_vcf(maf, geno, mind), [QC_MASK],
+                     {'maf': maf, 'geno': geno, 'mind': mind}, 
+                     parents=[stats_key])
     
-    # Runs initial PCA
-    pca(num_pca, False)
+    # Prunes variants in LD
+    ld_key = stage('ld', lambda: prune_ld(ld_window, ld_step, ld_r2, 
+                                          block_size), [LD_MASK],
+                   {'window': ld_window, 'step': ld_step, 'r2': ld_r2}, 
+                   parents=[store_key, mask_key])
     
-    # Checks for outlier, reruns PCA if any exist
-    if check_outliers():
-        pca(num_pca, True)
+    # Drops related samples
+    kin_key = stage('kinship', lambda: filter_related(max_kinship, 
+                                                      block_size), 
+                    [KINSHIP_MASK, RELATED_FP], 
+                    {'max_kinship': max_kinship, 
+                     'min_variants': MIN_KINSHIP_VARIANTS}, 
+                    parents=[store_key, mask_key, ld_key])
+    
+    # Runs PCA, removing outliers
+    pca_key = stage('pca', 
+                    lambda: run_pca(num_pca, block_size, max_rounds), 
+                    [PCS_FP, PCA_FP, OUTLIERS_FP], 
+                    {'num_pca': num_pca, 'max_rounds': max_rounds}, 
+                    parents=[store_key, ld_key, kin_key])
+        
+    # Clusters samples on principal components
+    stage('cluster', lambda: run_clustering(n_clusters, restarts),
+          [CLUSTERS_FP, CLUSTER_METRICS], 
+          {'n_clusters': n_clusters, 'restarts': restarts}, 
+          inputs=['references/sample_pop.csv'], parents=[pca_key])
         
     # Plots clusters
-    plot(outdir, test)
+    with instrument.stage('plot'):
+        plot(pd.read_csv(PCS_FP), outdir, test, max_points, 
+             pd.read_csv(CLUSTERS_FP))
+    
+    # Saves model for projecting new samples
+    save_model(os.path.join(outdir, MODEL_NAME))
+    
+    return
+
+
+
+def concat_data(inpath, threads=None, **kwargs):
+    """
+    Concatenates the VCF files at a path into one indexed
+    BGZF file, for tools that need the whole genome in a
+    single file. The pipeline itself reads the files
+    separately through the genotype store
+    
+    :param inpath: Location of VCF files
+    :param threads: Number of compression threads
+                    (default all cores)
+    """
+    
+    # Creating temp directory
+    if not os.path.exists('data/temp'):
+        os.makedirs('data/temp')
+    
+    gather_fnames(inpath)
+    concat_vcfs(threads)
+    print('***concatenated VCF saved at {}***'.format(FULL_VCF))
+    
+    return
+
+
+
+def project_data(vcfs, model, outdir, samples=None, **kwargs):
+    """
+    Projects new samples onto a PCA model saved by 
+    'process_data', without re-running the pipeline
+    
+    :param vcfs: List of paths to VCF files of new samples
+    :param model: Path to saved PCA model
+    :param outdir: Directory to output projected components
+    :param samples: List of sample IDs to project (default all)
+    """
+    
+    # Creating out directory
+    if not os.path.exists(outdir):
+        os.makedirs(outdir)
+    
+    pcs = project_samples(vcfs, model, samples)
+    
+    out_fp = os.path.join(outdir, 'projected.csv')
+    pcs.to_csv(out_fp, index=False)
+    print('***projected {} samples at {} model variants, saved at {}***'
+          .format(len(pcs), pcs['Sites'].iloc[0], out_fp))
     
     return
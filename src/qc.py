@@ -0,0 +1,135 @@
+"""  Quality Control
+
+qc.py computes per-variant allele frequency and call rate,
+and per-sample call rate, in a single streaming pass over
+packed genotypes. Thresholds are then applied to the stored
+statistics as keep-masks, without rewriting any data.
+
+"""
+
+# Importing libraries
+import numpy as np
+from collections import namedtuple
+from genotype import iter_blocks
+
+QCStats = namedtuple('QCStats', ['alt_counts', 'called', 'snps',
+                                 'sample_called'])
+
+
+
+def is_snp(variants):
+    """
+    Flags single nucleotide, biallelic variants
+
+    :param variants: Variant table from 'genotype.load_bed'
+    :returns: Boolean array
+    """
+
+    return ((variants['A1'].str.len() == 1) &
+            (variants['A2'].str.len() == 1)).to_numpy()
+
+
+
+def block_counts(dosage, snps):
+    """
+    Counts alternate alleles and calls of a block of variants,
+    and calls per sample over its SNPs. Shared by 'qc_stats'
+    and the genotype store, which counts while ingesting
+
+    :param dosage: Array of dosages (variants x samples), -1
+                   where missing
+    :param snps: Boolean array flagging SNPs of the block
+    :returns: Tuple of per-variant alternate allele counts,
+              per-variant call counts and per-sample call counts
+    """
+
+    calls = dosage >= 0
+    alt_counts = np.where(calls, dosage, 0).sum(axis=1, dtype=np.int64)
+
+    return (alt_counts, calls.sum(axis=1, dtype=np.int64),
+            calls[snps].sum(axis=0, dtype=np.int64))
+
+
+
+def qc_stats(geno, block_size=10000):
+    """
+    Computes QC statistics in one pass over genotype blocks.
+    Sample call counts only cover SNPs, matching the
+    '--snps-only' filter they are applied with
+
+    :param geno: GenotypeData returned by 'genotype.load_bed'
+    :param block_size: Number of variants per block
+    :returns: QCStats of per-variant alternate allele and
+              call counts, SNP flags and per-sample call counts
+    """
+
+    n_variants = len(geno.variants)
+    alt_counts = np.zeros(n_variants, dtype=np.int64)
+    called = np.zeros(n_variants, dtype=np.int64)
+    sample_called = np.zeros(len(geno.samples), dtype=np.int64)
+    snps = is_snp(geno.variants)
+
+    for index, dosage in iter_blocks(geno, block_size):
+        alt_counts[index], called[index], block_called = block_counts(
+            dosage, snps[index])
+        sample_called += block_called
+
+    return QCStats(alt_counts, called, snps, sample_called)
+
+
+
+def save_stats(stats, fp):
+    """
+    Saves QC statistics to a .npz file
+
+    :param stats: QCStats returned by 'qc_stats'
+    :param fp: Path to output file
+    """
+
+    np.savez(fp, **stats._asdict())
+
+    return
+
+
+
+def load_stats(fp):
+    """
+    Loads QC statistics saved by 'save_stats'
+
+    :param fp: Path to .npz file
+    :returns: QCStats
+    """
+
+    with np.load(fp) as data:
+        return QCStats(**{k: data[k] for k in QCStats._fields})
+
+
+
+def qc_masks(stats, maf, geno, mind):
+    """
+    Applies PLINK-style thresholds to QC statistics, keeping
+    SNPs only. Variant statistics cover all samples, so sample
+    and variant filters are applied simultaneously
+
+    :param stats: QCStats returned by 'qc_stats'
+    :param maf: Minor allele frequency threshold
+    :param geno: SNP missing call rate threshold
+    :param mind: Sample missing call rate threshold
+    :returns: Tuple of boolean keep-masks for variants and samples
+    """
+
+    n_samples = len(stats.sample_called)
+    n_snps = stats.snps.sum()
+
+    # Variant missingness and minor allele frequency
+    freqs = stats.alt_counts / np.maximum(2 * stats.called, 1)
+    minor = np.minimum(freqs, 1 - freqs)
+    missing = 1 - stats.called / max(n_samples, 1)
+
+    variants = (stats.snps & (stats.called > 0) &
+                (missing <= geno) & (minor >= maf))
+
+    # Sample missingness over SNPs
+    samples = 1 - stats.sample_called / max(n_snps, 1) <= mind
+
+    return variants, samples
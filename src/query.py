@@ -0,0 +1,114 @@
+"""  Variant Query
+
+query.py looks up the genotypes of a region and a set of
+samples directly from tabix-indexed VCF files. Only the
+BGZF blocks overlapping the region are decompressed, and
+only the requested sample columns are decoded.
+
+"""
+
+# Importing libraries
+import pandas as pd
+import numpy as np
+import pysam
+import os
+from collections import namedtuple
+from genotype import gt_to_dosage
+from read_data import VCF_FIXED
+
+QueryResult = namedtuple('QueryResult', ['variants', 'dosage', 'samples'])
+
+QUERY_COLUMNS = ['#CHROM', 'POS', 'ID', 'REF', 'ALT']
+
+
+
+def index_contigs(path):
+    """
+    Maps contigs to the indexed VCF files containing them
+
+    :param path: Path to a VCF file, or a directory of them
+    :returns: Dictionary of contig names to file paths
+    """
+
+    if os.path.isdir(path):
+        fps = sorted(os.path.join(path, f) for f in os.listdir(path)
+                     if f.endswith('.vcf.gz'))
+    else:
+        fps = [path]
+
+    contigs = {}
+    for fp in fps:
+        if not os.path.exists(fp+'.tbi'):
+            continue
+        with pysam.TabixFile(fp) as tbx:
+            for contig in tbx.contigs:
+                contigs.setdefault(contig, fp)
+
+    return contigs
+
+
+
+def sample_columns(tbx, samples=None):
+    """
+    Helper function for 'query'. Finds the columns of
+    samples in the header of an indexed VCF
+
+    :param tbx: Open pysam TabixFile
+    :param samples: List of sample IDs (default all)
+    :returns: Tuple of sample IDs and column indexes
+    """
+
+    header = list(tbx.header)[-1].split('\t')
+    all_samples = header[len(VCF_FIXED):]
+
+    if samples is None:
+        samples = all_samples
+
+    missing = set(samples) - set(all_samples)
+    if missing:
+        raise KeyError('Samples not in VCF: {}'.format(sorted(missing)))
+
+    positions = {sample: i for i, sample in enumerate(header)}
+
+    return list(samples), [positions[sample] for sample in samples]
+
+
+
+def query(path, chrom, start=None, end=None, samples=None):
+    """
+    Reads genotypes of a region through the tabix index
+
+    :param path: Path to a tabix-indexed VCF file, or a
+                 directory of them such as the raw data
+    :param chrom: Contig name, as in the VCF
+    :param start: First position, 1-based (default contig start)
+    :param end: Last position, inclusive (default contig end)
+    :param samples: List of sample IDs (default all)
+    :returns: QueryResult of variant DataFrame, int8 dosage
+              array (variants x samples, -1 where missing)
+              and sample IDs
+    """
+
+    contigs = index_contigs(path)
+    if chrom not in contigs:
+        raise KeyError('Contig not in indexed VCFs: {}'.format(chrom))
+
+    with pysam.TabixFile(contigs[chrom]) as tbx:
+        samples, columns = sample_columns(tbx, samples)
+
+        # Seeking to region, tabix is 0-based half-open
+        rows = [line.split('\t') for line in
+                tbx.fetch(chrom, None if start is None else start - 1, end)]
+
+    fixed = [row[:len(QUERY_COLUMNS)] for row in rows]
+    variants = pd.DataFrame(fixed, columns=QUERY_COLUMNS)
+    variants['POS'] = variants['POS'].astype(np.int64)
+
+    # Decoding requested samples only
+    gts = [[row[c] for c in columns] for row in rows]
+    if rows:
+        dosage = gt_to_dosage(gts)
+    else:
+        dosage = np.empty((0, len(samples)), dtype=np.int8)
+
+    return QueryResult(variants, dosage, samples)
@@ -9,83 +9,569 @@ and reads them to a pandas data frame.
 import pandas as pd
 import numpy as np
 import pysam
+import gzip
 import io
 from itertools import islice
+from collections import namedtuple
 
 
-def read_vcf(fp):
+VCF_FIXED = ['#CHROM', 'POS', 'ID', 'REF', 'ALT',
+             'QUAL', 'FILTER', 'INFO', 'FORMAT']
+VCF_DTYPES = {'#CHROM': str, 'POS': np.int64, 'ID': str, 'REF': str,
+              'ALT': str, 'QUAL': np.float64, 'FILTER': str,
+              'INFO': str, 'FORMAT': str}
+
+BAM_FIELDS = ['name', 'flag', 'ref_name', 'ref_pos', 'map_quality',
+              'cigar', 'next_ref_name', 'next_ref_pos', 'length', 
+              'seq', 'qual', 'tags']
+BAM_DTYPES = {'flag': np.uint16, 'ref_pos': np.int64,
+              'map_quality': np.uint8, 'next_ref_pos': np.int64,
+              'length': np.int64}
+
+# Per-alignment fields other than bases and Phred scores,
+# written as in SAM ('*' where unavailable)
+BAM_GETTERS = {
+    'name': lambda r: r.query_name,
+    'flag': lambda r: r.flag,
+    'ref_name': lambda r: r.reference_name or '*',
+    'ref_pos': lambda r: r.reference_start + 1,
+    'map_quality': lambda r: r.mapping_quality,
+    'cigar': lambda r: r.cigarstring or '*',
+    'next_ref_name': lambda r: ('*' if r.next_reference_id < 0 else '=' 
+                                if r.next_reference_id == r.reference_id 
+                                else r.next_reference_name),
+    'next_ref_pos': lambda r: r.next_reference_start + 1,
+    'length': lambda r: r.template_length,
+    'tags': lambda r: r.to_dict()['tags']}
+
+BamBlock = namedtuple('BamBlock', ['columns', 'seqs', 'seq_offsets',
+                                   'quals', 'qual_offsets'])
+
+FastqBlock = namedtuple('FastqBlock', ['names', 'name_offsets', 'seqs', 
+                                       'quals', 'offsets', 'separators',
+                                       'separator_offsets'])
+FASTQ_BLOCK = 1 << 24
+PHRED_OFFSET = 33
+NEWLINE, CARRIAGE_RETURN = ord('\n'), ord('\r')
+GC_BASES = np.frombuffer(b'GCgc', dtype=np.uint8)
+
+
+
+def is_gzip(fp):
+    """
+    Checks for gzip magic bytes (BGZF is valid gzip)
+    
+    :param fp: String representing file path
+    :returns: Boolean
+    """
+    
+    with open(fp, 'rb') as f:
+        magic = f.read(2)
+        
+    return magic == b'\x1f\x8b'
+
+
+
+def open_vcf(fp, binary=False):
+    """
+    Opens a VCF file, transparently handling plain, gzip 
+    and BGZF compressed files
+    
+    :param fp: String representing file path to VCF file
+    :param binary: Whether to open in binary mode
+    :returns: File handle
+    """
+    
+    if is_gzip(fp):
+        return gzip.open(fp, 'rb' if binary else 'rt')
+    
+    return open(fp, 'rb' if binary else 'r')
+
+
+
+def read_vcf_header(f):
+    """
+    Reads VCF header, leaving the file handle positioned
+    at the first record
+    
+    :param f: Text file handle returned by 'open_vcf'
+    :returns: Tuple of meta-information lines and
+              column names
+    """
+    
+    meta = []
+    while True:
+        line = f.readline()
+        
+        if not line:
+            raise ValueError('VCF file has no #CHROM header line')
+        elif line.startswith('##'):
+            meta.append(line.rstrip('\n'))
+        elif line.startswith('#'):
+            return meta, line.rstrip('\n').split('\t')
+
+
+
+def read_vcf_chunks(fp, chunksize=10000, columns=None, samples=None):
+    """
+    Reads VCF file in chunks of a fixed number of records
+    
+    :param fp: String representing file path to VCF file
+    :param chunksize: Number of records per chunk
+    :param columns: List of fixed VCF columns to keep
+                    (default all)
+    :param samples: List of sample columns to keep
+                    (default all)
+    :returns: Generator of DataFrames
+    """
+    
+    with open_vcf(fp) as f:
+        _, header = read_vcf_header(f)
+        
+        # Projecting columns and samples of interest
+        fixed = [c for c in header if c in VCF_FIXED]
+        all_samples = header[len(fixed):]
+        if columns is None:
+            columns = fixed
+        if samples is None:
+            samples = all_samples
+            
+        missing = set(samples) - set(all_samples)
+        if missing:
+            raise KeyError('Samples not in VCF: {}'.format(sorted(missing)))
+        
+        usecols = [c for c in fixed if c in columns] + list(samples)
+        dtypes = {c: VCF_DTYPES.get(c, str) for c in usecols}
+        
+        # Streaming records from current file position
+        reader = pd.read_csv(f, sep='\t', header=None, names=header,
+                             usecols=usecols, dtype=dtypes,
+                             keep_default_na=False, na_values={'QUAL': ['.']},
+                             chunksize=chunksize)
+        
+        for chunk in reader:
+            yield chunk[usecols]
+
+
+
+def read_vcf(fp, columns=None, samples=None):
     """
     Reads VCF file
     
     :param fp: String representing file path to VCF file
+    :param columns: List of fixed VCF columns to keep
+                    (default all)
+    :param samples: List of sample columns to keep
+                    (default all)
     """
     
-    # Read VCF line by line
-    with open(fp, 'r') as f:
-        lines = [l for l in f if not l.startswith('##')]
+    # Read VCF chunk by chunk
+    chunks = list(read_vcf_chunks(fp, columns=columns, samples=samples))
         
-    # Convert lines to dataframe
-    vcf_df = pd.read_csv(io.StringIO(''.join(lines)), sep='\t')
+    # Convert chunks to dataframe
+    vcf_df = pd.concat(chunks, ignore_index=True)
         
     return vcf_df
 
 
 
-def read_bam(fp):
+def bam_block(reads, fields, size):
+    """
+    Helper function for 'read_bam_blocks'. Fills columns
+    of up to 'size' alignments into preallocated arrays,
+    packing bases and Phred scores into one buffer each
+
+    :param reads: Iterator of pysam alignments
+    :param fields: List of fields to read
+    :param size: Maximum number of alignments
+    :returns: BamBlock, None when the iterator is exhausted
+    """
+
+    columns = {f: np.empty(size, dtype=BAM_DTYPES.get(f, object))
+               for f in fields if f in BAM_GETTERS}
+    getters = [(columns[f], BAM_GETTERS[f]) for f in columns]
+    seqs, quals = bytearray(), bytearray()
+    seq_offsets = np.zeros(size + 1, dtype=np.int64)
+    qual_offsets = np.zeros(size + 1, dtype=np.int64)
+    read_seq, read_qual = 'seq' in fields, 'qual' in fields
+
+    n = 0
+    for read in islice(reads, size):
+        for column, getter in getters:
+            column[n] = getter(read)
+
+        # Copying bases and Phred scores into one buffer per batch
+        if read_seq and read.query_sequence is not None:
+            seqs += read.query_sequence.encode()
+        if read_qual and read.query_qualities is not None:
+            quals += read.query_qualities
+        n += 1
+        seq_offsets[n], qual_offsets[n] = len(seqs), len(quals)
+
+    if n == 0:
+        return None
+
+    return BamBlock({f: col[:n] for f, col in columns.items()},
+                    np.frombuffer(bytes(seqs), dtype=np.uint8),
+                    seq_offsets[:n + 1],
+                    np.frombuffer(bytes(quals), dtype=np.uint8),
+                    qual_offsets[:n + 1])
+
+
+
+def read_bam_blocks(fp, fields=None, region=None, chunksize=100000):
+    """
+    Reads BAM file in blocks of a fixed number of alignments,
+    reading only the requested fields
+
+    :param fp: String representing file path to BAM file
+    :param fields: List of fields out of BAM_FIELDS to read
+                   (default all)
+    :param region: Samtools region string such as 'chr20' or
+                   'chr20:1000000-2000000', read through the
+                   .bai index (default whole file)
+    :param chunksize: Number of alignments per block
+    :returns: Generator of BamBlocks, holding a column array
+              per field, packed bases, packed Phred scores as
+              uint8 and the offsets of each read into them
+    """
+
+    if fields is None:
+        fields = BAM_FIELDS
+
+    unknown = set(fields) - set(BAM_FIELDS)
+    if unknown:
+        raise KeyError('Unknown BAM fields: {}'.format(sorted(unknown)))
+
+    with pysam.AlignmentFile(fp, mode='rb', check_sq=False) as imported:
+
+        # Seeking region through index, or streaming whole file
+        if region is not None:
+            if not imported.has_index():
+                raise ValueError('Region queries need an index: {}.bai'
+                                 .format(fp))
+            reads = imported.fetch(region=region)
+        else:
+            reads = imported.fetch(until_eof=True)
+
+        while True:
+            block = bam_block(reads, fields, chunksize)
+            if block is None:
+                break
+            yield block
+
+
+
+def read_bam_chunks(fp, fields=None, region=None, chunksize=100000):
+    """
+    Reads BAM file in chunks of a fixed number of alignments,
+    reading only the requested fields
+
+    :param fp: String representing file path to BAM file
+    :param fields: List of fields out of BAM_FIELDS to read
+                   (default all). 'seq' and 'qual' are strings
+                   as in SAM, '*' where missing
+    :param region: Samtools region string read through the
+                   .bai index (default whole file)
+    :param chunksize: Number of alignments per chunk
+    :returns: Generator of DataFrames
+    """
+
+    if fields is None:
+        fields = BAM_FIELDS
+
+    # Decoding packed reads into strings
+    def decode(packed, offsets):
+        text = packed.tobytes().decode()
+        return [text[i:j] or '*' for i, j in zip(offsets[:-1], offsets[1:])]
+
+    for block in read_bam_blocks(fp, fields, region, chunksize):
+        columns = dict(block.columns)
+        if 'seq' in fields:
+            columns['seq'] = decode(block.seqs, block.seq_offsets)
+        if 'qual' in fields:
+            columns['qual'] = decode(block.quals + PHRED_OFFSET, 
+                                     block.qual_offsets)
+        yield pd.DataFrame(columns)[list(fields)]
+
+
+
+def read_bam(fp, fields=None, region=None):
     """
     Reads BAM file
-    
+
     :param fp: String representing file path to BAM file
+    :param fields: List of fields out of BAM_FIELDS to read
+                   (default all)
+    :param region: Samtools region string read through the
+                   .bai index (default whole file)
+    """
+
+    # Read BAM chunk by chunk
+    chunks = list(read_bam_chunks(fp, fields, region))
+    if not chunks:
+        return pd.DataFrame(columns=fields or BAM_FIELDS)
+
+    # Convert chunks to dataframe
+    sam_df = pd.concat(chunks, ignore_index=True)
+
+    return sam_df
+
+
+
+def parse_fastq(buf):
+    """
+    Helper function for 'read_fastq_blocks'. Parses the
+    complete records of a buffer of four-line FASTQ records
+    
+    :param buf: Bytes starting at a record boundary
+    :returns: Tuple of FastqBlock and unparsed trailing bytes
     """
     
-    # Read file, convert to SAM
-    imported = pysam.AlignmentFile(fp, mode = 'rb')
+    arr = np.frombuffer(buf, dtype=np.uint8)
+    newlines = np.flatnonzero(arr == NEWLINE)
+    n = len(newlines) // 4
+    if n == 0:
+        return None, buf
+    
+    # Locating the four lines of each record
+    ends = newlines[:4 * n]
+    starts = np.concatenate([[0], ends[:-1] + 1])
+    ends = ends - (arr[np.maximum(ends - 1, 0)] == CARRIAGE_RETURN)
+    starts, ends = starts.reshape(n, 4), ends.reshape(n, 4)
+    
+    if ((arr[starts[:, 0]] != ord('@')).any() or 
+        (arr[starts[:, 2]] != ord('+')).any()):
+        raise ValueError('Malformed FASTQ record, expected four-line records')
+        
+    lengths = ends[:, 1] - starts[:, 1]
+    if (ends[:, 3] - starts[:, 3] != lengths).any():
+        raise ValueError('FASTQ sequence and quality lengths differ')
+    
+    names, name_offsets = gather_ranges(arr, starts[:, 0] + 1, ends[:, 0])
+    seqs, offsets = gather_ranges(arr, starts[:, 1], ends[:, 1])
+    seps, sep_offsets = gather_ranges(arr, starts[:, 2] + 1, ends[:, 2])
+    quals, _ = gather_ranges(arr, starts[:, 3], ends[:, 3])
+    
+    # Scores below the offset would wrap around in uint8
+    if (quals < PHRED_OFFSET).any():
+        raise ValueError('FASTQ quality characters below {!r}'
+                         .format(chr(PHRED_OFFSET)))
+    quals -= PHRED_OFFSET
+    
+    block = FastqBlock(names, name_offsets, seqs, quals, offsets, seps,
+                       sep_offsets)
+    
+    return block, buf[newlines[4 * n - 1] + 1:]
 
-    # Store lines from SAM
-    sams = []
-    for i in imported:
-        sams.append(i.to_dict())
 
-    # Convert lines to dataframe
-    lines = {}
-    for k in sams[0].keys():
-          lines[k] = tuple(lines[k] for lines in sams)
 
-    sam_df = pd.DataFrame(lines)
+def gather_ranges(arr, starts, ends):
+    """
+    Helper function for 'parse_fastq'. Copies byte ranges
+    into one packed array
     
-    return sam_df
+    :param arr: uint8 array
+    :param starts: Array of range starts
+    :param ends: Array of range ends
+    :returns: Tuple of packed uint8 array and offsets
+    """
+    
+    lengths = ends - starts
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    
+    # Index of every byte is its range start plus its
+    # position within the range
+    index = (np.repeat(starts - offsets[:-1], lengths) + 
+             np.arange(offsets[-1]))
+    
+    return arr[index], offsets
 
 
 
-def read_fastq(fp):
+def read_fastq_blocks(fp, block_size=FASTQ_BLOCK):
     """
-    Reads FASTQ file
+    Reads FASTQ file, plain or gzip compressed, in blocks
+    of records found in large byte buffers
     
     :param fp: String representing file path to FASTQ file
+    :param block_size: Number of bytes read at once
+    :returns: Generator of FastqBlocks, holding packed read
+              names, packed bases, Phred scores as uint8,
+              packed separator lines after the '+' and the
+              offsets of each read into them
     """
     
-    # Lists to store data frame data
-    identifiers, sequences = [], []
-    separators, quality_scores = [], []
-
-    # Reads every four lines, stores data
-    # NOTE: 1 observation = 4 lines in FASTQ
-    with open(fp, "r") as f:
+    opener = gzip.open if is_gzip(fp) else open
+    
+    with opener(fp, 'rb') as f:
+        rest = b''
         while True:
-            next_4_lines = list(islice(f, 4))
-
-            if not next_4_lines:
+            data = f.read(block_size)
+            if not data:
                 break
+            block, rest = parse_fastq(rest + data)
+            if block is not None:
+                yield block
+        
+        # Parsing last record without trailing newline
+        if rest.strip():
+            block, rest = parse_fastq(rest + b'\n')
+            if block is None or rest.strip():
+                raise ValueError('Truncated FASTQ record at end of file')
+            yield block
+
+
+
+def slice_block(block, start, stop):
+    """
+    Selects a range of records of a FastqBlock
+    
+    :param block: FastqBlock
+    :param start: Index of first record
+    :param stop: Index after last record
+    :returns: FastqBlock
+    """
+    
+    lo, hi = block.offsets[start], block.offsets[stop]
+    name_lo = block.name_offsets[start]
+    name_hi = block.name_offsets[stop]
+    sep_lo = block.separator_offsets[start]
+    sep_hi = block.separator_offsets[stop]
+    
+    return FastqBlock(block.names[name_lo:name_hi], 
+                      block.name_offsets[start:stop + 1] - name_lo,
+                      block.seqs[lo:hi], block.quals[lo:hi],
+                      block.offsets[start:stop + 1] - lo,
+                      block.separators[sep_lo:sep_hi],
+                      block.separator_offsets[start:stop + 1] - sep_lo)
+
+
+
+def concat_blocks(blocks):
+    """
+    Joins FastqBlocks
+    
+    :param blocks: List of FastqBlocks
+    :returns: FastqBlock
+    """
+    
+    def join_offsets(offsets):
+        shifts = np.cumsum([0] + [o[-1] for o in offsets[:-1]])
+        return np.concatenate([offsets[0][:1]] + 
+                              [o[1:] + s for o, s in zip(offsets, shifts)])
+    
+    return FastqBlock(np.concatenate([b.names for b in blocks]),
+                      join_offsets([b.name_offsets for b in blocks]),
+                      np.concatenate([b.seqs for b in blocks]),
+                      np.concatenate([b.quals for b in blocks]),
+                      join_offsets([b.offsets for b in blocks]),
+                      np.concatenate([b.separators for b in blocks]),
+                      join_offsets([b.separator_offsets for b in blocks]))
+
+
+
+def read_fastq_pairs(fp1, fp2, block_size=FASTQ_BLOCK):
+    """
+    Reads paired-end FASTQ files in lockstep
+    
+    :param fp1: String representing file path to R1 FASTQ file
+    :param fp2: String representing file path to R2 FASTQ file
+    :param block_size: Number of bytes read at once per file
+    :returns: Generator of (R1, R2) FastqBlock tuples holding
+              the same number of reads
+    """
+    
+    readers = [read_fastq_blocks(fp1, block_size), 
+               read_fastq_blocks(fp2, block_size)]
+    pending = [[], []]
+    counts = [0, 0]
+    exhausted = [False, False]
+    
+    while True:
+        
+        # Reading the side that is behind
+        side = int(counts[1] < counts[0])
+        if not exhausted[side]:
+            block = next(readers[side], None)
+            if block is None:
+                exhausted[side] = True
             else:
-                identifiers.append(next_4_lines[0].replace('\n', ''))
-                sequences.append(next_4_lines[1].replace('\n', ''))
-                separators.append(next_4_lines[2].replace('\n', ''))
-                quality_scores.append(next_4_lines[3].replace('\n', ''))
-
-    fastq_dict = {'identifier': identifiers, 
-                  'sequence': sequences, 
-                  'separator': separators, 
-                  'quality_score':quality_scores}
+                pending[side].append(block)
+                counts[side] += len(block.offsets) - 1
+        
+        # Yielding reads present on both sides
+        n = min(counts)
+        if n > 0:
+            joined = [concat_blocks(p) for p in pending]
+            yield tuple(slice_block(b, 0, n) for b in joined)
+            pending = [[slice_block(b, n, len(b.offsets) - 1)] 
+                       for b in joined]
+            counts = [c - n for c in counts]
+        
+        if exhausted[side] and counts[side] == 0:
+            break
+        
+    if any(counts) or next(readers[1 - side], None) is not None:
+        raise ValueError('Paired FASTQ files have different numbers of reads')
+
+
+
+def read_stats(block):
+    """
+    Computes per-read QC statistics of a FastqBlock
+    
+    :param block: FastqBlock
+    :returns: DataFrame of read length, mean Phred score
+              and GC fraction
+    """
+    
+    lengths = np.diff(block.offsets)
+    starts = block.offsets[:-1]
+    
+    # Summing over each read, empty reads sum to zero
+    def per_read(values):
+        sums = np.add.reduceat(np.append(values, 0), starts) 
+        return np.where(lengths > 0, sums, 0)
+    
+    gc = np.isin(block.seqs, GC_BASES)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        stats = pd.DataFrame({
+            'length': lengths,
+            'mean_quality': per_read(block.quals.astype(np.int64)) / lengths,
+            'gc': per_read(gc.astype(np.int64)) / lengths})
+    
+    return stats
+
+
+
+def read_fastq(fp):
+    """
+    Reads FASTQ file
+    
+    :param fp: String representing file path to FASTQ file
+    """
+    
+    # Read FASTQ block by block
+    blocks = list(read_fastq_blocks(fp))
+    if not blocks:
+        return pd.DataFrame(columns=['identifier', 'sequence', 
+                                     'separator', 'quality_score'])
+    block = concat_blocks(blocks)
+    
+    # Decoding packed reads into strings
+    def decode(packed, offsets):
+        text = packed.tobytes().decode()
+        return [text[i:j] for i, j in zip(offsets[:-1], offsets[1:])]
+    
+    names = decode(block.names, block.name_offsets)
+    separators = decode(block.separators, block.separator_offsets)
+    fastq_dict = {'identifier': ['@' + name for name in names], 
+                  'sequence': decode(block.seqs, block.offsets), 
+                  'separator': ['+' + sep for sep in separators], 
+                  'quality_score': decode(block.quals + PHRED_OFFSET, 
+                                          block.offsets)}
 
     fastq_df = pd.DataFrame(fastq_dict)
     
@@ -0,0 +1,288 @@
+""" Reference Store
+
+reference.py keeps the hg38 reference genome and its FASTA,
+sequence dictionary, BWA indexes and assembly gaps in a
+persistent store. Files are linked from the source directory
+or built once, and recorded with checksums in a manifest so
+later runs only verify them.
+
+"""
+
+# Importing libraries
+import runner
+import hashlib
+import json
+import math
+import re
+import os
+
+REF_ROOT = 'Homo_sapiens_assembly38.fasta'
+REF_SOURCE = ('../../../../datasets/dsc180a-wi20-public/'+
+              'Genome/resources/hg38/')
+REF_STORE = 'data/reference'
+BWA_EXT = ['.amb', '.ann', '.bwt', '.pac', '.sa']
+
+# Shortest run of N bases treated as an assembly gap
+MIN_GAP = 1000
+N_RUN = re.compile(b'[Nn]+')
+
+SH_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                       'conversion.sh')
+
+
+
+def file_record(fp):
+    """
+    Records size, modification time and MD5 checksum of a file
+
+    :param fp: Path to file, symlinks are followed
+    :returns: Dictionary
+    """
+
+    digest = hashlib.md5()
+    with open(fp, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 22), b''):
+            digest.update(block)
+
+    stat = os.stat(fp)
+
+    return {'size': stat.st_size, 'mtime': stat.st_mtime_ns,
+            'md5': digest.hexdigest()}
+
+
+
+def is_valid(fp, record, verify=False):
+    """
+    Checks a file against its manifest record. Size and
+    modification time are always compared, checksums only
+    when verifying
+
+    :param fp: Path to file
+    :param record: Dictionary from 'file_record'
+    :param verify: Whether to recompute the checksum
+    :returns: Boolean
+    """
+
+    if record is None or not os.path.exists(fp):
+        return False
+
+    if verify:
+        return file_record(fp) == record
+
+    stat = os.stat(fp)
+
+    return (stat.st_size, stat.st_mtime_ns) == (record['size'],
+                                                record['mtime'])
+
+
+
+def link(src, dst):
+    """
+    Symlinks a source file into the store
+
+    :param src: Path to source file
+    :param dst: Path in store
+    """
+
+    if os.path.lexists(dst):
+        os.remove(dst)
+    os.symlink(os.path.abspath(src), dst)
+
+    return
+
+
+
+def ensure(manifest, store, names, build, verify=False, force=False):
+    """
+    Rebuilds files of the store that are missing or changed
+
+    :param manifest: Dictionary of file names to records
+    :param store: Path to store directory
+    :param names: File names created together by 'build'
+    :param build: Function without arguments creating the files
+    :param verify: Whether to verify checksums
+    :param force: Whether to rebuild regardless
+    :returns: Boolean whether files were rebuilt
+    """
+
+    paths = [os.path.join(store, name) for name in names]
+    if not force and all(is_valid(fp, manifest.get(name), verify)
+                         for fp, name in zip(paths, names)):
+        return False
+
+    for fp in paths:
+        if os.path.lexists(fp):
+            os.remove(fp)
+
+    build()
+
+    for fp, name in zip(paths, names):
+        manifest[name] = file_record(fp)
+
+    return True
+
+
+
+def find_gaps(fasta, out_fp, min_gap=MIN_GAP):
+    """
+    Finds runs of N bases in a FASTA file and writes them
+    as a BED file
+
+    :param fasta: Path to FASTA file
+    :param out_fp: Path to output BED file
+    :param min_gap: Shortest run of N bases reported
+    """
+
+    contig, pos = None, 0
+    run_start, run_end = None, None
+
+    with open(fasta, 'rb') as f, open(out_fp, 'w') as out:
+
+        def close_run():
+            if run_start is not None and run_end - run_start >= min_gap:
+                out.write('{}\t{}\t{}\n'.format(contig, run_start, run_end))
+
+        for line in f:
+            if line.startswith(b'>'):
+                close_run()
+                contig = line[1:].split()[0].decode()
+                pos, run_start, run_end = 0, None, None
+                continue
+
+            # Extending runs continuing from the previous line
+            seq = line.rstrip()
+            for match in N_RUN.finditer(seq):
+                start, end = pos + match.start(), pos + match.end()
+                if run_end == start:
+                    run_end = end
+                else:
+                    close_run()
+                    run_start, run_end = start, end
+            pos += len(seq)
+
+        close_run()
+
+    return
+
+
+
+def scatter_intervals(ref, n):
+    """
+    Splits the reference into intervals of balanced length,
+    leaving out assembly gaps
+
+    :param ref: Path to reference FASTA in store, with its
+                .fai index and optionally gaps.bed
+    :param n: Number of intervals
+    :returns: List of intervals, each a list of
+              (contig, start, end) segments, 0-based half-open
+    """
+
+    with open(ref+'.fai') as f:
+        contigs = [(l.split('\t')[0], int(l.split('\t')[1])) for l in f]
+
+    gaps = {}
+    gaps_fp = os.path.join(os.path.dirname(ref), 'gaps.bed')
+    if os.path.exists(gaps_fp):
+        with open(gaps_fp) as f:
+            for line in f:
+                contig, start, end = line.split('\t')
+                gaps.setdefault(contig, []).append((int(start), int(end)))
+
+    # Cutting gaps out of contigs
+    segments = []
+    for contig, length in contigs:
+        start = 0
+        for gap_start, gap_end in gaps.get(contig, []) + [(length, length)]:
+            if gap_start > start:
+                segments.append([contig, start, gap_start])
+            start = max(start, gap_end)
+
+    # Filling intervals up to an equal share of bases
+    target = math.ceil(sum(e - s for _, s, e in segments) / n)
+    intervals, filled = [[]], 0
+    for contig, start, end in segments:
+        while start < end:
+            take = end - start
+            if len(intervals) < n:
+                take = min(take, target - filled)
+            intervals[-1].append((contig, start, start + take))
+            filled += take
+            start += take
+
+            if filled >= target and len(intervals) < n:
+                intervals.append([])
+                filled = 0
+
+    return [interval for interval in intervals if interval]
+
+
+
+def prep_reference(source=REF_SOURCE, store=REF_STORE, bwa=True,
+                   gaps=False, verify=False):
+    """
+    Prepares the reference store. The FASTA and any indexes
+    shipped next to it are linked, missing indexes are built,
+    and anything depending on a changed file is rebuilt
+
+    :param source: Directory containing the reference FASTA
+    :param store: Path to store directory
+    :param bwa: Whether BWA indexes are needed
+    :param gaps: Whether a BED file of assembly gaps is needed
+    :param verify: Whether to verify checksums of every file
+    :returns: Absolute path to reference FASTA in store
+    """
+
+    if not os.path.exists(store):
+        os.makedirs(store)
+
+    manifest_fp = os.path.join(store, 'manifest.json')
+    manifest = {}
+    if os.path.exists(manifest_fp):
+        with open(manifest_fp) as f:
+            manifest = json.load(f)
+
+    ref = os.path.abspath(os.path.join(store, REF_ROOT))
+    src = os.path.join(source, REF_ROOT)
+    unrooted = REF_ROOT.split('.')[0]
+
+    def link_or_build(names, cmd):
+        def build():
+            if all(os.path.exists(os.path.join(source, n)) for n in names):
+                for name in names:
+                    link(os.path.join(source, name), os.path.join(store, name))
+            else:
+                runner.run(['sh', SH_PATH] + cmd)
+        return build
+
+    # Linking reference FASTA
+    changed = ensure(manifest, store, [REF_ROOT], lambda: link(src, ref),
+                     verify)
+
+    # Indexing reference
+    ensure(manifest, store, [REF_ROOT+'.fai'],
+           link_or_build([REF_ROOT+'.fai'], ['fasta_index', ref]),
+           verify, changed)
+
+    # Creating sequence dictionary for reference
+    ensure(manifest, store, [unrooted+'.dict'],
+           link_or_build([unrooted+'.dict'],
+                         ['seq_dict', ref, os.path.abspath(store), unrooted]),
+           verify, changed)
+
+    # Creating BWA indexes
+    if bwa:
+        names = [REF_ROOT+ext for ext in BWA_EXT]
+        ensure(manifest, store, names,
+               link_or_build(names, ['bwa_index', ref]), verify, changed)
+
+    # Finding assembly gaps
+    if gaps:
+        gaps_fp = os.path.join(store, 'gaps.bed')
+        ensure(manifest, store, ['gaps.bed'], lambda: find_gaps(ref, gaps_fp),
+               verify, changed)
+
+    with open(manifest_fp, 'w') as f:
+        json.dump(manifest, f, indent=1)
+
+    return ref
@@ -0,0 +1,260 @@
+"""  Command Runner
+
+runner.py is the one path external tools are run through.
+Commands run as asyncio tasks, with at most a set number of
+each tool running at once, and their output is streamed
+line by line under a prefix naming the command. Commands
+can time out and be retried, and raise on a nonzero exit
+once their attempts are used up. Every attempt is traced
+with its resource use, as read from 'wait4'.
+
+"""
+
+# Importing libraries
+import subprocess as sp
+import collections
+import itertools
+import asyncio
+import signal
+import time
+import sys
+import os
+from concurrent.futures import ThreadPoolExecutor
+from instrument import emit, RSS_BYTES, BLOCK_BYTES
+
+# Commands of a tool running at once, DEFAULT_LIMIT for others
+TOOL_LIMITS = {'gatk': 2, 'samtools': 8, 'bwa': 2}
+DEFAULT_LIMIT = 4
+
+# Tools run by the functions of the project's shell scripts
+SH_TOOLS = {'mapper': 'bwa', 'bwa_index': 'bwa', 'fasta_index': 'samtools',
+            'index_bam': 'samtools', 'sam_bam': 'gatk', 'seq_dict': 'gatk',
+            'haplotype': 'gatk', 'haplotype_interval': 'gatk',
+            'gather_vcfs': 'gatk', 'create_list': 'ls'}
+
+# Output lines kept to report with a failure
+TAIL_LINES = 20
+
+# Threads waiting on running commands, shared by all runners
+WAITERS = ThreadPoolExecutor(max_workers=256)
+
+
+
+def command_name(cmd):
+    """
+    Names a command, by shell function for project scripts
+
+    :param cmd: List of command arguments
+    :returns: String
+    """
+
+    if cmd[0] == 'sh' and len(cmd) > 2:
+        return '{}:{}'.format(os.path.basename(cmd[1]), cmd[2])
+
+    return os.path.basename(cmd[0])
+
+
+
+def command_tool(cmd):
+    """
+    Finds the tool a command runs, limited as one
+
+    :param cmd: List of command arguments
+    :returns: String
+    """
+
+    if cmd[0] == 'sh' and len(cmd) > 2:
+        return SH_TOOLS.get(cmd[2], cmd[2])
+
+    return os.path.basename(cmd[0])
+
+
+
+class Runner:
+    """
+    Runs commands concurrently, within limits per tool.
+    Limits hold across all tasks of the event loop the
+    runner is used in, and start over in each new loop
+    """
+
+    def __init__(self, limits=None, timeout=None, retries=0, delay=1):
+        """
+        :param limits: Dictionary of commands of a tool run at
+                       once, overriding TOOL_LIMITS
+        :param timeout: Seconds before an attempt is killed
+                        (default none)
+        :param retries: Number of times a failed command is
+                        run again
+        :param delay: Seconds before the first retry, doubling
+                      with each one after
+        """
+
+        self.limits = dict(TOOL_LIMITS, **(limits or {}))
+        self.timeout = timeout
+        self.retries = retries
+        self.delay = delay
+        self.semaphores = {}
+        self.loop = None
+        self.ids = itertools.count(1)
+
+    def semaphore(self, tool):
+        # Semaphores bind to the loop they are first used in
+        loop = asyncio.get_running_loop()
+        if loop is not self.loop:
+            self.loop, self.semaphores = loop, {}
+        if tool not in self.semaphores:
+            self.semaphores[tool] = asyncio.Semaphore(
+                self.limits.get(tool, DEFAULT_LIMIT))
+        return self.semaphores[tool]
+
+    async def run(self, cmd, name=None, tool=None, check=True, timeout=None,
+                  retries=None, **kwargs):
+        """
+        Runs a command once a slot of its tool is free,
+        retrying failed or timed out attempts
+
+        :param cmd: List of command arguments
+        :param name: Name in logs and trace (default from command)
+        :param tool: Tool limited as (default from command)
+        :param check: Whether to raise once all attempts fail
+        :param timeout: Seconds before an attempt is killed
+                        (default the runner's)
+        :param retries: Number of retries (default the runner's)
+        :param kwargs: Keyword arguments of 'subprocess.Popen'
+        :returns: Exit status of the last attempt
+        """
+
+        name = name or command_name(cmd)
+        label = '{} {}'.format(name, next(self.ids))
+        timeout = self.timeout if timeout is None else timeout
+        retries = self.retries if retries is None else retries
+
+        async with self.semaphore(tool or command_tool(cmd)):
+            for attempt in range(retries + 1):
+                code, timed_out, tail = await self.attempt(
+                    cmd, name, label, timeout, attempt, **kwargs)
+                if code == 0 or attempt == retries:
+                    break
+                wait = self.delay * 2 ** attempt
+                print('[{}] {}, retrying in {}s'.format(
+                    label, 'timed out' if timed_out else 'exit status {}'
+                    .format(code), wait), file=sys.stderr, flush=True)
+                await asyncio.sleep(wait)
+
+        if check and timed_out:
+            raise sp.TimeoutExpired(cmd, timeout, stderr='\n'.join(tail))
+        if check and code != 0:
+            raise sp.CalledProcessError(code, cmd, stderr='\n'.join(tail))
+
+        return code
+
+    async def attempt(self, cmd, name, label, timeout, attempt, **kwargs):
+        """
+        Runs one attempt of a command in its own process
+        group, so a timeout kills the tools it started too.
+        The exit is waited on with 'wait4' in a thread
+
+        :returns: Tuple of exit status, whether it timed out
+                  and the last lines of output
+        """
+
+        outputs = {'stdout': kwargs.pop('stdout', sp.PIPE),
+                   'stderr': kwargs.pop('stderr', sp.PIPE)}
+
+        start = time.time()
+        proc = sp.Popen(cmd, start_new_session=True, **outputs, **kwargs)
+        exited = asyncio.get_running_loop().run_in_executor(
+            WAITERS, os.wait4, proc.pid, 0)
+
+        # Streaming piped output as it is written
+        tail = collections.deque(maxlen=TAIL_LINES)
+        streams = [asyncio.ensure_future(stream(pipe, label, tail, out))
+                   for pipe, out in [(proc.stdout, sys.stdout),
+                                     (proc.stderr, sys.stderr)]
+                   if pipe is not None]
+
+        timed_out = False
+        try:
+            _, status, usage = await asyncio.wait_for(asyncio.shield(exited),
+                                                      timeout)
+        except asyncio.TimeoutError:
+            timed_out = True
+            kill(proc)
+            _, status, usage = await exited
+        except BaseException:
+            kill(proc)
+            raise
+        finally:
+            await asyncio.gather(*streams, return_exceptions=True)
+
+        proc.returncode = os.waitstatus_to_exitcode(status)
+
+        emit({'type': 'command', 'name': name, 'start': start,
+              'wall': time.time() - start,
+              'user': usage.ru_utime, 'sys': usage.ru_stime,
+              'max_rss': usage.ru_maxrss * RSS_BYTES,
+              'read_bytes': usage.ru_inblock * BLOCK_BYTES,
+              'write_bytes': usage.ru_oublock * BLOCK_BYTES,
+              'status': proc.returncode, 'pid': proc.pid,
+              'attempt': attempt, 'timed_out': timed_out})
+
+        return proc.returncode, timed_out, tail
+
+
+
+def kill(proc):
+    """
+    Helper function for 'Runner.attempt'. Kills the process
+    group of a command, if it still runs
+    """
+
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+    return
+
+
+
+async def stream(pipe, label, tail, out):
+    """
+    Helper function for 'Runner.attempt'. Writes each line
+    of a pipe prefixed with the command's label, keeping
+    the last lines
+
+    :param pipe: Pipe of command output
+    :param label: Prefix of lines
+    :param tail: Deque of last lines
+    :param out: File written to
+    """
+
+    reader = asyncio.StreamReader(limit=1 << 24)
+    await asyncio.get_running_loop().connect_read_pipe(
+        lambda: asyncio.StreamReaderProtocol(reader), pipe)
+
+    async for line in reader:
+        text = line.decode(errors='replace').rstrip('\n')
+        tail.append(text)
+        print('[{}] {}'.format(label, text), file=out, flush=True)
+
+    return
+
+
+
+def run(cmd, name=None, check=True, timeout=None, retries=0, **kwargs):
+    """
+    Runs one command from synchronous code
+
+    :param cmd: List of command arguments
+    :param name: Name in logs and trace (default from command)
+    :param check: Whether to raise once all attempts fail
+    :param timeout: Seconds before an attempt is killed
+    :param retries: Number of times a failed command is run again
+    :param kwargs: Keyword arguments of 'subprocess.Popen'
+    :returns: Exit status
+    """
+
+    runner = Runner(timeout=timeout, retries=retries)
+
+    return asyncio.run(runner.run(cmd, name, check=check, **kwargs))
@@ -0,0 +1,196 @@
+"""  Target Scheduler
+
+scheduler.py runs project targets as a dependency graph.
+Targets whose outputs are newer than their inputs are
+skipped, independent targets run concurrently on a worker
+pool, and the first failure stops new targets from starting.
+
+"""
+
+# Importing libraries
+import traceback
+import time
+import os
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from instrument import stage
+
+Target = namedtuple('Target', ['name', 'func', 'deps', 'inputs', 'outputs',
+                               'lock'])
+
+# Lock of targets that must run alone
+EXCLUSIVE = '*'
+
+
+
+def make_target(name, func, deps=(), inputs=(), outputs=(), lock=None):
+    """
+    Creates a target
+
+    :param name: Name used on the command line
+    :param func: Function without arguments building the target
+    :param deps: Names of targets to build first
+    :param inputs: Paths to files the target reads
+    :param outputs: Paths to files the target writes. Targets
+                    without outputs always run
+    :param lock: Name of a resource, such as a shared working
+                 directory, that only one target may use at
+                 once. EXCLUSIVE runs the target alone
+    :returns: Target
+    """
+
+    return Target(name, func, tuple(deps), tuple(inputs), tuple(outputs),
+                  lock)
+
+
+
+def conflicts(target, other):
+    """
+    Checks whether two targets cannot run at the same time
+
+    :param target: Target
+    :param other: Target
+    :returns: Boolean
+    """
+
+    locks = {target.lock, other.lock}
+    if EXCLUSIVE in locks:
+        return True
+
+    return target.lock is not None and target.lock == other.lock
+
+
+
+def resolve(targets, requested):
+    """
+    Collects requested targets and their dependencies
+
+    :param targets: Dictionary of target names to Targets
+    :param requested: List of requested target names
+    :returns: List of target names, dependencies first
+    """
+
+    order, visiting = [], set()
+
+    def visit(name):
+        if name in order:
+            return
+        if name not in targets:
+            raise KeyError('Unknown target: {}'.format(name))
+        if name in visiting:
+            raise ValueError('Dependency cycle at target: {}'.format(name))
+
+        visiting.add(name)
+        for dep in targets[name].deps:
+            visit(dep)
+        visiting.discard(name)
+        order.append(name)
+
+    for name in requested:
+        visit(name)
+
+    return order
+
+
+
+def up_to_date(target):
+    """
+    Checks whether all outputs exist and are newer than inputs
+
+    :param target: Target
+    :returns: Boolean
+    """
+
+    if not target.outputs:
+        return False
+    if not all(os.path.exists(fp) for fp in target.outputs):
+        return False
+
+    inputs = [fp for fp in target.inputs if os.path.exists(fp)]
+    if not inputs:
+        return True
+
+    oldest_output = min(os.path.getmtime(fp) for fp in target.outputs)
+    newest_input = max(os.path.getmtime(fp) for fp in inputs)
+
+    return oldest_output >= newest_input
+
+
+
+def run_targets(targets, requested, jobs=1):
+    """
+    Runs requested targets and their dependencies
+
+    :param targets: Dictionary of target names to Targets
+    :param requested: List of requested target names
+    :param jobs: Maximum number of targets running at once
+    :returns: Boolean whether every target succeeded
+    """
+
+    order = resolve(targets, requested)
+    status = {name: 'not run' for name in order}
+    timings, errors = {}, {}
+    running = {}
+    failed = False
+
+    def ready(name):
+        return (status[name] == 'not run' and name not in running.values()
+                and all(status[dep] in ('done', 'up to date')
+                        for dep in targets[name].deps))
+
+    def free(name):
+        return not any(conflicts(targets[name], targets[other])
+                       for other in running.values())
+
+    def execute(name):
+        start = time.time()
+        try:
+            with stage('target:{}'.format(name)):
+                targets[name].func()
+        finally:
+            timings[name] = time.time() - start
+
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        while True:
+
+            # Starting targets whose dependencies are built
+            for name in order:
+                if failed or len(running) >= jobs:
+                    break
+                if not ready(name):
+                    continue
+                if up_to_date(targets[name]):
+                    status[name] = 'up to date'
+                    continue
+                if free(name):
+                    running[pool.submit(execute, name)] = name
+
+            if not running:
+                if failed or not any(ready(name) for name in order):
+                    break
+                continue
+
+            # Collecting finished targets
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                if future.exception() is None:
+                    status[name] = 'done'
+                else:
+                    status[name] = 'failed'
+                    errors[name] = future.exception()
+                    failed = True
+                    traceback.print_exception(errors[name])
+
+    # Reporting outcome of each target
+    print('***target report***')
+    for name in order:
+        line = '  {:<15}{:<12}'.format(name, status[name])
+        if name in timings:
+            line += '{:>9.1f}s'.format(timings[name])
+        if name in errors:
+            line += '  {}: {}'.format(type(errors[name]).__name__,
+                                      errors[name])
+        print(line)
+
+    return not failed
@@ -0,0 +1,318 @@
+"""  Sharded Genotype Store
+
+store.py keeps packed genotypes as per-chromosome shards of
+a fixed number of variants, each a .bed/.bim pair with
+per-variant metadata, listed in a manifest. Input files are
+ingested in parallel and only re-ingested when they change.
+Shards are memory-mapped lazily, only once they are read.
+
+"""
+
+# Importing libraries
+import pandas as pd
+import numpy as np
+import hashlib
+import shutil
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from read_data import read_vcf_chunks
+from genotype import (GenotypeData, BED_MAGIC, gt_to_dosage, pack_dosages,
+                      chunk_variants, write_fam, read_bim, read_fam, map_bed,
+                      load_bed)
+from cache import file_identity
+from qc import QCStats, is_snp, block_counts
+
+MANIFEST = 'manifest.json'
+SHARD_SIZE = 100000
+
+
+
+class ShardedPacked:
+    """
+    Packed genotype matrix spread over shards, indexed like
+    one array. Shards are memory-mapped on first access
+    """
+
+    def __init__(self, beds, counts, n_samples):
+        """
+        :param beds: List of paths to shard .bed files
+        :param counts: Number of variants of each shard
+        :param n_samples: Number of samples
+        """
+
+        self.beds = beds
+        self.counts = counts
+        self.n_samples = n_samples
+        self.offsets = np.concatenate([[0], np.cumsum(counts)]).astype(int)
+        self.shape = (int(self.offsets[-1]), -(-n_samples // 4))
+        self.dtype = np.dtype(np.uint8)
+        self.maps = {}
+
+    def __len__(self):
+        return self.shape[0]
+
+    def shard(self, i):
+        if i not in self.maps:
+            self.maps[i] = map_bed(self.beds[i], self.counts[i],
+                                   self.n_samples)
+        return self.maps[i]
+
+    def __getitem__(self, index):
+        if isinstance(index, (int, np.integer)):
+            return self[np.array([index])][0]
+        if isinstance(index, slice):
+            index = np.arange(*index.indices(len(self)))
+
+        index = np.asarray(index)
+        if index.dtype == bool:
+            index = np.flatnonzero(index)
+
+        # Reading each shard's rows at once
+        out = np.empty((len(index), self.shape[1]), dtype=np.uint8)
+        shards = np.searchsorted(self.offsets, index, side='right') - 1
+        for i in np.unique(shards):
+            rows = shards == i
+            local = index[rows] - self.offsets[i]
+            if local[-1] - local[0] == len(local) - 1:
+                out[rows] = self.shard(i)[local[0]:local[-1]+1]
+            else:
+                out[rows] = self.shard(i)[local]
+
+        return out
+
+
+
+def shard_name(fp, chrom, number):
+    """
+    Helper function. Names a shard by chromosome, input
+    file and position in file. A hash of the input's path
+    keeps files of the same name in different directories
+    apart, and stays the same when the input list changes
+
+    :returns: Relative path of shard without extension
+    """
+
+    stem = os.path.basename(fp).split('.vcf')[0]
+    digest = hashlib.md5(os.path.abspath(fp).encode()).hexdigest()[:8]
+
+    return os.path.join(chrom, '{}_{}_{:05d}'.format(stem, digest, number))
+
+
+
+def ingest(fp, store_dir, shard_size=SHARD_SIZE, chunksize=10000):
+    """
+    Writes the shards of one VCF file. Chunks are appended
+    to the open shard until it is full or the chromosome
+    changes, and per-variant allele and call counts and
+    per-sample SNP call counts are saved next to each shard
+
+    :param fp: Path to VCF file
+    :param store_dir: Path to store directory
+    :param shard_size: Maximum number of variants per shard
+    :param chunksize: Number of records read at once
+    :returns: Tuple of sample IDs and list of shard records
+    """
+
+    fixed = ['#CHROM', 'POS', 'ID', 'REF', 'ALT']
+    samples, shards, current = None, [], None
+
+    def close_shard():
+        current['bed'].close()
+        current['bim'].close()
+        meta = current['meta']
+        np.savez(os.path.join(store_dir, current['name']+'.npz'),
+                 pos=np.concatenate(meta['pos']),
+                 alt_counts=np.concatenate(meta['alt_counts']),
+                 called=np.concatenate(meta['called']),
+                 sample_called=meta['sample_called'])
+        shards.append({'name': current['name'], 'chrom': current['chrom'],
+                       'variants': current['variants']})
+
+    for chunk in read_vcf_chunks(fp, chunksize, columns=fixed):
+        if samples is None:
+            samples = list(chunk.columns[len(fixed):])
+
+        # Splitting chunks at chromosome and shard boundaries
+        chroms = chunk['#CHROM'].to_numpy()
+        start = 0
+        while start < len(chunk):
+            chrom = chroms[start]
+            if (current is None or current['chrom'] != chrom or
+                    current['variants'] == shard_size):
+                if current is not None:
+                    close_shard()
+                name = shard_name(fp, chrom, len(shards))
+                os.makedirs(os.path.join(store_dir, chrom), exist_ok=True)
+                prefix = os.path.join(store_dir, name)
+                current = {'name': name, 'chrom': chrom, 'variants': 0,
+                           'bed': open(prefix+'.bed', 'wb'),
+                           'bim': open(prefix+'.bim', 'w'),
+                           'meta': {'pos': [], 'alt_counts': [], 'called': [],
+                                    'sample_called': np.zeros(len(samples),
+                                                              dtype=np.int64)}}
+                current['bed'].write(BED_MAGIC)
+
+            stop = start + min(shard_size - current['variants'],
+                               len(chunk) - start)
+            stop = start + np.argmax(np.append(chroms[start:stop] != chrom,
+                                               True))
+            part = chunk.iloc[start:stop]
+
+            # Packing genotypes, recording counts
+            dosage = gt_to_dosage(part[samples].to_numpy())
+            current['bed'].write(pack_dosages(dosage).tobytes())
+            variants = chunk_variants(part)
+            variants.to_csv(current['bim'], sep='\t', header=False,
+                            index=False)
+
+            alt_counts, called, sample_called = block_counts(
+                dosage, is_snp(variants))
+            meta = current['meta']
+            meta['pos'].append(part['POS'].to_numpy())
+            meta['alt_counts'].append(alt_counts)
+            meta['called'].append(called)
+            meta['sample_called'] += sample_called
+
+            current['variants'] += len(part)
+            start = stop
+
+    if current is not None:
+        close_shard()
+
+    return samples or [], shards
+
+
+
+def build_store(vcf_fps, store_dir, shard_size=SHARD_SIZE, chunksize=10000,
+                jobs=None):
+    """
+    Ingests VCF files into the store in parallel, one worker
+    per file. Files ingested before with the same size and
+    modification time keep their shards
+
+    :param vcf_fps: List of paths to VCF files sharing samples,
+                    in genome order
+    :param store_dir: Path to store directory
+    :param shard_size: Maximum number of variants per shard
+    :param chunksize: Number of records read at once
+    :param jobs: Number of worker processes (default CPU count)
+    :returns: Manifest dictionary
+    """
+
+    manifest_fp = os.path.join(store_dir, MANIFEST)
+    old = {'inputs': {}}
+    if os.path.exists(manifest_fp):
+        with open(manifest_fp) as f:
+            old = json.load(f)
+    if old.get('shard_size') != shard_size:
+        shutil.rmtree(store_dir, ignore_errors=True)
+        old = {'inputs': {}}
+    os.makedirs(store_dir, exist_ok=True)
+
+    def current(fp):
+        entry = old['inputs'].get(fp)
+        return (entry is not None and
+                entry['identity'] == file_identity(fp) and
+                all(os.path.exists(os.path.join(store_dir, s['name']+ext))
+                    for s in entry['shards'] for ext in ['.bed', '.npz']))
+
+    # Removing shards of changed or dropped inputs
+    inputs = {fp: old['inputs'][fp] for fp in vcf_fps if current(fp)}
+    for fp, entry in old['inputs'].items():
+        if fp not in inputs:
+            for shard in entry['shards']:
+                for ext in ['.bed', '.bim', '.npz']:
+                    path = os.path.join(store_dir, shard['name']+ext)
+                    if os.path.exists(path):
+                        os.remove(path)
+
+    # Ingesting new inputs in parallel
+    stale = [fp for fp in vcf_fps if fp not in inputs]
+    with ProcessPoolExecutor(max_workers=jobs or os.cpu_count()) as pool:
+        futures = {fp: pool.submit(ingest, fp, store_dir, shard_size,
+                                   chunksize) for fp in stale}
+        for fp, future in futures.items():
+            samples, shards = future.result()
+            inputs[fp] = {'identity': file_identity(fp), 'samples': samples,
+                          'shards': shards}
+
+    # Checking sample columns match across files
+    samples = inputs[vcf_fps[0]]['samples'] if vcf_fps else []
+    for fp in vcf_fps:
+        if inputs[fp]['samples'] != samples:
+            raise ValueError('Samples in {} do not match'.format(fp))
+    write_fam(samples, os.path.join(store_dir, 'samples.fam'))
+
+    manifest = {'shard_size': shard_size,
+                'inputs': {fp: inputs[fp] for fp in vcf_fps},
+                'shards': [s for fp in vcf_fps for s in inputs[fp]['shards']]}
+    with open(manifest_fp, 'w') as f:
+        json.dump(manifest, f, indent=1)
+
+    return manifest
+
+
+
+def load_store(store_dir):
+    """
+    Opens the store as one genotype matrix. Variant tables
+    are read up front, genotypes only when indexed
+
+    :param store_dir: Path to store directory
+    :returns: GenotypeData, as returned by 'genotype.load_bed'
+    """
+
+    with open(os.path.join(store_dir, MANIFEST)) as f:
+        shards = json.load(f)['shards']
+
+    prefixes = [os.path.join(store_dir, s['name']) for s in shards]
+    samples = read_fam(os.path.join(store_dir, 'samples.fam'))
+    variants = pd.concat([read_bim(p+'.bim') for p in prefixes] or
+                         [read_bim(os.devnull)], ignore_index=True)
+    packed = ShardedPacked([p+'.bed' for p in prefixes],
+                           [s['variants'] for s in shards], len(samples))
+
+    return GenotypeData(packed, variants, samples)
+
+
+
+def load_genotypes(path):
+    """
+    Opens a store directory or a .bed fileset prefix
+
+    :param path: Path to store directory or fileset prefix
+    :returns: GenotypeData
+    """
+
+    if os.path.isdir(path):
+        return load_store(path)
+
+    return load_bed(path)
+
+
+
+def store_stats(store_dir):
+    """
+    Assembles QC statistics from the metadata saved with
+    each shard, without reading genotypes
+
+    :param store_dir: Path to store directory
+    :returns: QCStats, as returned by 'qc.qc_stats'
+    """
+
+    geno = load_store(store_dir)
+    with open(os.path.join(store_dir, MANIFEST)) as f:
+        shards = json.load(f)['shards']
+
+    alt_counts, called = [np.zeros(0, dtype=np.int64)], [np.zeros(0)]
+    sample_called = np.zeros(len(geno.samples), dtype=np.int64)
+    for shard in shards:
+        with np.load(os.path.join(store_dir, shard['name']+'.npz')) as meta:
+            alt_counts.append(meta['alt_counts'])
+            called.append(meta['called'])
+            sample_called += meta['sample_called']
+
+    return QCStats(np.concatenate(alt_counts),
+                   np.concatenate(called).astype(np.int64),
+                   is_snp(geno.variants), sample_called)
@@ -0,0 +1,58 @@
+import pytest
+
+
+def write_vcf(fp, samples, records):
+    """
+    Writes a plain text VCF of GT-only records
+
+    :param fp: Path to VCF file
+    :param samples: List of sample IDs
+    :param records: List of (chrom, pos, ref, alt, genotypes)
+    :returns: Path to VCF file
+    """
+
+    with open(fp, 'w') as f:
+        f.write('##fileformat=VCFv4.1\n'
+                '#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\t' +
+                '\t'.join(samples) + '\n')
+        for chrom, pos, ref, alt, gts in records:
+            f.write('{}\t{}\t.\t{}\t{}\t.\tPASS\t.\tGT\t{}\n'.format(
+                chrom, pos, ref, alt, '\t'.join(gts)))
+
+    return str(fp)
+
+
+def write_dosage_vcf(fp, dosage, chroms=None):
+    """
+    Writes a VCF of SNPs from a dosage matrix, with samples
+    named S0, S1, ... and variants 100 bp apart
+
+    :param fp: Path to VCF file
+    :param dosage: Array of dosages (variants x samples), -1
+                   where missing
+    :param chroms: Chromosome of each variant (default all '1')
+    :returns: Path to VCF file
+    """
+
+    calls = {-1: './.', 0: '0|0', 1: '0|1', 2: '1|1'}
+    chroms = ['1'] * len(dosage) if chroms is None else chroms
+    samples = ['S{}'.format(i) for i in range(dosage.shape[1])]
+
+    return write_vcf(fp, samples, [
+        (chrom, 100 * (i + 1), 'A', 'G', [calls[d] for d in row])
+        for i, (chrom, row) in enumerate(zip(chroms, dosage.tolist()))])
+
+
+@pytest.fixture
+def small_vcf(tmp_path):
+    """
+    VCF of 4 samples with missing calls, an indel and both
+    phased and unphased genotypes
+    """
+
+    return write_vcf(tmp_path / 'small.vcf', ['A', 'B', 'C', 'D'], [
+        ('1', 100, 'A', 'G', ['0|0', '0|1', '1|1', './.']),
+        ('1', 200, 'C', 'T', ['1/1', '0/1', '0/0', '0/1']),
+        ('1', 300, 'AT', 'A', ['0|1', '.|.', '1|1', '0|0']),
+        ('2', 150, 'G', 'C', ['1|0', '1|1', './.', '0|0']),
+    ])
@@ -0,0 +1,61 @@
+import json
+import sys
+import os
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+import benchmark
+
+HOST = {'machine': 'x86_64', 'cpu': 'Test CPU', 'cpus': 4}
+OUTPUTS = {'scale': '10x100', 'qc_variants': 90, 'qc_samples': 10}
+
+
+def fake_scale(monkeypatch, seconds, outputs=OUTPUTS, host=HOST):
+    """
+    Replaces running a scale with fixed timings and outputs
+    """
+
+    stages = [{'scale': '10x100', 'stage': 'store', 'seconds': seconds,
+               'peak_mb': 100.0}]
+    monkeypatch.setattr(benchmark, 'run_scale',
+                        lambda *args: (stages, dict(outputs)))
+    monkeypatch.setattr(benchmark, 'host_info', lambda: dict(host))
+
+
+def run(tmp_path, baseline):
+    benchmark.run_benchmarks([{'samples': 10, 'variants': 100, 'reads': 10}],
+                             str(tmp_path), str(baseline))
+
+
+def test_slower_stage_fails_on_same_host(monkeypatch, tmp_path):
+    baseline = tmp_path / 'baseline.json'
+    fake_scale(monkeypatch, 1.0)
+    run(tmp_path, baseline)
+
+    fake_scale(monkeypatch, 5.0)
+    with pytest.raises(RuntimeError, match='store seconds'):
+        run(tmp_path, baseline)
+
+
+def test_timings_skipped_on_other_host(monkeypatch, tmp_path):
+    baseline = tmp_path / 'baseline.json'
+    fake_scale(monkeypatch, 1.0)
+    run(tmp_path, baseline)
+
+    fake_scale(monkeypatch, 5.0, host=dict(HOST, cpu='Other CPU'))
+    run(tmp_path, baseline)
+
+    with open(tmp_path / 'results.json') as f:
+        assert json.load(f)['host']['cpu'] == 'Other CPU'
+
+
+def test_changed_outputs_fail_on_any_host(monkeypatch, tmp_path):
+    baseline = tmp_path / 'baseline.json'
+    fake_scale(monkeypatch, 1.0)
+    run(tmp_path, baseline)
+
+    fake_scale(monkeypatch, 1.0, outputs=dict(OUTPUTS, qc_variants=80),
+               host=dict(HOST, cpu='Other CPU'))
+    with pytest.raises(RuntimeError, match='qc_variants: 90 -> 80'):
+        run(tmp_path, baseline)
@@ -0,0 +1,83 @@
+import gzip
+import sys
+import os
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+import bgzf
+
+DATA = b''.join(b'line %d\n' % i for i in range(50000))
+
+
+def test_writer_round_trips_through_gzip(tmp_path):
+    fp = tmp_path / 'out.gz'
+    with bgzf.BgzfWriter(str(fp), threads=2) as writer:
+        writer.write(DATA)
+
+    assert bgzf.is_bgzf(str(fp))
+    assert gzip.decompress(fp.read_bytes()) == DATA
+    assert fp.read_bytes().endswith(bgzf.BGZF_EOF)
+
+
+def test_writer_deletes_output_on_error(tmp_path):
+    fp = tmp_path / 'out.gz'
+    with pytest.raises(RuntimeError):
+        with bgzf.BgzfWriter(str(fp), threads=2) as writer:
+            writer.write(DATA)
+            raise RuntimeError('input failed')
+
+    assert not fp.exists()
+
+
+def test_concat_vcfs_joins_bgzf_gzip_and_plain(monkeypatch, tmp_path):
+    pysam = pytest.importorskip('pysam')
+    import process_data as pdata
+    from conftest import write_vcf
+
+    monkeypatch.chdir(tmp_path)
+    os.makedirs('data/temp')
+    samples = ['A', 'B']
+    fps = [write_vcf(tmp_path / 'chr{}.vcf'.format(chrom), samples,
+                     [(chrom, pos, 'A', 'G', ['0|1', '1|1'])
+                      for pos in range(1, 3001)])
+           for chrom in '123']
+
+    # Compressing as BGZF with a header past the first block,
+    # as plain gzip, and leaving plain text without a final newline
+    with open(fps[0], 'rb') as f:
+        fileformat, body = f.readline(), f.read()
+    note = b'##note=' + b'x' * 70000 + b'\n'
+    with bgzf.BgzfWriter(fps[0]+'.gz') as writer:
+        writer.write(fileformat + note + body)
+    with open(fps[1], 'rb') as f, gzip.open(fps[1]+'.gz', 'wb') as out:
+        out.write(f.read())
+    with open(fps[2], 'rb+') as f:
+        f.truncate(os.path.getsize(fps[2]) - 1)
+    with open(pdata.INPUT_LIST, 'w') as f:
+        f.write('\n'.join([fps[0]+'.gz', fps[1]+'.gz', fps[2]]))
+
+    pdata.concat_vcfs(threads=2)
+
+    with pysam.VariantFile(pdata.FULL_VCF) as vcf:
+        assert list(vcf.header.samples) == samples
+        records = [(r.chrom, r.pos) for r in vcf]
+        assert len(list(vcf.fetch('2', 1000, 1010))) == 10
+    assert records == [(c, p) for c in '123' for p in range(1, 3001)]
+
+
+def test_concat_vcfs_rejects_mismatched_samples(monkeypatch, tmp_path):
+    import process_data as pdata
+    from conftest import write_vcf
+
+    monkeypatch.chdir(tmp_path)
+    os.makedirs('data/temp')
+    fps = [write_vcf(tmp_path / 'a.vcf', ['A', 'B'], []),
+           write_vcf(tmp_path / 'b.vcf', ['A', 'C'], [])]
+    with open(pdata.INPUT_LIST, 'w') as f:
+        f.write('\n'.join(fps))
+
+    with pytest.raises(ValueError, match='Columns'):
+        pdata.concat_vcfs()
+
+    assert not os.path.exists(pdata.FULL_VCF)
@@ -0,0 +1,69 @@
+import sys
+import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+from cache import cached_stage
+
+
+def counting_stage(tmp_path):
+    """
+    Stage writing its input, uppercased, to one output,
+    counting how often it runs
+    """
+
+    src, out = tmp_path / 'in.txt', tmp_path / 'out.txt'
+    src.write_text('a')
+    runs = []
+
+    def run(params=None, parents=(), max_bytes=None):
+        def func():
+            runs.append(1)
+            out.write_text(src.read_text().upper())
+        return cached_stage('upper', func, [str(out)], params, [str(src)],
+                            parents, str(tmp_path / 'cache'), max_bytes)
+
+    return src, out, runs, run
+
+
+def test_unchanged_stage_is_restored(tmp_path):
+    src, out, runs, run = counting_stage(tmp_path)
+    key = run()
+    out.unlink()
+
+    assert run() == key
+    assert len(runs) == 1
+    assert out.read_text() == 'A'
+
+
+def test_params_inputs_and_parents_invalidate(tmp_path):
+    src, out, runs, run = counting_stage(tmp_path)
+    key = run({'k': 1})
+
+    assert run({'k': 2}) != key
+    assert run({'k': 1}, parents=['other']) != key
+    src.write_text('b')
+    os.utime(src, ns=(0, 10**18))
+    assert run({'k': 1}) != key
+    assert len(runs) == 4
+    assert out.read_text() == 'B'
+
+
+def test_corrupt_entry_is_rerun(tmp_path):
+    src, out, runs, run = counting_stage(tmp_path)
+    key = run()
+    (tmp_path / 'cache' / key / 'out.txt').write_text('Z')
+
+    run()
+
+    assert len(runs) == 2
+    assert out.read_text() == 'A'
+    assert (tmp_path / 'cache' / key / 'out.txt').read_text() == 'A'
+
+
+def test_old_entries_are_evicted(tmp_path):
+    src, out, runs, run = counting_stage(tmp_path)
+    old = run({'k': 1})
+    new = run({'k': 2}, max_bytes=1)
+
+    assert os.listdir(tmp_path / 'cache') == [new]
+    assert old != new
@@ -0,0 +1,23 @@
+import sys
+import os
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+from cluster import gmm_diag, adjusted_rand
+
+
+def test_gmm_diag_fits_unit_norm_pcs_of_many_samples():
+    rng = np.random.default_rng(0)
+    n = 300000
+    centers = np.array([[0, 0], [4, 0], [0, 4], [4, 4], [2, 2]])
+    truth = rng.integers(len(centers), size=n)
+    X = centers[truth] + rng.normal(scale=0.3, size=(n, 2))
+
+    # Scaling columns to unit norm like eigenvectors
+    X -= X.mean(axis=0)
+    X /= np.linalg.norm(X, axis=0)
+
+    result = gmm_diag(X, len(centers))
+
+    assert adjusted_rand(result.labels, truth) > 0.99
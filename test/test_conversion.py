@@ -0,0 +1,51 @@
+import sys
+import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+import conversion
+
+
+def fake_steps(monkeypatch, tmp_path):
+    """
+    Replaces the reference and tool steps of a conversion
+    with 'true' commands limited as 'bwa', writing empty
+    outputs
+    """
+
+    monkeypatch.setattr(conversion, 'TEMP', str(tmp_path / 'temp'))
+    monkeypatch.setattr(conversion, 'prep_reference',
+                        lambda **kwargs: str(tmp_path / 'ref.fa'))
+
+    async def step(runner, fp, ref, scratch, *args):
+        await runner.run(['true'], tool='bwa')
+        out_fp = os.path.join(scratch, conversion.file_stem(fp)+'.out')
+        open(out_fp, 'w').close()
+        return out_fp
+
+    monkeypatch.setattr(conversion, 'map_fastq', step)
+    monkeypatch.setattr(conversion, 'call_variants', step)
+
+
+def test_convert_data_shares_limits_across_groups(monkeypatch, tmp_path):
+    fake_steps(monkeypatch, tmp_path)
+    fastqs = [str(tmp_path / 'S{}.fq'.format(i)) for i in range(4)]
+    bams = [str(tmp_path / 'B{}.bam'.format(i)) for i in range(4)]
+    outdir = tmp_path / 'out'
+
+    conversion.convert_data(fastqs, [], bams, str(outdir), jobs=4,
+                            limits={'bwa': 1})
+
+    assert sorted(os.listdir(outdir)) == sorted(
+        ['S{}.out'.format(i) for i in range(4)] +
+        ['B{}.out'.format(i) for i in range(4)])
+
+
+def test_convert_data_keeps_files_of_one_sample_apart(monkeypatch, tmp_path):
+    fake_steps(monkeypatch, tmp_path)
+    bams = [str(tmp_path / 'HG00096.chrom{}.bam'.format(c)) for c in (11, 20)]
+    outdir = tmp_path / 'out'
+
+    conversion.convert_data([], [], bams, str(outdir), jobs=2)
+
+    assert sorted(os.listdir(outdir)) == ['HG00096.chrom11.out',
+                                          'HG00096.chrom20.out']
@@ -0,0 +1,77 @@
+import sys
+import os
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+from conftest import write_dosage_vcf
+from genotype import write_bed, load_bed, unpack_dosages
+from decomposition import (allele_freqs, standardize, fix_signs,
+                           randomized_pca)
+
+
+def structured_geno(tmp_path, n_samples=40, n_variants=300, seed=0):
+    """
+    Writes and loads genotypes of two populations with
+    diverged allele frequencies and a few missing calls
+    """
+
+    rng = np.random.default_rng(seed)
+    pops = np.arange(n_samples) % 2
+    freqs = rng.uniform(0.05, 0.95, size=(n_variants, 2))
+    dosage = rng.binomial(2, freqs[:, pops])
+    dosage[rng.random(dosage.shape) < 0.02] = -1
+
+    prefix = str(tmp_path / 'geno')
+    write_bed([write_dosage_vcf(tmp_path / 'geno.vcf', dosage)], prefix)
+
+    return load_bed(prefix)
+
+
+def svd_pca(geno, num_pca, samples=None):
+    """
+    Exact PCA of the standardized genotype matrix
+    """
+
+    dosage = unpack_dosages(geno.packed, len(geno.samples))
+    if samples is not None:
+        dosage = dosage[:, samples]
+    std = standardize(dosage, allele_freqs(geno, samples=samples), np.float64)
+    u, s, vt = np.linalg.svd(std.T, full_matrices=False)
+    signs = fix_signs(u[:, :num_pca])
+
+    return u[:, :num_pca], s[:num_pca] ** 2 / len(std), vt[:num_pca].T * signs
+
+
+def test_randomized_pca_matches_svd(tmp_path):
+    geno = structured_geno(tmp_path)
+    eigvecs, eigvals, loadings = svd_pca(geno, 3)
+
+    # A sketch as wide as the samples spans them exactly
+    result = randomized_pca(geno, 3, block_size=64, oversample=40)
+
+    assert np.allclose(result.eigvecs, eigvecs, atol=1e-5)
+    assert np.allclose(result.eigvals, eigvals, rtol=1e-5)
+    assert np.allclose(result.loadings, loadings, atol=1e-5)
+
+
+def test_randomized_pca_finds_population_axis(tmp_path):
+    geno = structured_geno(tmp_path)
+    eigvecs, eigvals, _ = svd_pca(geno, 3)
+
+    result = randomized_pca(geno, 3, block_size=64)
+
+    assert np.allclose(result.eigvecs[:, 0], eigvecs[:, 0], atol=1e-5)
+    assert np.allclose(result.eigvals, eigvals, rtol=1e-3)
+
+
+def test_randomized_pca_subsets_samples(tmp_path):
+    geno = structured_geno(tmp_path)
+    samples = np.arange(len(geno.samples)) < 30
+
+    result = randomized_pca(geno, 2, block_size=64, samples=samples,
+                            oversample=30)
+
+    assert result.samples.tolist() == list(range(30))
+    assert np.allclose(result.eigvecs, svd_pca(geno, 2, samples)[0],
+                       atol=1e-5)
@@ -0,0 +1,116 @@
+import threading
+import hashlib
+import gzip
+import io
+import sys
+import os
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+import etl
+
+pyftpdlib = pytest.importorskip('pyftpdlib')
+from pyftpdlib.authorizers import DummyAuthorizer
+from pyftpdlib.handlers import FTPHandler
+from pyftpdlib.servers import ThreadedFTPServer
+
+DATA = bytes(range(256)) * 4096
+
+# FASTQ text stored as two gzip members, as BGZF files are
+FASTQ = b''.join(b'@r%d\nACGT\n+\nIIII\n' % i for i in range(20000))
+FASTQ_GZ = gzip.compress(FASTQ[:40000]) + gzip.compress(FASTQ[40000:])
+
+
+@pytest.fixture
+def server(tmp_path):
+    """
+    Serves directories holding a BAM file and a gzip FASTQ
+    file, each with its '.md5' file, from a local FTP server,
+    yielding its port
+    """
+
+    root = tmp_path / 'ftp'
+    (root / 'data').mkdir(parents=True)
+    (root / 'data' / 'S1.chrom20.bam').write_bytes(DATA)
+    (root / 'data' / 'S1.chrom20.bam.md5').write_text(
+        '{}  S1.chrom20.bam\n'.format(hashlib.md5(DATA).hexdigest()))
+    (root / 'fastq').mkdir()
+    (root / 'fastq' / 'S1_1.fastq.gz').write_bytes(FASTQ_GZ)
+    (root / 'fastq' / 'S1_1.fastq.gz.md5').write_text(
+        '{}  S1_1.fastq.gz\n'.format(hashlib.md5(FASTQ_GZ).hexdigest()))
+
+    authorizer = DummyAuthorizer()
+    authorizer.add_anonymous(str(root))
+    handler = type('Handler', (FTPHandler,), {'authorizer': authorizer})
+    ftpd = ThreadedFTPServer(('127.0.0.1', 0), handler)
+    thread = threading.Thread(target=ftpd.serve_forever,
+                              kwargs={'timeout': 0.1}, daemon=True)
+    thread.start()
+
+    yield ftpd.address[1]
+
+    ftpd.close_all()
+    thread.join()
+
+
+def download(port, outdir, **kwargs):
+    return etl.download_data('/data/', 'bam', str(outdir), 'S1.chrom20',
+                             host='127.0.0.1', port=port, **kwargs)
+
+
+def test_download_verifies_md5(server, tmp_path):
+    fnames = download(server, tmp_path / 'out')
+
+    assert fnames == ['S1.chrom20.bam']
+    assert (tmp_path / 'out' / 'S1.chrom20.bam').read_bytes() == DATA
+
+
+def test_corrupt_partial_download_is_restarted(server, tmp_path):
+    out = tmp_path / 'out'
+    out.mkdir()
+
+    # Resuming after a corrupt prefix gives the right size only
+    (out / 'S1.chrom20.bam.part').write_bytes(b'\0' * (len(DATA) // 2))
+    download(server, out, retries=1)
+
+    assert (out / 'S1.chrom20.bam').read_bytes() == DATA
+    assert not (out / 'S1.chrom20.bam.part').exists()
+
+
+def test_checksum_mismatch_fails_after_retries(server, tmp_path):
+    out = tmp_path / 'out'
+
+    with pytest.raises(IOError, match='MD5'):
+        download(server, out, retries=1,
+                 checksums={'S1.chrom20.bam': '0' * 32})
+
+    assert not (out / 'S1.chrom20.bam').exists()
+
+
+def test_parse_index_pairs_files_with_checksums():
+    lines = ['BAM FILE\tBAM MD5\tBAI FILE\tBAI MD5\n',
+             'data/S1/alignment/S1.bam\taaa\tdata/S1/alignment/S1.bam.bai'
+             '\tbbb\n']
+
+    assert etl.parse_index(lines) == {'S1.bam': 'aaa', 'S1.bam.bai': 'bbb'}
+
+
+def test_download_decompresses_while_receiving(server, tmp_path):
+    out = tmp_path / 'out'
+
+    fnames = etl.download_data('/fastq/', 'fastq', str(out), host='127.0.0.1',
+                               port=server, decompress=True)
+
+    assert fnames == ['S1_1.fastq.gz']
+    assert sorted(os.listdir(out)) == ['S1_1.fastq']
+    assert (out / 'S1_1.fastq').read_bytes() == FASTQ
+
+
+def test_gunzip_writer_spans_members_and_blocks():
+    out = io.BytesIO()
+    write = etl.gunzip_writer(out)
+    for start in range(0, len(FASTQ_GZ), 777):
+        write(FASTQ_GZ[start:start+777])
+
+    assert out.getvalue() == FASTQ
@@ -0,0 +1,45 @@
+import sys
+import os
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+from genotype import (gt_to_dosage, pack_dosages, unpack_dosages, write_bed,
+                      load_bed)
+
+
+def test_gt_to_dosage_reads_calls():
+    gts = [['0|0', '0|1', '1/0', '1/1', './.', '.|.'],
+           ['0', '1', '.', '0|0:12,0', '1|1:.', '2|0']]
+
+    assert gt_to_dosage(gts).tolist() == [[0, 1, 1, 2, -1, -1],
+                                          [0, 2, -1, 0, 2, 1]]
+
+
+def test_gt_to_dosage_reads_multi_digit_alleles():
+    gts = [['10|1', '0|10', '10/0', '12|13', '10', '100|0:5']]
+
+    assert gt_to_dosage(gts).tolist() == [[2, 1, 1, 2, 2, 1]]
+
+
+def test_pack_round_trips_every_sample_count():
+    rng = np.random.default_rng(0)
+    for n_samples in range(1, 10):
+        dosage = rng.integers(-1, 3, size=(7, n_samples)).astype(np.int8)
+
+        packed = pack_dosages(dosage)
+
+        assert packed.shape == (7, -(-n_samples // 4))
+        assert np.array_equal(unpack_dosages(packed, n_samples), dosage)
+
+
+def test_write_bed_round_trips(small_vcf, tmp_path):
+    prefix = str(tmp_path / 'small')
+    write_bed([small_vcf], prefix, chunksize=3)
+    geno = load_bed(prefix)
+
+    assert geno.samples['IID'].tolist() == ['A', 'B', 'C', 'D']
+    assert unpack_dosages(geno.packed, 4).tolist() == [[0, 1, 2, -1],
+                                                       [2, 1, 0, 1],
+                                                       [1, -1, 2, 0],
+                                                       [1, 2, -1, 0]]
@@ -0,0 +1,30 @@
+import time
+import sys
+import os
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+import instrument
+
+
+def test_stage_reports_its_own_memory(tmp_path, monkeypatch, capsys):
+    monkeypatch.delenv(instrument.TRACE_ENV, raising=False)
+    fp = instrument.start_trace(str(tmp_path))
+
+    with instrument.stage('large'):
+        block = np.ones(200 * 10**6 // 8)
+        block += 1
+        # Holding the block over several samples of the sampler
+        time.sleep(4 * instrument.RSS_INTERVAL)
+        del block
+    with instrument.stage('small'):
+        sum(range(1000))
+
+    events = instrument.load_trace(fp).set_index('name')
+    assert events.loc['large', 'rss_growth'] > 150e6
+    assert events.loc['small', 'rss_growth'] < 50e6
+    assert events.loc['small', 'max_rss'] < events.loc['large', 'max_rss']
+
+    instrument.summarize(fp)
+    assert 'growth MB' in capsys.readouterr().out
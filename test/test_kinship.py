@@ -0,0 +1,87 @@
+import sys
+import os
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+from conftest import write_dosage_vcf
+from genotype import write_bed, load_bed
+from kinship import relatedness, unrelated
+
+
+def family_geno(tmp_path, n_variants=2000):
+    """
+    Writes two parents, their child, a duplicate of the
+    first parent and four unrelated samples, with a few
+    missing calls
+    """
+
+    rng = np.random.default_rng(0)
+    freqs = rng.uniform(0.1, 0.9, size=n_variants)
+    haps = rng.random((n_variants, 6, 2)) < freqs[:, None, None]
+
+    # The child takes one haplotype of each parent
+    child = np.stack([haps[:, 0, 0], haps[:, 1, 1]], axis=1)
+    haps = np.concatenate([haps[:, :2], child[:, None], haps[:, :1],
+                           haps[:, 2:6]], axis=1)
+    dosage = haps.sum(axis=2)
+    dosage[rng.random(dosage.shape) < 0.01] = -1
+
+    prefix = str(tmp_path / 'family')
+    write_bed([write_dosage_vcf(tmp_path / 'family.vcf', dosage)], prefix)
+
+    return load_bed(prefix), dosage
+
+
+def naive_king(dosage):
+    """
+    KING-robust kinship and IBS of each pair, one at a time
+    """
+
+    n = dosage.shape[1]
+    kinship, ibs = np.zeros((n, n)), np.zeros((n, n))
+    for i in range(n):
+        for j in range(n):
+            a, b = dosage[:, i], dosage[:, j]
+            both = (a >= 0) & (b >= 0)
+            a, b = a[both], b[both]
+            het_het = np.sum((a == 1) & (b == 1))
+            ibs0 = np.sum(np.abs(a - b) == 2)
+            kinship[i, j] = (het_het - 2 * ibs0) / (np.sum(a == 1) +
+                                                    np.sum(b == 1))
+            ibs[i, j] = 1 - np.abs(a - b).sum() / (2 * both.sum())
+
+    return kinship, ibs
+
+
+def test_relatedness_matches_pairwise_king(tmp_path):
+    geno, dosage = family_geno(tmp_path)
+    kinship, ibs = naive_king(dosage)
+
+    result = relatedness(geno, block_size=300, jobs=3)
+
+    assert np.allclose(result.kinship, kinship)
+    assert np.allclose(result.ibs, ibs)
+    assert np.allclose(np.diag(result.called), (dosage >= 0).sum(axis=0))
+
+
+def test_relatedness_finds_family(tmp_path):
+    geno, _ = family_geno(tmp_path)
+    samples = np.ones(8, dtype=bool)
+    samples[7] = False
+
+    kinship = relatedness(geno, block_size=300, samples=samples).kinship
+
+    assert kinship.shape == (7, 7)
+    assert abs(kinship[0, 3] - 0.5) < 0.02
+    assert abs(kinship[0, 2] - 0.25) < 0.05
+    assert abs(kinship[1, 2] - 0.25) < 0.05
+    assert abs(kinship[0, 1]) < 0.05
+
+
+def test_unrelated_drops_fewest_samples():
+    # Sample 0 is related to 1 and 2, which are unrelated
+    kinship = np.zeros((4, 4))
+    kinship[0, 1:3] = kinship[1:3, 0] = 0.25
+
+    assert unrelated(kinship).tolist() == [False, True, True, True]
@@ -0,0 +1,57 @@
+import sys
+import os
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+from conftest import write_dosage_vcf
+from genotype import write_bed
+from ld import prune_window, ld_prune
+
+
+def linked_fileset(tmp_path):
+    """
+    Writes independent variants on two chromosomes, with
+    variant 5 a copy of 4, variant 10 the complement of 9
+    and variant 15 a copy of 0, beyond a 10 variant window.
+    Variant 20, on the next chromosome, copies variant 0
+    """
+
+    rng = np.random.default_rng(0)
+    dosage = rng.binomial(2, 0.4, size=(30, 200))
+    dosage[5] = dosage[4]
+    dosage[10] = 2 - dosage[9]
+    dosage[15] = dosage[0]
+    dosage[20] = dosage[0]
+
+    prefix = str(tmp_path / 'linked')
+    write_bed([write_dosage_vcf(tmp_path / 'linked.vcf', dosage,
+                                ['1'] * 20 + ['2'] * 10)], prefix)
+
+    return prefix
+
+
+def test_prune_window_drops_lower_maf():
+    r2 = np.array([[1, 0.9, 0], [0.9, 1, 0.5], [0, 0.5, 1]])
+
+    assert prune_window(r2, np.array([0.1, 0.3, 0.2]), 0.2).tolist() == [
+        False, True, False]
+
+
+def test_ld_prune_drops_linked_variants_within_window(tmp_path):
+    prefix = linked_fileset(tmp_path)
+
+    keep = ld_prune(prefix, window=10, step=3, threshold=0.5, jobs=1)
+
+    assert np.flatnonzero(~keep).tolist() == [5, 10]
+
+
+def test_ld_prune_keeps_masked_out_partners(tmp_path):
+    prefix = linked_fileset(tmp_path)
+    variants = np.ones(30, dtype=bool)
+    variants[4] = False
+
+    keep = ld_prune(prefix, window=10, step=3, threshold=0.5,
+                    variants=variants, block_size=4, jobs=1)
+
+    assert np.flatnonzero(~keep).tolist() == [4, 10]
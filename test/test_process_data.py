@@ -0,0 +1,125 @@
+import sys
+import os
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+import process_data as pdata
+from process_data import downsample
+
+
+def test_downsample_caps_dense_cells_within_budget():
+    rng = np.random.default_rng(0)
+    dense = rng.normal(scale=0.01, size=(5000, 3))
+    sparse = rng.uniform(-1, 1, size=(200, 3))
+    pcs = pd.DataFrame(np.vstack([dense, sparse]),
+                       columns=['PC1', 'PC2', 'PC3'])
+
+    kept = downsample(pcs, max_points=1000, bins=5)
+
+    # Largest cap whose total fits, by brute force
+    cells = np.zeros(len(pcs), dtype=np.int64)
+    for pc in ['PC1', 'PC2', 'PC3']:
+        values = pcs[pc].to_numpy()
+        edges = np.linspace(values.min(), values.max(), 6)[1:-1]
+        cells = cells * 5 + np.searchsorted(edges, values)
+    counts = np.bincount(np.unique(cells, return_inverse=True)[1])
+    fits = [c for c in range(1, counts.max() + 1)
+            if np.minimum(counts, c).sum() <= 1000]
+
+    assert len(kept) == np.minimum(counts, max(fits)).sum()
+    assert len(kept) <= 1000
+    assert kept.index.is_monotonic_increasing
+
+
+def test_downsample_keeps_small_inputs():
+    pcs = pd.DataFrame(np.ones((10, 3)), columns=['PC1', 'PC2', 'PC3'])
+
+    assert downsample(pcs, 10) is pcs
+
+
+def test_filter_related_skipped_on_few_variants(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs('data/temp')
+    samples = np.array([True, False, True, True])
+    np.savez(pdata.QC_MASK, variants=np.ones(50, dtype=bool), 
+             samples=samples)
+    np.savez(pdata.LD_MASK, variants=np.ones(50, dtype=bool))
+
+    kept = pdata.filter_related(0.0884, min_variants=100)
+
+    assert kept.tolist() == samples.tolist()
+    with np.load(pdata.KINSHIP_MASK) as mask:
+        assert mask['samples'].tolist() == samples.tolist()
+    assert pd.read_csv(pdata.RELATED_FP).empty
+
+
+def test_project_samples_recovers_training_scores(tmp_path):
+    from conftest import write_dosage_vcf
+    from genotype import write_bed, load_bed
+    from decomposition import randomized_pca
+
+    rng = np.random.default_rng(0)
+    pops = np.arange(30) % 3
+    dosage = rng.binomial(2, rng.uniform(0.05, 0.95, (400, 3))[:, pops])
+    fp = write_dosage_vcf(tmp_path / 'train.vcf', dosage)
+    write_bed([fp], str(tmp_path / 'train'))
+    result = randomized_pca(load_bed(str(tmp_path / 'train')), 3,
+                            oversample=30)
+
+    model_fp = str(tmp_path / 'model.npz')
+    np.savez(model_fp, chrom=np.full(400, '1'),
+             pos=100 * np.arange(1, 401), ref=np.full(400, 'A'),
+             alt=np.full(400, 'G'), freqs=result.freqs,
+             loadings=result.loadings, eigvals=result.eigvals)
+
+    pcs = pdata.project_samples([fp], model_fp, block_size=64)
+
+    assert pcs['Sample'].tolist() == ['S{}'.format(i) for i in range(30)]
+    assert np.allclose(pcs[['PC1', 'PC2', 'PC3']], result.eigvecs, atol=1e-5)
+    assert (pcs['Sites'] == 400).all() and (pcs['Missing'] == 0).all()
+
+    # Sites are matched with a 'chr' prefix, and the scores of
+    # a sample missing every other site stay on the same scale
+    half = dosage.copy()
+    half[::2, :] = -1
+    chr_fp = write_dosage_vcf(tmp_path / 'chr.vcf', half[:, :5],
+                              ['chr1'] * 400)
+    pcs = pdata.project_samples([chr_fp], model_fp, samples=['S0', 'S1'])
+
+    assert pcs['Sample'].tolist() == ['S0', 'S1']
+    assert (pcs['Called'] == 200).all()
+    assert np.allclose(pcs['Missing'], 0.5)
+    assert np.allclose(pcs[['PC1']], result.eigvecs[:2, :1], atol=0.05)
+
+
+def test_pca_removes_outliers_same_way_in_memory_and_streamed(tmp_path,
+                                                             monkeypatch):
+    from conftest import write_dosage_vcf
+    from store import build_store
+
+    # Two populations and one sample of a distant population
+    rng = np.random.default_rng(0)
+    freqs = rng.uniform(0.05, 0.95, (500, 3))
+    freqs[:, 2] = 1 - freqs[:, 0]
+    pops = np.append(np.arange(60) % 2, 2)
+    dosage = rng.binomial(2, freqs[:, pops])
+    monkeypatch.chdir(tmp_path)
+    build_store([write_dosage_vcf(tmp_path / 'pops.vcf', dosage)],
+                pdata.STORE_DIR, jobs=1)
+
+    gram = pdata.pca(3, block_size=128)
+    streamed = pdata.pca(3, block_size=128, gram_max_samples=0)
+
+    for pcs, result, outliers in [gram, streamed]:
+        assert outliers == ['S60']
+        assert pcs['Sample'].tolist() == ['S{}'.format(i) for i in range(60)]
+        assert result.samples.tolist() == list(range(60))
+
+    # The population axis and its loadings agree, up to the
+    # Gram path also centering samples
+    assert np.allclose(gram[0]['PC1'], streamed[0]['PC1'], atol=1e-3)
+    assert np.allclose(gram[1].loadings[:, 0], streamed[1].loadings[:, 0],
+                       atol=1e-3)
+    assert np.allclose(gram[1].eigvals[0], streamed[1].eigvals[0], rtol=1e-2)
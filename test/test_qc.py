@@ -0,0 +1,37 @@
+import sys
+import os
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+from genotype import write_bed, load_bed
+from store import build_store, store_stats
+from qc import qc_stats, qc_masks
+
+
+def test_qc_stats_of_bed_match_store(small_vcf, tmp_path):
+    prefix = str(tmp_path / 'small')
+    assert write_bed([small_vcf], prefix) == 4
+
+    stats = qc_stats(load_bed(prefix), block_size=3)
+    build_store([small_vcf], str(tmp_path / 'store'), shard_size=2, jobs=1)
+    stored = store_stats(str(tmp_path / 'store'))
+
+    assert stats.alt_counts.tolist() == [3, 4, 3, 3]
+    assert stats.called.tolist() == [3, 4, 3, 3]
+    assert stats.snps.tolist() == [True, True, False, True]
+    assert stats.sample_called.tolist() == [3, 3, 2, 2]
+    for field in stats._fields:
+        assert np.array_equal(getattr(stats, field), getattr(stored, field))
+
+
+def test_qc_masks_apply_thresholds(small_vcf, tmp_path):
+    prefix = str(tmp_path / 'small')
+    write_bed([small_vcf], prefix)
+    stats = qc_stats(load_bed(prefix))
+
+    variants, samples = qc_masks(stats, maf=0.2, geno=0.2, mind=0.2)
+
+    # Variants 1 and 4 miss a call, variant 3 is an indel
+    assert variants.tolist() == [False, True, False, False]
+    assert samples.tolist() == [True, True, False, False]
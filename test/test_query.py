@@ -0,0 +1,52 @@
+import sys
+import os
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+pysam = pytest.importorskip('pysam')
+from conftest import write_vcf
+from query import query
+
+
+@pytest.fixture
+def indexed_dir(tmp_path):
+    """
+    Directory of two tabix-indexed VCF files, one per
+    chromosome, of samples A, B and C
+    """
+
+    for chrom in ['1', '2']:
+        fp = write_vcf(tmp_path / 'chr{}.vcf'.format(chrom), ['A', 'B', 'C'],
+                       [(chrom, pos, 'A', 'G', ['0|0', '0|1', '1|1'])
+                        for pos in range(100, 1100, 100)])
+        pysam.tabix_index(fp, preset='vcf')
+
+    return str(tmp_path)
+
+
+def test_query_reads_inclusive_region(indexed_dir):
+    result = query(indexed_dir, '2', 300, 500)
+
+    assert result.variants['POS'].tolist() == [300, 400, 500]
+    assert (result.variants['#CHROM'] == '2').all()
+    assert result.dosage.tolist() == [[0, 1, 2]] * 3
+    assert result.samples == ['A', 'B', 'C']
+
+
+def test_query_keeps_requested_sample_order(indexed_dir):
+    result = query(indexed_dir, '1', samples=['C', 'A'])
+
+    assert len(result.variants) == 10
+    assert result.dosage.tolist() == [[2, 0]] * 10
+    assert result.samples == ['C', 'A']
+
+
+def test_query_empty_region_and_unknown_names(indexed_dir):
+    result = query(indexed_dir, '1', 2000, 3000, samples=['B'])
+    assert result.dosage.shape == (0, 1)
+
+    with pytest.raises(KeyError, match='Contig'):
+        query(indexed_dir, 'X')
+    with pytest.raises(KeyError, match='Samples'):
+        query(indexed_dir, '1', samples=['D'])
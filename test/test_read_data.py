@@ -0,0 +1,131 @@
+import pysam
+import gzip
+import sys
+import os
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+from read_data import (read_fastq, read_fastq_blocks, read_fastq_pairs,
+                       read_bam, read_bam_blocks)
+
+RECORDS = [('@r1 a', 'ACGT', '+r1 a', 'IIII'),
+           ('@r2', 'GGCCA', '+', '!#%+5'),
+           ('@r3', '', '+', '')]
+
+
+def write_fastq(fp, records, compress=False):
+    opener = gzip.open if compress else open
+    with opener(fp, 'wt') as f:
+        for record in records:
+            f.write('\n'.join(record) + '\n')
+    return str(fp)
+
+
+@pytest.mark.parametrize('compress', [False, True])
+def test_read_fastq_keeps_every_line(tmp_path, compress):
+    fp = write_fastq(tmp_path / 'reads.fq', RECORDS, compress)
+
+    df = read_fastq(fp)
+
+    assert [tuple(row) for row in df.to_numpy()] == RECORDS
+
+
+def test_fastq_blocks_across_buffer_boundaries(tmp_path):
+    fp = write_fastq(tmp_path / 'reads.fq', RECORDS * 5)
+
+    blocks = list(read_fastq_blocks(fp, block_size=7))
+
+    assert sum(len(b.offsets) - 1 for b in blocks) == 15
+    quals = np.concatenate([b.quals for b in blocks])
+    assert quals[:9].tolist() == [40] * 4 + [0, 2, 4, 10, 20]
+
+
+def test_fastq_quality_below_offset_raises(tmp_path):
+    fp = write_fastq(tmp_path / 'reads.fq', [('@r1', 'AC', '+', 'I ')])
+
+    with pytest.raises(ValueError, match='quality'):
+        read_fastq(fp)
+
+
+def test_fastq_pairs_stay_in_lockstep(tmp_path):
+    fp1 = write_fastq(tmp_path / 'r1.fq', RECORDS * 4)
+    fp2 = write_fastq(tmp_path / 'r2.fq', RECORDS[::-1] * 4)
+
+    pairs = list(read_fastq_pairs(fp1, fp2, block_size=11))
+
+    assert all(len(a.offsets) == len(b.offsets) for a, b in pairs)
+    assert sum(len(a.offsets) - 1 for a, _ in pairs) == 12
+
+
+def write_bam(fp):
+    """
+    Writes an indexed BAM of paired, unpaired and unmapped
+    reads over two contigs
+    """
+
+    header = {'HD': {'VN': '1.6', 'SO': 'coordinate'},
+              'SQ': [{'SN': '1', 'LN': 1000}, {'SN': '2', 'LN': 1000}]}
+    with pysam.AlignmentFile(fp, 'wb', header=header) as out:
+        for i, (ref, mate, qual) in enumerate([(0, 0, 'IIII'),
+                                               (0, 1, None),
+                                               (1, -1, '!#%+')]):
+            read = pysam.AlignedSegment()
+            read.query_name = 'r{}'.format(i)
+            read.query_sequence = 'ACGT'
+            read.flag = 1
+            read.reference_id = ref
+            read.reference_start = 10 * i
+            read.cigarstring = '4M'
+            read.next_reference_id = mate
+            read.next_reference_start = 50 if mate >= 0 else -1
+            read.template_length = 40
+            if qual is not None:
+                read.query_qualities = pysam.qualitystring_to_array(qual)
+            read.set_tag('NM', i)
+            out.write(read)
+
+        read = pysam.AlignedSegment()
+        read.query_name = 'u'
+        read.query_sequence = 'GG'
+        read.flag = 4
+        out.write(read)
+
+    pysam.index(str(fp))
+
+    return str(fp)
+
+
+def test_read_bam_matches_sam_records(tmp_path):
+    fp = write_bam(tmp_path / 'reads.bam')
+    with pysam.AlignmentFile(fp, 'rb') as f:
+        expected = [r.to_dict() for r in f.fetch(until_eof=True)]
+
+    df = read_bam(fp)
+
+    assert list(df.columns) == list(expected[0])
+    for row, record in zip(df.to_dict('records'), expected):
+        assert {k: v if k == 'tags' else str(v) 
+                for k, v in row.items()} == record
+
+
+def test_bam_blocks_pack_reads_with_offsets(tmp_path):
+    fp = write_bam(tmp_path / 'reads.bam')
+
+    blocks = list(read_bam_blocks(fp, ['name', 'seq', 'qual'], chunksize=3))
+
+    assert [len(b.columns['name']) for b in blocks] == [3, 1]
+    first = blocks[0]
+    assert first.seqs.tobytes() == b'ACGT' * 3
+    assert first.seq_offsets.tolist() == [0, 4, 8, 12]
+    assert first.qual_offsets.tolist() == [0, 4, 4, 8]
+    assert first.quals.tolist() == [40] * 4 + [0, 2, 4, 10]
+
+
+def test_read_bam_region_query(tmp_path):
+    fp = write_bam(tmp_path / 'reads.bam')
+
+    df = read_bam(fp, ['name', 'ref_pos'], region='1')
+
+    assert df['name'].tolist() == ['r0', 'r1']
@@ -0,0 +1,72 @@
+import sys
+import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+import reference
+from reference import REF_ROOT, BWA_EXT, prep_reference
+
+
+def source_dir(tmp_path):
+    """
+    Writes a reference FASTA with a gap and every index
+    shipped next to it, so no tool has to run
+    """
+
+    source = tmp_path / 'source'
+    source.mkdir()
+    (source / REF_ROOT).write_text('>chr1\nACGT' + 'N' * 1200 + 'ACGT\n')
+    for name in ([REF_ROOT+'.fai', REF_ROOT.split('.')[0]+'.dict'] +
+                 [REF_ROOT+ext for ext in BWA_EXT]):
+        (source / name).write_text(name)
+
+    return source
+
+
+def counting_links(monkeypatch):
+    """
+    Counts files linked into the store
+    """
+
+    linked = []
+
+    def link(src, dst):
+        linked.append(os.path.basename(dst))
+        os.symlink(os.path.abspath(src), dst)
+
+    monkeypatch.setattr(reference, 'link', link)
+
+    return linked
+
+
+def test_store_is_built_once(tmp_path, monkeypatch):
+    source, store = source_dir(tmp_path), str(tmp_path / 'store')
+    linked = counting_links(monkeypatch)
+
+    ref = prep_reference(str(source), store, gaps=True)
+    assert len(linked) == 8
+    with open(os.path.join(store, 'gaps.bed')) as f:
+        assert f.read() == 'chr1\t4\t1204\n'
+
+    assert prep_reference(str(source), store, gaps=True, verify=True) == ref
+    assert len(linked) == 8
+
+
+def test_changed_fasta_rebuilds_dependents(tmp_path, monkeypatch):
+    source, store = source_dir(tmp_path), str(tmp_path / 'store')
+    linked = counting_links(monkeypatch)
+    prep_reference(str(source), store, bwa=False, gaps=True)
+
+    # Same size and modification time, different content
+    fasta = source / REF_ROOT
+    stat = os.stat(fasta)
+    fasta.write_text(fasta.read_text().replace('ACGT', 'NNNN'))
+    os.utime(fasta, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+    prep_reference(str(source), store, bwa=False, gaps=True)
+    assert len(linked) == 3
+
+    prep_reference(str(source), store, bwa=False, gaps=True, verify=True)
+    assert linked[3:] == [REF_ROOT, REF_ROOT+'.fai',
+                          REF_ROOT.split('.')[0]+'.dict']
+    with open(os.path.join(store, 'gaps.bed')) as f:
+        assert f.read() == 'chr1\t0\t1208\n'
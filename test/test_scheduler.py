@@ -0,0 +1,89 @@
+import threading
+import time
+import sys
+import os
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+from scheduler import make_target, resolve, run_targets
+
+
+def recorder():
+    """
+    Returns a list of target names in the order they ran,
+    and a factory of target functions appending to it
+    """
+
+    ran = []
+
+    def func(name, error=None):
+        def run():
+            ran.append(name)
+            if error is not None:
+                raise error
+        return run
+
+    return ran, func
+
+
+def test_resolve_orders_dependencies_first():
+    targets = {n: make_target(n, None, deps) for n, deps in
+               [('a', []), ('b', ['a']), ('c', ['a', 'b'])]}
+
+    assert resolve(targets, ['c']) == ['a', 'b', 'c']
+    with pytest.raises(KeyError):
+        resolve(targets, ['d'])
+
+
+def test_resolve_rejects_cycles():
+    targets = {'a': make_target('a', None, ['c']),
+               'b': make_target('b', None, ['a']),
+               'c': make_target('c', None, ['b'])}
+
+    with pytest.raises(ValueError, match='cycle'):
+        resolve(targets, ['a'])
+
+
+def test_failure_stops_new_targets(capsys):
+    ran, func = recorder()
+    targets = {'a': make_target('a', func('a', RuntimeError('boom'))),
+               'b': make_target('b', func('b'), ['a']),
+               'c': make_target('c', func('c'))}
+
+    assert not run_targets(targets, ['b', 'c'], jobs=1)
+    assert ran == ['a']
+    assert 'RuntimeError: boom' in capsys.readouterr().out
+
+
+def test_up_to_date_targets_are_skipped(tmp_path):
+    ran, func = recorder()
+    src, out = tmp_path / 'in.txt', tmp_path / 'out.txt'
+    src.write_text('')
+    out.write_text('')
+    os.utime(src, (0, 0))
+    targets = {'a': make_target('a', func('a'), [], [str(src)], [str(out)]),
+               'b': make_target('b', func('b'), ['a'])}
+
+    assert run_targets(targets, ['b'])
+    assert ran == ['b']
+
+
+def test_independent_targets_run_together_unless_locked():
+    barrier = threading.Barrier(2, timeout=5)
+    active, peak = [], []
+
+    def locked():
+        active.append(1)
+        peak.append(len(active))
+        time.sleep(0.05)
+        active.pop()
+
+    targets = {'a': make_target('a', barrier.wait),
+               'b': make_target('b', barrier.wait)}
+    assert run_targets(targets, ['a', 'b'], jobs=2)
+
+    targets = {'a': make_target('a', locked, lock='dir'),
+               'b': make_target('b', locked, lock='dir')}
+    assert run_targets(targets, ['a', 'b'], jobs=2)
+    assert peak == [1, 1]
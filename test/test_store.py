@@ -0,0 +1,24 @@
+import sys
+import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+from conftest import write_vcf
+from genotype import unpack_dosages
+from store import build_store, load_store
+
+
+def test_same_named_inputs_keep_their_own_shards(tmp_path):
+    fps = []
+    for batch, gt in [('a', '0|0'), ('b', '1|1')]:
+        (tmp_path / batch).mkdir()
+        fps.append(write_vcf(tmp_path / batch / 'chr1.vcf', ['S1', 'S2'],
+                             [('1', 100, 'A', 'G', [gt, gt]),
+                              ('1', 200, 'C', 'T', [gt, gt])]))
+
+    manifest = build_store(fps, str(tmp_path / 'store'), jobs=1)
+    geno = load_store(str(tmp_path / 'store'))
+
+    names = [s['name'] for s in manifest['shards']]
+    assert len(set(names)) == 2
+    assert unpack_dosages(geno.packed[:], 2).tolist() == [[0, 0], [0, 0],
+                                                          [2, 2], [2, 2]]